@@ -0,0 +1,160 @@
+"""
+近似最近傍（ANN）インデックスモジュール
+企業の埋め込みベクトルを転置ファイル（IVF）方式で索引化し、候補企業を高速に検索する
+"""
+
+import os
+import json
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from similarity import normalize_rows
+
+# 検索時に走査するクラスタ数の既定値（大きいほど再現率が上がり、遅くなる）
+DEFAULT_NPROBE = 8
+
+# k-means の反復回数と、学習に使うクラスタあたりの最大サンプル数
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 256
+
+# クラスタ割り当てを一度に計算する行数
+ASSIGN_CHUNK_SIZE = 4096
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各ベクトルを最も類似度の高いクラスタに割り当てる"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start:start + ASSIGN_CHUNK_SIZE]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def _train_centroids(sample: np.ndarray, n_lists: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """正規化済みのサンプルから球面 k-means でクラスタ中心を学習する"""
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = ~sums.any(axis=1)
+        # 空のクラスタはランダムなサンプルで初期化し直す
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """コサイン類似度の転置ファイルインデックス
+
+    ベクトルは正規化してクラスタごとの連続した float32 配列に格納する。
+    検索時は上位 nprobe 個のクラスタだけを走査するため、nprobe で再現率と速度を調整できる。
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = DEFAULT_NPROBE):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.dim = self.centroids.shape[1]
+        self.nprobe = nprobe
+        self._list_ids = [np.zeros(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._list_vectors = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(len(self.centroids))]
+
+    @classmethod
+    def build(cls, ids: Sequence[int], vectors, n_lists: Optional[int] = None, nprobe: int = DEFAULT_NPROBE,
+              iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> 'IVFIndex':
+        """ベクトル集合からクラスタを学習してインデックスを構築する
+
+        vectors には vector_codec.CompactVectors も渡せる（サンプルとチャンク単位で float32 に復元する）。
+        """
+        n = len(vectors)
+        if n == 0:
+            raise ValueError("インデックスに登録するベクトルがありません。")
+        if n_lists is None:
+            n_lists = int(np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, min(n, n_lists * KMEANS_SAMPLES_PER_LIST), replace=False))
+        index = cls(_train_centroids(normalize_rows(vectors[sample_rows]), n_lists, iterations, rng), nprobe=nprobe)
+
+        # チャンクごとに正規化してクラスタに割り当て、クラスタ順に並べ替えて一度に格納する
+        ids = np.asarray(ids, dtype=np.int64)
+        normalized = np.empty((n, index.dim), dtype=np.float32)
+        for start in range(0, n, ASSIGN_CHUNK_SIZE):
+            normalized[start:start + ASSIGN_CHUNK_SIZE] = normalize_rows(vectors[start:start + ASSIGN_CHUNK_SIZE])
+        assignments = _assign(normalized, index.centroids)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        normalized = normalized[order]
+        for list_no in range(n_lists):
+            rows = slice(offsets[list_no], offsets[list_no + 1])
+            index._list_ids[list_no] = ids[order[rows]]
+            index._list_vectors[list_no] = normalized[rows]
+        return index
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._list_ids)
+
+    def add(self, ids: Sequence[int], vectors, normalized: bool = False):
+        """ベクトルを追加する（同じIDが既にあれば置き換える）"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32) if normalized else normalize_rows(vectors)
+        if len(ids) == 0:
+            return
+        self.delete(ids)
+        assignments = _assign(vectors, self.centroids)
+        for list_no in np.unique(assignments):
+            mask = assignments == list_no
+            self._list_ids[list_no] = np.concatenate([self._list_ids[list_no], ids[mask]])
+            self._list_vectors[list_no] = np.concatenate([self._list_vectors[list_no], vectors[mask]])
+
+    def delete(self, ids: Sequence[int]):
+        """指定したIDのベクトルを削除する"""
+        ids = np.asarray(ids, dtype=np.int64)
+        for list_no, list_ids in enumerate(self._list_ids):
+            if len(list_ids) == 0:
+                continue
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                self._list_ids[list_no] = list_ids[keep]
+                self._list_vectors[list_no] = self._list_vectors[list_no][keep]
+
+    def search(self, vector, k: int = 10, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """クエリベクトルに類似したIDと類似度を降順で返す"""
+        query = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+        ids = np.concatenate([self._list_ids[list_no] for list_no in probe])
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = np.concatenate([self._list_vectors[list_no] @ query for list_no in probe])
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return ids[top], scores[top]
+
+    def save(self, directory: str):
+        """インデックスをディレクトリに保存する（読み込み時にメモリマップできる .npy 形式）"""
+        os.makedirs(directory, exist_ok=True)
+        sizes = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+        np.save(os.path.join(directory, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(directory, 'ids.npy'), np.concatenate(self._list_ids))
+        np.save(os.path.join(directory, 'vectors.npy'), np.concatenate(self._list_vectors))
+        np.save(os.path.join(directory, 'list_sizes.npy'), sizes)
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'nprobe': self.nprobe}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'IVFIndex':
+        """保存したインデックスを読み込む（mmap=True ではベクトルをメモリマップする）"""
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(np.load(os.path.join(directory, 'centroids.npy')), nprobe=meta['nprobe'])
+        ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode)
+        vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode=mmap_mode)
+        offsets = np.concatenate([[0], np.cumsum(np.load(os.path.join(directory, 'list_sizes.npy')))])
+        index._list_ids = [ids[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        index._list_vectors = [vectors[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return index
@@ -8,21 +8,31 @@ import json
 import csv
 import uuid
 import tempfile
-from flask import Flask, request, jsonify, render_template, session
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, render_template, session, stream_with_context
 from werkzeug.utils import secure_filename
 from csv_extractor import extract_company_data_from_csv
-from matching_algorithm import compare_companies, generate_matching_report
+from pipeline import PipelineContext
+from metrics import format_gauge, get_registry
+from report_cache import report_etag
+from jobs import JobQueue, QueueFullError, create_job_store, QUEUED, RUNNING, SUCCEEDED, CANCELLED
+from session_store import create_session_store
+from warmup import start_warmup
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SECRET_KEY", os.urandom(24))
+# マッチング処理（openai・numpy を読み込む）は起動を速くするため各エンドポイント内で読み込み、
+# 起動時のウォームアップで事前に読み込む
+bp = Blueprint('main', __name__)
 
 # OpenAI APIキーの環境変数設定
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     print("警告: OPENAI_API_KEYが設定されていません。環境変数を設定してください。")
 
-# セッションデータを保存するディクショナリ
-session_data = {}
+# セッションデータの保存先（SESSION_BACKEND=memory / sqlite、期限切れのセッションはアップロードファイルごと削除される）
+session_store = create_session_store()
+
+# レポート生成をリクエストスレッドから切り離して実行するジョブキュー
+# （状態と結果は JOB_BACKEND のジョブストアに保存し、sqlite ではどのワーカーからでも参照・取り消しできる）
+job_queue = JobQueue(store=create_job_store())
 
 # アップロードされたファイルの保存先ディレクトリ
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
@@ -35,12 +45,20 @@ ALLOWED_EXTENSIONS = {'csv'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+def _session_context(session_id):
+    """クエリ拡張やHyDEなどの中間生成物をエンドポイント間で共有するコンテキスト（プロセス内に保持し、セッションストアには保存しない）"""
+    return session_store.local(session_id).setdefault('context', PipelineContext())
+
+def _index_directory(filepath):
+    """アップロードファイルの企業の近似最近傍インデックスを保存するディレクトリ"""
+    return f"{filepath}.index"
+
+@bp.route('/')
 def index():
     """メインページを表示"""
     return render_template('index.html')
 
-@app.route('/api/upload_and_match', methods=['POST'])
+@bp.route('/api/upload_and_match', methods=['POST'])
 def upload_and_match():
     """CSVファイルをアップロードしてマッチング分析を開始する"""
     # セッションIDの生成
@@ -69,6 +87,7 @@ def upload_and_match():
     if not allowed_file(file.filename):
         return jsonify({'status': 'error', 'message': 'CSVファイル形式のみ対応しています。'}), 400
     
+    filepath = None
     try:
         # ファイルの保存
         filename = secure_filename(file.filename)
@@ -79,6 +98,7 @@ def upload_and_match():
         company_data = extract_company_data_from_csv(filepath)
         
         if not company_data:
+            os.remove(filepath)
             return jsonify({'status': 'error', 'message': 'CSVファイルからデータを抽出できませんでした。ファイル形式を確認してください。'}), 400
         
         # マッチング先企業データの作成
@@ -89,12 +109,13 @@ def upload_and_match():
         }
         
         # セッションデータの保存
-        session_data[session_id] = {
+        session_store.create(session_id, {
             'company_a': company_data,
             'company_b': target_company_data,
+            'filepath': filepath,
             'analysis_results': None,
             'matching_results': None
-        }
+        }, files=[filepath, _index_directory(filepath)])
         
         # 企業情報を返す
         return jsonify({
@@ -110,28 +131,33 @@ def upload_and_match():
         
     except Exception as e:
         print(f"Error: {str(e)}")
+        # 保存済みのアップロードファイルはセッションに登録されないため、ここで削除する
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
         return jsonify({'status': 'error', 'message': f'ファイル処理中にエラーが発生しました: {str(e)}'}), 500
 
-@app.route('/api/analyze_matching', methods=['POST'])
+@bp.route('/api/analyze_matching', methods=['POST'])
 def analyze_matching():
     """マッチング分析を実行する"""
     data = request.json
     session_id = data.get('session_id')
+    session_info = session_store.get(session_id) if session_id else None
     
-    if not session_id or session_id not in session_data:
+    if session_info is None:
         return jsonify({'status': 'error', 'message': 'セッションが無効です。もう一度お試しください。'}), 400
     
     try:
         # セッションデータの取得
-        session_info = session_data[session_id]
         company_a = session_info['company_a']
         company_b = session_info['company_b']
         
+        from matching_algorithm import compare_companies
+        
         # 企業間の比較分析（実際のマッチングアルゴリズムを使用）
-        analysis_results = compare_companies(company_a, company_b, api_key=OPENAI_API_KEY)
+        analysis_results = compare_companies(company_a, company_b, api_key=OPENAI_API_KEY, context=_session_context(session_id))
         
         # 分析結果をセッションに保存
-        session_data[session_id]['analysis_results'] = analysis_results
+        session_store.update(session_id, {'analysis_results': analysis_results})
         
         return jsonify({
             'status': 'success',
@@ -142,58 +168,252 @@ def analyze_matching():
         print(f"Error: {str(e)}")
         return jsonify({'status': 'error', 'message': f'分析中にエラーが発生しました: {str(e)}'}), 500
 
-@app.route('/api/matching_results', methods=['POST'])
+def _report_response(report):
+    """ETag 付きでマッチング結果を返す（If-None-Match が一致すれば本文なしの 304 を返す）"""
+    etag = report_etag(report)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({'status': 'success', 'results': report})
+    response.set_etag(etag)
+    # 毎回 ETag で再検証させる
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@bp.route('/api/matching_results', methods=['GET', 'POST'])
 def matching_results():
-    """マッチング結果を取得する"""
-    data = request.json
+    """マッチング結果を取得する
+
+    GET（?session_id=）は生成済みの結果があればそれを返す。
+    If-None-Match が生成済みの結果の ETag と一致する場合は、再生成せずに 304 を返す。
+    """
+    data = request.args if request.method == 'GET' else request.json
     session_id = data.get('session_id')
+    session_info = session_store.get(session_id) if session_id else None
     
-    if not session_id or session_id not in session_data:
+    if session_info is None:
         return jsonify({'status': 'error', 'message': 'セッションが無効です。もう一度お試しください。'}), 400
     
+    stored_results = session_info.get('matching_results')
+    if stored_results is not None and (request.method == 'GET' or request.if_none_match.contains(report_etag(stored_results))):
+        return _report_response(stored_results)
+    
     try:
         # セッションデータの取得
-        session_info = session_data[session_id]
         company_a = session_info['company_a']
         company_b = session_info['company_b']
         
+        from matching_algorithm import generate_matching_report
+        
         # マッチング結果の生成（実際のマッチングアルゴリズムを使用）
-        matching_results = generate_matching_report(company_a, company_b, api_key=OPENAI_API_KEY)
+        matching_results = generate_matching_report(company_a, company_b, api_key=OPENAI_API_KEY, context=_session_context(session_id))
         
         # マッチング結果をセッションに保存
-        session_data[session_id]['matching_results'] = matching_results
+        session_store.update(session_id, {'matching_results': matching_results})
+        
+        return _report_response(matching_results)
+        
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return jsonify({'status': 'error', 'message': f'結果生成中にエラーが発生しました: {str(e)}'}), 500
+
+@bp.route('/api/rank_companies', methods=['POST'])
+def rank_companies_endpoint():
+    """アップロードされたCSVの全企業をマッチング先企業との類似度で順位付けする"""
+    data = request.json
+    session_id = data.get('session_id')
+    session_info = session_store.get(session_id) if session_id else None
+    
+    if session_info is None:
+        return jsonify({'status': 'error', 'message': 'セッションが無効です。もう一度お試しください。'}), 400
+    
+    try:
+        page = max(int(data.get('page', 1)), 1)
+        per_page = min(max(int(data.get('per_page', 20)), 1), 100)
+        # 上位候補をHyDEで再評価する件数（0 の場合は埋め込みのみで順位付け）
+        rerank_top_k = max(int(data.get('rerank_top_k', 0)), 0)
+        # 近似最近傍検索で走査するクラスタ数（大きいほど再現率が上がり遅くなる、省略時はインデックスの既定値）
+        nprobe = max(int(data['nprobe']), 1) if data.get('nprobe') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'ページ指定が不正です。'}), 400
+    
+    try:
+        from company_store import CompanyStore
+        from matching_algorithm import COMPANY_INDEX_MIN_SIZE, build_company_index, rank_companies, rank_companies_cascade
+        
+        # CSVの全企業と順位付けの結果は各ワーカーで条件ごとに一度だけ作成し、埋め込みとともにプロセス内に保持する
+        # （全件の順位付けは大きいため、セッションストアには保存しない）
+        local = session_store.local(session_id)
+        rankings = local.setdefault('rankings', {})
+        ranking_key = (rerank_top_k, nprobe)
+        ranking = rankings.get(ranking_key)
+        if ranking is None:
+            if local.get('companies') is None:
+                local['companies'] = CompanyStore.from_csv(session_info['filepath'])
+            companies = local['companies']
+            if len(companies) == 0:
+                return jsonify({'status': 'error', 'message': 'CSVファイルからデータを抽出できませんでした。ファイル形式を確認してください。'}), 400
+            # 大規模なCSVでは近似最近傍インデックスで候補を検索する（アップロードファイルの隣に保存し、セッションとともに削除される）
+            index = None
+            if len(companies) >= COMPANY_INDEX_MIN_SIZE:
+                index = build_company_index(companies, api_key=OPENAI_API_KEY, directory=_index_directory(session_info['filepath']))
+            if rerank_top_k:
+                ranking = rank_companies_cascade(session_info['company_b'], companies, api_key=OPENAI_API_KEY, rerank_top_k=rerank_top_k,
+                                                 index=index, nprobe=nprobe, context=_session_context(session_id))
+            else:
+                ranking = rank_companies(session_info['company_b'], companies, api_key=OPENAI_API_KEY, index=index, nprobe=nprobe)
+            rankings[ranking_key] = ranking
         
+        start = (page - 1) * per_page
         return jsonify({
             'status': 'success',
-            'results': matching_results
+            'total': ranking['total'],
+            # 近似最近傍検索の場合、ページングできるのは取得した候補の範囲のみ
+            'retrieved': len(ranking['results']),
+            'page': page,
+            'per_page': per_page,
+            'results': ranking['results'][start:start + per_page]
         })
         
     except Exception as e:
         print(f"Error: {str(e)}")
-        return jsonify({'status': 'error', 'message': f'結果生成中にエラーが発生しました: {str(e)}'}), 500
+        return jsonify({'status': 'error', 'message': f'順位付け中にエラーが発生しました: {str(e)}'}), 500
+
+def _run_matching_report_job(session_id, cancel_event=None):
+    """ジョブとしてマッチングレポートを生成し、セッションに保存する"""
+    from matching_algorithm import generate_matching_report
+    
+    session_info = session_store.get(session_id)
+    if session_info is None:
+        raise ValueError("セッションが無効です。もう一度お試しください。")
+    matching_results = generate_matching_report(session_info['company_a'], session_info['company_b'], api_key=OPENAI_API_KEY,
+                                                context=_session_context(session_id), cancel_event=cancel_event)
+    session_store.update(session_id, {'matching_results': matching_results})
+    return matching_results
+
+@bp.route('/api/jobs/matching_results', methods=['POST'])
+def submit_matching_results_job():
+    """マッチングレポート生成ジョブを投入し、ジョブIDを即座に返す"""
+    data = request.json
+    session_id = data.get('session_id')
+    
+    if not session_id or session_id not in session_store:
+        return jsonify({'status': 'error', 'message': 'セッションが無効です。もう一度お試しください。'}), 400
+    
+    try:
+        job_id = job_queue.submit(_run_matching_report_job, session_id, kind='matching_results')
+    except QueueFullError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 429
+    
+    return jsonify({'status': 'success', 'job_id': job_id}), 202
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """ジョブの状態を返す"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'ジョブが見つかりません。'}), 404
+    
+    return jsonify({'status': 'success', 'job': job.to_dict(), 'queue_depth': job_queue.queue_depth()})
+
+@bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """完了したジョブの結果を返す"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'ジョブが見つかりません。'}), 404
+    
+    if job.status in (QUEUED, RUNNING):
+        return jsonify({'status': 'pending', 'job': job.to_dict()}), 202
+    if job.status == CANCELLED:
+        return jsonify({'status': 'error', 'message': 'ジョブは取り消されました。'}), 409
+    if job.status != SUCCEEDED:
+        return jsonify({'status': 'error', 'message': f'結果生成中にエラーが発生しました: {job.error}'}), 500
+    
+    return _report_response(job.result)
+
+@bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """ジョブを取り消す"""
+    if job_queue.get(job_id) is None:
+        return jsonify({'status': 'error', 'message': 'ジョブが見つかりません。'}), 404
+    
+    if not job_queue.cancel(job_id):
+        return jsonify({'status': 'error', 'message': 'ジョブは既に終了しています。'}), 409
+    
+    return jsonify({'status': 'success', 'message': 'ジョブの取り消しを受け付けました。'})
+
+def _sse_event(event, data):
+    """Server-Sent Events 形式のメッセージを作成する"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@bp.route('/api/matching_results/stream', methods=['GET'])
+def matching_results_stream():
+    """マッチング結果の各セクションを、完了した順に Server-Sent Events で送信する"""
+    session_id = request.args.get('session_id')
+    session_info = session_store.get(session_id) if session_id else None
+    
+    if session_info is None:
+        return jsonify({'status': 'error', 'message': 'セッションが無効です。もう一度お試しください。'}), 400
+    
+    from matching_algorithm import stream_matching_report
+    
+    def generate():
+        for event, data in stream_matching_report(session_info['company_a'], session_info['company_b'], api_key=OPENAI_API_KEY,
+                                                  context=_session_context(session_id)):
+            if event == 'report':
+                session_store.update(session_id, {'matching_results': data})
+            if event == 'error':
+                print(f"Error: {data['message']}")
+                data = {'message': f"結果生成中にエラーが発生しました: {data['message']}"}
+            yield _sse_event(event, data)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # セッションクリーンアップ機能（オプション）
-@app.route('/api/cleanup_session', methods=['POST'])
+@bp.route('/api/cleanup_session', methods=['POST'])
 def cleanup_session():
     """不要なセッションデータを削除する"""
     data = request.json
     session_id = data.get('session_id')
     
-    if session_id and session_id in session_data:
-        # セッションデータの削除
-        del session_data[session_id]
-        
-        # 関連ファイルの削除
-        for filename in os.listdir(UPLOAD_FOLDER):
-            if filename.startswith(f"{session_id}_"):
-                try:
-                    os.remove(os.path.join(UPLOAD_FOLDER, filename))
-                except Exception as e:
-                    print(f"Error removing file: {str(e)}")
-                    
+    # セッションデータと関連ファイルの削除
+    if session_id and session_store.delete(session_id):
         return jsonify({'status': 'success', 'message': 'セッションデータがクリーンアップされました。'})
     
     return jsonify({'status': 'success', 'message': 'セッションデータが見つかりませんでした。'})
 
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 形式のメトリクスを返す（LLM・埋め込み呼び出しの所要時間・トークン数・コスト、ジョブキューの状態）"""
+    body = get_registry().render() + format_gauge('matching_job_queue_depth', "実行待ちのジョブ数", job_queue.queue_depth())
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    """プロセスが応答できるかを返す（liveness）"""
+    return jsonify({'status': 'success'})
+
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    """ウォームアップが完了してリクエストを処理できるかを返す（readiness）"""
+    warmup_state = current_app.extensions['warmup']
+    if not warmup_state.is_ready:
+        return jsonify({'status': 'error', 'message': '起動処理中です。', 'warmup': warmup_state.to_dict()}), 503
+    return jsonify({'status': 'success', 'warmup': warmup_state.to_dict()})
+
+def create_app(warm_up=True):
+    """Flask アプリケーションを作成する（warm_up=True でバックグラウンドのウォームアップを開始する）"""
+    flask_app = Flask(__name__)
+    flask_app.secret_key = os.environ.get("SECRET_KEY", os.urandom(24))
+    flask_app.register_blueprint(bp)
+    flask_app.extensions['warmup'] = start_warmup() if warm_up else start_warmup(steps=[])
+    # 期限切れのセッションはアクセスがなくてもアップロードファイルごと定期的に削除する
+    session_store.start_sweeper()
+    return flask_app
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+ベンチマークスクリプト
+スタブバックエンドで API キーなしにマッチングスコア計算・レポート生成・CSV 取り込み・ランキングの処理時間を計測し、
+結果を JSON で出力する
+
+使用例:
+    python benchmark.py --sizes 100,1000,10000 --latency 0.05 --output bench.json
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from typing import Any, Callable, Dict, List
+
+# キャッシュの有無で結果が変わらないように、既定ではキャッシュを無効にして計測する
+os.environ.setdefault('EMBEDDING_CACHE_MAX_ENTRIES', '0')
+for _stage in ('QUERY_EXPANSION', 'HYDE_DOCUMENT', 'PAST_CASES', 'STRATEGIES', 'MATCHING_DETAILS', 'STRUCTURED_REPORT'):
+    os.environ.setdefault(f'COMPLETION_CACHE_TTL_{_stage}', '0')
+os.environ.setdefault('REPORT_CACHE_TTL', '0')
+# スタブの呼び出しがレート制限で待たされないようにする
+os.environ.setdefault('OPENAI_DEFAULT_RPM', '1000000000')
+os.environ.setdefault('OPENAI_DEFAULT_TPM', '1000000000')
+
+import numpy as np
+
+from company_store import CompanyStore
+from matching_algorithm import calculate_matching_score, generate_matching_report, rank_companies
+from model_backend import StubBackend, set_backend
+
+# スタブ使用時に API キーの確認を通すためのダミー値
+STUB_API_KEY = 'stub'
+
+INDUSTRIES = ["製造業", "小売業", "飲食業", "宿泊業", "情報通信業", "建設業", "運輸業", "農業", "医療・福祉", "教育"]
+
+SAMPLE_COMPANY_A = {
+    "company_name": "株式会社サンプル製菓",
+    "industry": "製造業",
+    "business_description": "地元の果物を使用した和菓子の製造・販売。観光客向けの土産物を中心に展開している。"
+}
+
+SAMPLE_COMPANY_B = {
+    "company_name": "サンプル観光ホテル",
+    "industry": "宿泊業",
+    "business_description": "温泉地の旅館を運営。地域の食材を使った料理と体験プログラムを提供している。"
+}
+
+
+def synthetic_companies(count: int, seed: int = 0) -> List[Dict[str, str]]:
+    """ベンチマーク用の企業データを生成する関数"""
+    rng = random.Random(seed)
+    return [
+        {
+            "company_name": f"テスト企業{i}",
+            "industry": rng.choice(INDUSTRIES),
+            "business_description": f"{rng.choice(INDUSTRIES)}向けのサービスを提供する企業{i}。従業員数{rng.randint(5, 500)}名。"
+        }
+        for i in range(count)
+    ]
+
+
+def write_csv(filepath: str, companies: List[Dict[str, str]]):
+    """企業データを CSV ファイルに書き出す関数"""
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["company_name", "industry", "business_description"])
+        writer.writeheader()
+        writer.writerows(companies)
+
+
+def measure(name: str, func: Callable[..., Any], repeat: int, setup: Callable[[], Any] = None, **params) -> Dict[str, Any]:
+    """func を repeat 回実行し、処理時間（ミリ秒）の統計を返す関数
+
+    setup を指定すると実行ごとに呼び出し（計測には含めない）、その戻り値を func に渡す。
+    """
+    durations = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        durations.append((time.perf_counter() - start) * 1000.0)
+    durations = np.array(durations)
+    result = {
+        "name": name,
+        "params": params,
+        "runs": repeat,
+        "mean_ms": round(float(durations.mean()), 3),
+        "p50_ms": round(float(np.percentile(durations, 50)), 3),
+        "p95_ms": round(float(np.percentile(durations, 95)), 3),
+        "min_ms": round(float(durations.min()), 3),
+        "max_ms": round(float(durations.max()), 3)
+    }
+    print(f"{name} {params}: mean {result['mean_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms", file=sys.stderr)
+    return result
+
+
+def run_benchmarks(sizes: List[int], repeat: int) -> List[Dict[str, Any]]:
+    """すべてのベンチマークを実行する関数"""
+    results = [
+        measure("calculate_matching_score", lambda: calculate_matching_score(SAMPLE_COMPANY_A, SAMPLE_COMPANY_B, api_key=STUB_API_KEY), repeat),
+        measure("generate_matching_report", lambda: generate_matching_report(SAMPLE_COMPANY_A, SAMPLE_COMPANY_B, api_key=STUB_API_KEY), repeat)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            companies = synthetic_companies(size)
+            filepath = os.path.join(directory, f"companies_{size}.csv")
+            write_csv(filepath, companies)
+            results.append(measure("csv_ingestion", lambda: CompanyStore.from_csv(filepath), repeat, corpus_size=size))
+
+            # cold: 実行ごとに新しいストア（コーパスの埋め込みを含む） / warm: 埋め込み済みのストアを使い回す
+            results.append(measure("rank_companies_cold", lambda store: rank_companies(SAMPLE_COMPANY_A, store, api_key=STUB_API_KEY, top_k=10), repeat,
+                                   setup=lambda: CompanyStore.from_companies(companies), corpus_size=size))
+            store = CompanyStore.from_companies(companies)
+            rank_companies(SAMPLE_COMPANY_A, store, api_key=STUB_API_KEY, top_k=10)
+            results.append(measure("rank_companies_warm", lambda: rank_companies(SAMPLE_COMPANY_A, store, api_key=STUB_API_KEY, top_k=10), repeat, corpus_size=size))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マッチング処理のベンチマーク（スタブバックエンド使用）")
+    parser.add_argument('--sizes', default='100,1000,10000', help="CSV 取り込み・ランキングの企業数（カンマ区切り）")
+    parser.add_argument('--repeat', type=int, default=5, help="各ベンチマークの実行回数")
+    parser.add_argument('--latency', type=float, default=0.0, help="スタブの応答遅延（秒）")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="応答遅延に加えるランダムな揺らぎの上限（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="スタブが一時的なエラーを返す確率")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="結果の JSON を書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args()
+
+    backend = StubBackend(latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate, seed=args.seed)
+    set_backend(backend)
+    try:
+        results = run_benchmarks([int(size) for size in args.sizes.split(",") if size], args.repeat)
+    finally:
+        set_backend(None)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "backend": {
+            "latency": args.latency,
+            "latency_jitter": args.latency_jitter,
+            "error_rate": args.error_rate,
+            "calls": backend.calls
+        },
+        "results": results
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
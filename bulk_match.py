@@ -0,0 +1,406 @@
+"""
+一括マッチングCLI
+企業台帳（CSV）を並列のバッチで埋め込み、対象企業ごとの上位候補、企業ペアのスコア、
+または台帳内の全企業のパートナー候補（多対多）を JSONL に逐次書き出す
+
+使用例:
+    python bulk_match.py companies.csv --targets targets.csv --output results.jsonl --top-k 20
+    python bulk_match.py companies.csv --pairs pairs.csv --output scores.jsonl --full-score
+    python bulk_match.py companies.csv --partners --output partners.jsonl --top-k 5
+
+- pairs.csv は company_a, company_b 列に企業台帳の company_name を指定する
+- 途中で停止した場合は同じコマンドを再実行すると、チェックポイントから再開する
+  （埋め込みはバッチごとに state-dir に保存され、完了したバッチは再実行時に埋め込み直さない）
+- 埋め込みは内容のハッシュとともに state-dir にコンパクトな形式（EMBEDDING_VECTOR_FORMAT）で保存され、
+  再実行時は内容が変わった行だけを埋め込む
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import uuid
+import hashlib
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from company_store import CompanyStore
+from csv_extractor import DEFAULT_CHUNK_SIZE, detect_encoding, extract_companies_from_csv, iter_company_chunks
+from embedding_cache import cache_key
+from matching_algorithm import EMBEDDING_BATCH_SIZE, company_text, ranking_entry, calculate_matching_score, get_embeddings, iter_partner_pairs
+from rate_limiter import BULK, request_priority
+from similarity import DEFAULT_MEMORY_BUDGET_MB
+from vector_codec import CompactVectors
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# 埋め込み状態の保存先
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'bulk')
+
+# チェックポイントを更新する間隔（処理単位数）
+CHECKPOINT_INTERVAL = 100
+
+# 類似度行列を一度に計算する対象企業数（企業数×この値の float32 行列を確保する）
+TARGET_BLOCK_SIZE = 32
+
+
+def _embed_batch(texts: List[str], api_key: str) -> np.ndarray:
+    """1バッチを一括処理の優先度で埋め込む"""
+    with request_priority(BULK):
+        return get_embeddings(texts, model=EMBEDDING_MODEL, api_key=api_key, stage='corpus_embeddings')
+
+
+def embed_texts(texts: List[str], api_key: str, batch_size: int = EMBEDDING_BATCH_SIZE, workers: int = 4) -> np.ndarray:
+    """テキストをバッチに分けて並列に埋め込む関数（一括処理の優先度で実行する）"""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _embed_batch, batch, api_key) for batch in batches]
+        return np.concatenate([future.result() for future in futures])
+
+
+def _state_paths(state_dir: str) -> Tuple[str, str, str]:
+    """(完了時のキー, 完了時の埋め込み, 実行中に完了したバッチの保存先)"""
+    return os.path.join(state_dir, 'keys.npy'), os.path.join(state_dir, 'vectors'), os.path.join(state_dir, 'batches')
+
+
+def _save_array(path: str, array: np.ndarray):
+    """配列を一時ファイル経由で保存する（途中で停止しても既存のファイルを壊さない）"""
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _save_compact(directory: str, compact: CompactVectors):
+    """コンパクトな埋め込みを一時ディレクトリ経由で保存する"""
+    tmp_dir = directory + '.tmp'
+    compact.save(tmp_dir)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_dir, directory)
+
+
+def _save_batch(batches_dir: str, keys: np.ndarray, compact: CompactVectors):
+    """埋め込みが完了したバッチを保存する（中断した場合も再実行時に再利用される）"""
+    os.makedirs(batches_dir, exist_ok=True)
+    arrays = {'keys': keys, 'codes': compact.codes}
+    if compact.scales is not None:
+        arrays['scales'] = compact.scales
+    path = os.path.join(batches_dir, f"{uuid.uuid4().hex}.npz")
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, format=np.array(compact.format), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def load_state(state_dir: str) -> Dict[bytes, Tuple[CompactVectors, int]]:
+    """保存済みの埋め込みを キー→(埋め込み群, 行) で返す関数
+
+    前回の実行の完了時の埋め込みに加え、中断した実行で埋め込みが完了したバッチも含める。
+    """
+    keys_path, vectors_dir, batches_dir = _state_paths(state_dir)
+    saved: Dict[bytes, Tuple[CompactVectors, int]] = {}
+    if os.path.exists(keys_path) and os.path.exists(os.path.join(vectors_dir, 'meta.json')):
+        vectors = CompactVectors.load(vectors_dir)
+        saved.update((key, (vectors, row)) for row, key in enumerate(np.load(keys_path).tolist()))
+    if os.path.isdir(batches_dir):
+        for name in sorted(os.listdir(batches_dir)):
+            if not name.endswith('.npz'):
+                continue
+            with np.load(os.path.join(batches_dir, name)) as batch:
+                vectors = CompactVectors(batch['codes'], batch['scales'] if 'scales' in batch else None, str(batch['format']))
+                saved.update((key, (vectors, row)) for row, key in enumerate(batch['keys'].tolist()))
+    return saved
+
+
+def save_state(state_dir: str, keys: np.ndarray, compact: CompactVectors):
+    """完了時の埋め込みを保存し、実行中に保存したバッチを削除する関数"""
+    keys_path, vectors_dir, batches_dir = _state_paths(state_dir)
+    os.makedirs(state_dir, exist_ok=True)
+    _save_compact(vectors_dir, compact)
+    _save_array(keys_path, keys)
+    if os.path.isdir(batches_dir):
+        shutil.rmtree(batches_dir)
+
+
+def _restore_embeddings(store: CompanyStore, rows: np.ndarray, keys: np.ndarray, saved: Dict[bytes, Tuple[CompactVectors, int]]) -> int:
+    """保存済みの埋め込みのうち、内容のハッシュが一致する行をストアに設定し、その行数を返す"""
+    groups: Dict[int, Tuple[CompactVectors, List[int], List[int]]] = {}
+    for row, key in zip(rows.tolist(), keys.tolist()):
+        match = saved.get(key)
+        if match is not None:
+            vectors, saved_row = match
+            group = groups.setdefault(id(vectors), (vectors, [], []))
+            group[1].append(row)
+            group[2].append(saved_row)
+
+    restored = 0
+    for vectors, matched_rows, saved_rows in groups.values():
+        compact = vectors.take(np.array(saved_rows, dtype=np.int64))
+        if compact.format == store.vector_format and store.dim in (None, compact.dim):
+            store.set_compact_embeddings(matched_rows, compact)
+        else:
+            # 形式・次元の設定が前回と異なる場合は復元して変換し直す
+            store.set_embeddings(matched_rows, compact.decode())
+        restored += len(matched_rows)
+    return restored
+
+
+def _embed_rows(store: CompanyStore, rows: np.ndarray, keys: np.ndarray, saved: Dict[bytes, Tuple[CompactVectors, int]], api_key: str,
+                batches_dir: str, batch_size: int, workers: int) -> Dict[str, int]:
+    """指定した行（keys は各行の内容のハッシュ）の埋め込みを、保存済みのものは再利用し、
+    それ以外は並列のバッチで取得してバッチごとに保存する"""
+    reused = _restore_embeddings(store, rows, keys, saved)
+    missing = np.flatnonzero(~store.has_embeddings(rows))
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, _embed_batch, [company_text(store[row]) for row in rows[batch]], api_key): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            store.set_embeddings(rows[batch], future.result())
+            _save_batch(batches_dir, keys[batch], store.compact_embeddings().take(rows[batch]))
+    return {'reused': reused, 'embedded': int(len(missing))}
+
+
+def embed_corpus(store: CompanyStore, api_key: str, state_dir: str, batch_size: int = EMBEDDING_BATCH_SIZE, workers: int = 4) -> Dict[str, int]:
+    """企業台帳の埋め込みをストアに設定する関数
+
+    前回の実行で保存した埋め込みのうち、内容のハッシュが一致する行は再利用し、変更・追加された行だけを
+    並列のバッチで埋め込む。バッチごとに埋め込みを保存するため、途中で停止しても完了したバッチは再実行時に再利用される。
+    """
+    keys = np.array([cache_key(EMBEDDING_MODEL, company_text(record)) for record in store], dtype='S16')
+    _, _, batches_dir = _state_paths(state_dir)
+    stats = _embed_rows(store, np.arange(len(store)), keys, load_state(state_dir), api_key, batches_dir, batch_size, workers)
+    if len(store):
+        save_state(state_dir, keys, store.compact_embeddings())
+    return stats
+
+
+def ingest_corpus(filepath: str, api_key: str, state_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE, batch_size: int = EMBEDDING_BATCH_SIZE,
+                  workers: int = 4) -> Tuple[CompanyStore, Dict[str, int]]:
+    """企業台帳の CSV をチャンク単位で読み込みながら埋め込み、ストアと件数を返す関数
+
+    CSV 全体や埋め込みの float32 行列を保持せず、読み込んだチャンクごとに embed_corpus と同じ方法で埋め込む。
+    不正な行は読み込みを中断せず、行番号とエラー内容を標準エラー出力に書き出す。
+    """
+    store = CompanyStore()
+    saved = load_state(state_dir)
+    _, _, batches_dir = _state_paths(state_dir)
+    key_chunks: List[np.ndarray] = []
+    stats = {'reused': 0, 'embedded': 0, 'invalid_rows': 0}
+    for chunk in iter_company_chunks(filepath, chunk_size=chunk_size):
+        for error in chunk['errors']:
+            print(f"{error['line']}行目: {error['message']}", file=sys.stderr)
+        stats['invalid_rows'] += len(chunk['errors'])
+        if not chunk['records']:
+            continue
+        rows = np.array(store.extend(chunk['records']), dtype=np.int64)
+        keys = np.array([cache_key(EMBEDDING_MODEL, company_text(record)) for record in chunk['records']], dtype='S16')
+        key_chunks.append(keys)
+        chunk_stats = _embed_rows(store, rows, keys, saved, api_key, batches_dir, batch_size, workers)
+        stats['reused'] += chunk_stats['reused']
+        stats['embedded'] += chunk_stats['embedded']
+    if len(store):
+        save_state(state_dir, np.concatenate(key_chunks), store.compact_embeddings())
+    return store, stats
+
+
+def _file_signature(path: str) -> str:
+    """入力ファイルの内容のハッシュ"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_checkpoint(path: str, signature: str) -> Optional[Dict[str, Any]]:
+    """同じ入力・設定のチェックポイントがあれば返す関数"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('signature') != signature:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path: str, signature: str, completed: int, output_offset: int):
+    """処理済みの件数と出力ファイルの書き込み位置を保存する関数"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'completed': completed, 'output_offset': output_offset}, f)
+    os.replace(tmp_path, path)
+
+
+def read_pairs(filepath: str, store: CompanyStore) -> Tuple[List[Tuple[int, int]], List[str]]:
+    """ペアのCSVを読み込み、企業台帳の行IDの組に変換する関数"""
+    rows_by_name = {record.company_name: record.row_id for record in store}
+    pairs, errors = [], []
+    with open(filepath, 'r', encoding=detect_encoding(filepath), newline='') as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            names = (row.get('company_a', '').strip(), row.get('company_b', '').strip())
+            missing = [name for name in names if name not in rows_by_name]
+            if missing:
+                errors.append(f"{line_number}行目: 企業台帳に存在しない企業です: {', '.join(missing)}")
+                continue
+            pairs.append((rows_by_name[names[0]], rows_by_name[names[1]]))
+    return pairs, errors
+
+
+def score_targets(store: CompanyStore, targets: List[Dict[str, str]], api_key: str, top_k: int, workers: int) -> Iterator[Dict[str, Any]]:
+    """対象企業ごとに企業台帳から類似度の高い上位 top_k 社を返すジェネレータ"""
+    corpus = store.compact_embeddings()
+    top_k = min(top_k, len(store))
+    target_vectors = embed_texts([company_text(target) for target in targets], api_key, workers=workers)
+    for start in range(0, len(targets), TARGET_BLOCK_SIZE):
+        # 量子化した企業台帳のまま、対象企業のブロックとの類似度行列を計算する
+        similarities = corpus.scores(target_vectors[start:start + TARGET_BLOCK_SIZE])
+        for column, target in enumerate(targets[start:start + TARGET_BLOCK_SIZE]):
+            scores = similarities[:, column]
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            yield {
+                'target': target,
+                'results': [ranking_entry(rank, store[row], float(scores[row])) for rank, row in enumerate(top, start=1)]
+            }
+
+
+def score_pairs(store: CompanyStore, pairs: List[Tuple[int, int]], api_key: str, full_score: bool, workers: int) -> Iterator[Dict[str, Any]]:
+    """企業ペアごとのスコアを返すジェネレータ（full_score では calculate_matching_score を並列に実行する）"""
+    corpus = store.compact_embeddings()
+
+    def entry(pair: Tuple[int, int], score: Optional[int] = None) -> Dict[str, Any]:
+        a, b = pair
+        vectors = corpus.decode([a, b])
+        similarity = float(vectors[0] @ vectors[1])
+        return {
+            'company_a': store[a].to_dict(),
+            'company_b': store[b].to_dict(),
+            'similarity': similarity,
+            'matching_score': score if score is not None else max(min(int(similarity * 100), 100), 0)
+        }
+
+    if not full_score:
+        for pair in pairs:
+            yield entry(pair)
+        return
+
+    def full(pair: Tuple[int, int]) -> int:
+        with request_priority(BULK):
+            return calculate_matching_score(store[pair[0]].to_dict(), store[pair[1]].to_dict(), api_key=api_key)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(pairs), CHECKPOINT_INTERVAL):
+            block = pairs[start:start + CHECKPOINT_INTERVAL]
+            futures = [executor.submit(contextvars.copy_context().run, full, pair) for pair in block]
+            for pair, future in zip(block, futures):
+                yield entry(pair, future.result())
+
+
+def _positive_int(value: str) -> int:
+    """1以上の整数を受け付ける引数の型"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"1以上の整数を指定してください: {value}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企業台帳の一括マッチング（結果は JSONL で出力）")
+    parser.add_argument('corpus', help="企業台帳の CSV（company_name, industry, business_description）")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--targets', help="対象企業の CSV（各社について企業台帳から上位候補を求める）")
+    group.add_argument('--pairs', help="企業ペアの CSV（company_a, company_b に企業名）")
+    group.add_argument('--partners', action='store_true', help="企業台帳内の全企業について、台帳内の上位パートナー候補を求める（多対多）")
+    parser.add_argument('--output', required=True, help="結果の JSONL ファイル")
+    parser.add_argument('--checkpoint', help="チェックポイントファイル（省略時は <output>.checkpoint）")
+    parser.add_argument('--state-dir', help="埋め込みの保存先（省略時は cache/bulk/<企業台帳のファイル名>）")
+    parser.add_argument('--top-k', type=_positive_int, default=10, help="対象企業・企業ごとに出力する候補数")
+    parser.add_argument('--memory-budget-mb', type=float, default=DEFAULT_MEMORY_BUDGET_MB, help="--partners の類似度計算に使う作業メモリの上限（MB）")
+    parser.add_argument('--full-score', action='store_true', help="ペアのスコアを LLM を使う calculate_matching_score で計算する")
+    parser.add_argument('--chunk-size', type=_positive_int, default=DEFAULT_CHUNK_SIZE, help="企業台帳を読み込んで埋め込む単位の行数")
+    parser.add_argument('--batch-size', type=_positive_int, default=EMBEDDING_BATCH_SIZE, help="1リクエストで埋め込むテキスト数")
+    parser.add_argument('--workers', type=_positive_int, default=4, help="並列に実行するリクエスト数")
+    args = parser.parse_args()
+
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+
+    started = time.perf_counter()
+    state_dir = args.state_dir or os.path.join(DEFAULT_STATE_DIR, os.path.splitext(os.path.basename(args.corpus))[0])
+    store, embedding_stats = ingest_corpus(args.corpus, api_key, state_dir, chunk_size=args.chunk_size, batch_size=args.batch_size, workers=args.workers)
+    if len(store) == 0:
+        print("企業台帳に有効な企業データがありません。", file=sys.stderr)
+        sys.exit(1)
+    print(f"埋め込み: {embedding_stats['embedded']} 件を取得、{embedding_stats['reused']} 件を再利用"
+          f"（不正な行 {embedding_stats['invalid_rows']} 件を除外）", file=sys.stderr)
+
+    if args.targets:
+        targets = extract_companies_from_csv(args.targets) or []
+        units = len(targets)
+        options = {'mode': 'targets', 'top_k': args.top_k}
+        input_path = args.targets
+    elif args.pairs:
+        pairs, errors = read_pairs(args.pairs, store)
+        for error in errors:
+            print(error, file=sys.stderr)
+        units = len(pairs)
+        options = {'mode': 'pairs', 'full_score': args.full_score}
+        input_path = args.pairs
+    else:
+        units = len(store)
+        options = {'mode': 'partners', 'top_k': args.top_k}
+        input_path = None
+
+    signature = hashlib.sha256(json.dumps(
+        [_file_signature(args.corpus), _file_signature(input_path) if input_path else None, options], sort_keys=True
+    ).encode('utf-8')).hexdigest()
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path, signature)
+
+    completed = 0
+    if checkpoint is not None and os.path.exists(args.output):
+        # 前回の最後のチェックポイント以降に書き込まれた行は破棄して再計算する
+        completed = checkpoint['completed']
+        with open(args.output, 'r+b') as f:
+            f.truncate(checkpoint['output_offset'])
+        print(f"チェックポイントから再開します（{completed}/{units} 件処理済み）", file=sys.stderr)
+
+    if args.targets:
+        results = score_targets(store, targets[completed:], api_key, args.top_k, args.workers)
+    elif args.pairs:
+        results = score_pairs(store, pairs[completed:], api_key, args.full_score, args.workers)
+    else:
+        results = iter_partner_pairs(store, api_key=api_key, top_k=args.top_k, memory_budget_mb=args.memory_budget_mb, start=completed)
+
+    with open(args.output, 'ab' if completed else 'wb') as f:
+        for result in results:
+            f.write((json.dumps(result, ensure_ascii=False) + "\n").encode('utf-8'))
+            completed += 1
+            if completed % CHECKPOINT_INTERVAL == 0 or completed == units:
+                f.flush()
+                os.fsync(f.fileno())
+                save_checkpoint(checkpoint_path, signature, completed, f.tell())
+
+    # 完了したらチェックポイントは不要
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"{completed} 件を {args.output} に書き出しました（{time.perf_counter() - started:.1f} 秒）", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
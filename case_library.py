@@ -0,0 +1,121 @@
+"""
+過去事例ライブラリモジュール
+協業の成功事例を事前計算済みの埋め込みとベクトルインデックスとともに保存し、HyDE ドキュメントの埋め込みで類似事例を検索する
+
+ライブラリの作成:
+    python case_library.py cases.json --output data/case_library
+
+cases.json は title, date, description, roi を持つ事例のリスト。埋め込みの取得には OPENAI_API_KEY が必要。
+"""
+
+import os
+import json
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ann_index import IVFIndex
+
+# ライブラリの保存先（CASE_LIBRARY_DIR で変更可能）
+DEFAULT_LIBRARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'case_library')
+
+# 返す事例の件数
+DEFAULT_TOP_K = 2
+
+CASE_FIELDS = ('title', 'date', 'description', 'roi')
+
+
+def case_text(case: Dict[str, str]) -> str:
+    """事例を埋め込み用のテキストに変換する関数"""
+    return f"{case['title']} {case['description']}"
+
+
+class CaseLibrary:
+    """過去事例とその埋め込みインデックス"""
+
+    def __init__(self, cases: List[Dict[str, str]], index: IVFIndex, model: str):
+        self.cases = cases
+        self.index = index
+        self.model = model
+
+    @property
+    def dim(self) -> int:
+        return self.index.dim
+
+    def __len__(self) -> int:
+        return len(self.cases)
+
+    @classmethod
+    def build(cls, cases: List[Dict[str, str]], embeddings: np.ndarray, model: str, n_lists: Optional[int] = None) -> 'CaseLibrary':
+        """事例と埋め込み行列からライブラリを構築する"""
+        for i, case in enumerate(cases):
+            missing_fields = [field for field in CASE_FIELDS if not case.get(field)]
+            if missing_fields:
+                raise ValueError(f"事例 {i + 1} に必要なフィールドが含まれていません: {', '.join(missing_fields)}")
+        cases = [{field: str(case[field]) for field in CASE_FIELDS} for case in cases]
+        return cls(cases, IVFIndex.build(np.arange(len(cases)), embeddings, n_lists=n_lists), model)
+
+    def save(self, directory: str):
+        """ライブラリをディレクトリに保存する"""
+        os.makedirs(directory, exist_ok=True)
+        self.index.save(os.path.join(directory, 'index'))
+        with open(os.path.join(directory, 'cases.json'), 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model, 'cases': self.cases}, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'CaseLibrary':
+        """保存したライブラリを読み込む（インデックスのベクトルはメモリマップする）"""
+        with open(os.path.join(directory, 'cases.json'), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['cases'], IVFIndex.load(os.path.join(directory, 'index'), mmap=mmap), data['model'])
+
+    def search(self, vector, k: int = DEFAULT_TOP_K) -> List[Dict[str, Any]]:
+        """クエリベクトルに類似した事例を類似度の降順で返す（similarity を付与）"""
+        ids, scores = self.index.search(vector, k=k, nprobe=len(self.index.centroids))
+        return [{**self.cases[case_id], 'similarity': round(float(score), 4)} for case_id, score in zip(ids, scores)]
+
+
+_default_library: Optional[CaseLibrary] = None
+_default_library_loaded = False
+_default_library_lock = threading.Lock()
+
+
+def get_case_library() -> Optional[CaseLibrary]:
+    """CASE_LIBRARY_DIR のライブラリを読み込んで返す関数（ライブラリがなければ None）"""
+    global _default_library, _default_library_loaded
+    if not _default_library_loaded:
+        with _default_library_lock:
+            if not _default_library_loaded:
+                directory = os.environ.get('CASE_LIBRARY_DIR', DEFAULT_LIBRARY_DIR)
+                if os.path.exists(os.path.join(directory, 'cases.json')):
+                    _default_library = CaseLibrary.load(directory)
+                _default_library_loaded = True
+    return _default_library
+
+
+def main():
+    from matching_algorithm import get_embeddings
+    from rate_limiter import BULK, request_priority
+
+    parser = argparse.ArgumentParser(description="過去事例ライブラリを作成する")
+    parser.add_argument('cases', help="事例のリスト（JSON）")
+    parser.add_argument('--output', default=os.environ.get('CASE_LIBRARY_DIR', DEFAULT_LIBRARY_DIR), help="ライブラリの保存先")
+    parser.add_argument('--model', default="text-embedding-ada-002", help="埋め込みモデル（マッチングで使うモデルと同じにする）")
+    args = parser.parse_args()
+
+    with open(args.cases, 'r', encoding='utf-8') as f:
+        cases = json.load(f)
+    if isinstance(cases, dict):
+        cases = cases.get('cases', [])
+
+    with request_priority(BULK):
+        embeddings = get_embeddings([case_text(case) for case in cases], model=args.model, api_key=os.environ.get('OPENAI_API_KEY'))
+    library = CaseLibrary.build(cases, embeddings, args.model)
+    library.save(args.output)
+    print(f"{len(library)} 件の事例を {args.output} に保存しました。")
+
+
+if __name__ == '__main__':
+    main()
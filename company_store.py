@@ -0,0 +1,197 @@
+"""
+企業データストアモジュール
+企業データを列指向で保持し、埋め込みを行IDで参照できる連続したコンパクトなベクトル行列（正規化済み float32 / float16 / int8）にまとめる
+"""
+
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from ann_index import IVFIndex
+from csv_extractor import DEFAULT_CHUNK_SIZE, iter_company_chunks
+from vector_codec import DEFAULT_FORMAT, CompactVectors
+
+# 埋め込み行列の初期確保行数
+INITIAL_CAPACITY = 1024
+
+
+class CompanyRecord:
+    """企業1社分のレコード（辞書と同じく record['company_name'] で参照できる）"""
+
+    __slots__ = ('row_id', 'company_name', 'industry', 'business_description')
+
+    def __init__(self, row_id: int, company_name: str, industry: str, business_description: str):
+        self.row_id = row_id
+        self.company_name = company_name
+        self.industry = industry
+        self.business_description = business_description
+
+    def __getitem__(self, key: str) -> str:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {
+            'company_name': self.company_name,
+            'industry': self.industry,
+            'business_description': self.business_description
+        }
+
+    def __repr__(self) -> str:
+        return f"CompanyRecord({self.row_id}, {self.company_name!r}, {self.industry!r})"
+
+
+class CompanyStore:
+    """企業データの列指向ストア
+
+    業種は辞書エンコード（業種リスト＋行ごとの int32 コード）し、
+    埋め込みは正規化・量子化（vector_format、dim で次元削減）したコンパクトな形式のみを、
+    行IDでアドレスする1つの連続した行列に格納する。
+    """
+
+    def __init__(self, vector_format: str = DEFAULT_FORMAT, dim: Optional[int] = None):
+        self.vector_format = vector_format
+        self.dim = dim
+        self._names: List[str] = []
+        self._descriptions: List[str] = []
+        self._industries: List[str] = []
+        self._industry_codes_by_name: Dict[str, int] = {}
+        self._industry_codes = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._has_embedding = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        # 埋め込みの近似最近傍インデックス（matching_algorithm.build_company_index で構築し、ストアごとに使い回す）
+        self.ann_index: Optional[IVFIndex] = None
+
+    @classmethod
+    def from_companies(cls, companies: Iterable[Dict[str, str]], **options) -> 'CompanyStore':
+        store = cls(**options)
+        store.extend(companies)
+        return store
+
+    @classmethod
+    def from_csv(cls, filepath: str, chunk_size: int = DEFAULT_CHUNK_SIZE, **options) -> 'CompanyStore':
+        """CSVファイルをチャンク単位で読み込んでストアを作成する（不正な行は除外）"""
+        store = cls(**options)
+        for chunk in iter_company_chunks(filepath, chunk_size=chunk_size):
+            store.extend(chunk['records'])
+        return store
+
+    def _ensure_capacity(self, size: int):
+        capacity = len(self._industry_codes)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self._industry_codes = np.resize(self._industry_codes, capacity)
+        has_embedding = np.zeros(capacity, dtype=bool)
+        has_embedding[:len(self._has_embedding)] = self._has_embedding
+        self._has_embedding = has_embedding
+        if self._codes is not None:
+            codes = np.zeros((capacity, self._codes.shape[1]), dtype=self._codes.dtype)
+            codes[:len(self._codes)] = self._codes
+            self._codes = codes
+        if self._scales is not None:
+            self._scales = np.resize(self._scales, capacity)
+
+    def _industry_code(self, industry: str) -> int:
+        code = self._industry_codes_by_name.get(industry)
+        if code is None:
+            code = len(self._industries)
+            self._industries.append(sys.intern(industry))
+            self._industry_codes_by_name[self._industries[code]] = code
+        return code
+
+    def add(self, company: Dict[str, str]) -> int:
+        """企業を追加して行IDを返す"""
+        row_id = len(self._names)
+        self._ensure_capacity(row_id + 1)
+        self._names.append(company['company_name'])
+        self._descriptions.append(company['business_description'])
+        self._industry_codes[row_id] = self._industry_code(company['industry'])
+        return row_id
+
+    def extend(self, companies: Iterable[Dict[str, str]]) -> List[int]:
+        return [self.add(company) for company in companies]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __getitem__(self, row_id: int) -> CompanyRecord:
+        if row_id < 0:
+            row_id += len(self)
+        if not 0 <= row_id < len(self):
+            raise IndexError(row_id)
+        return CompanyRecord(int(row_id), self._names[row_id], self._industries[self._industry_codes[row_id]], self._descriptions[row_id])
+
+    def __iter__(self) -> Iterator[CompanyRecord]:
+        for row_id in range(len(self)):
+            yield self[row_id]
+
+    @property
+    def industries(self) -> List[str]:
+        """登録されている業種の一覧（業種コード順）"""
+        return list(self._industries)
+
+    @property
+    def industry_codes(self) -> np.ndarray:
+        """行ごとの業種コード"""
+        return self._industry_codes[:len(self)]
+
+    def rows_in_industry(self, industry: str) -> np.ndarray:
+        """指定した業種の行IDを返す"""
+        code = self._industry_codes_by_name.get(industry)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.industry_codes == code)
+
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        """行IDでアドレスする正規化済みの埋め込み行列（float32 に復元したコピー、未設定の行はゼロベクトル）"""
+        compact = self.compact_embeddings()
+        return compact.decode() if compact is not None else None
+
+    def has_embeddings(self, row_ids: Sequence[int]) -> np.ndarray:
+        """指定した行に埋め込みが設定されているかを返す"""
+        return self._has_embedding[np.asarray(row_ids, dtype=np.int64)]
+
+    def missing_embedding_rows(self) -> np.ndarray:
+        """埋め込みが未設定の行IDを返す"""
+        return np.flatnonzero(~self._has_embedding[:len(self)])
+
+    def set_embeddings(self, row_ids: Sequence[int], vectors):
+        """指定した行に埋め込みを設定する（ストアの形式に正規化・量子化して格納する）"""
+        if len(row_ids) == 0:
+            return
+        self.set_compact_embeddings(row_ids, CompactVectors.encode(vectors, self.vector_format, dim=self.dim))
+
+    def set_compact_embeddings(self, row_ids: Sequence[int], compact: CompactVectors):
+        """ストアと同じ形式のコンパクトな埋め込みを、復元せずにそのまま指定した行に設定する"""
+        if compact.format != self.vector_format:
+            raise ValueError("埋め込みの形式がストアと一致しません。")
+        if len(row_ids) == 0:
+            return
+        if self._codes is None:
+            self._codes = np.zeros((len(self._has_embedding), compact.dim), dtype=compact.codes.dtype)
+            if compact.scales is not None:
+                self._scales = np.zeros(len(self._has_embedding), dtype=np.float32)
+        elif compact.dim != self._codes.shape[1]:
+            raise ValueError("埋め込みの次元がストアと一致しません。")
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        self._codes[row_ids] = compact.codes
+        if self._scales is not None:
+            self._scales[row_ids] = compact.scales
+        self._has_embedding[row_ids] = True
+
+    def compact_embeddings(self) -> Optional[CompactVectors]:
+        """行IDでアドレスするコンパクトな埋め込み（ストアの行列を参照し、コピーしない）"""
+        if self._codes is None:
+            return None
+        n = len(self)
+        return CompactVectors(self._codes[:n], self._scales[:n] if self._scales is not None else None, self.vector_format)
@@ -0,0 +1,187 @@
+"""
+LLM 応答キャッシュモジュール
+(モデル, システムプロンプト, ユーザープロンプト, パラメータ) をキーに、
+メモリ上の LRU と任意の SQLite の2段構成で応答テキストを保存する
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# メモリ上に保持する最大件数
+DEFAULT_MAX_ENTRIES = 1024
+
+# ステージごとの有効期限（秒）。0 のステージはキャッシュしない
+DEFAULT_STAGE_TTLS = {
+    'query_expansion': 7 * 24 * 3600,
+    'hyde_document': 0,
+    'past_cases': 0,
+    'strategies': 0,
+    'matching_details': 0,
+    'structured_report': 0,
+}
+
+
+def completion_key(model: str, system_prompt: str, user_prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """リクエスト内容からキャッシュキーを生成する関数"""
+    payload = json.dumps([model, system_prompt, user_prompt, params or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """有効期限付きのスレッドセーフな LRU キャッシュ"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteCompletionStore:
+    """複数ワーカー間で共有できる SQLite の応答キャッシュ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def put(self, key: str, value: str, ttl: float):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+
+    def purge_expired(self):
+        """期限切れのエントリを削除する"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM completions WHERE expires_at < ?", (time.time(),))
+
+
+class CompletionCache:
+    """ステージごとの有効期限とヒット率カウンタを持つ応答キャッシュ"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, sqlite_path: Optional[str] = None,
+                 stage_ttls: Optional[Dict[str, float]] = None):
+        self.memory = LRUCache(max_entries)
+        self.sqlite = SqliteCompletionStore(sqlite_path) if sqlite_path else None
+        self.stage_ttls = dict(DEFAULT_STAGE_TTLS)
+        if stage_ttls:
+            self.stage_ttls.update(stage_ttls)
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+
+    def is_enabled(self, stage: str) -> bool:
+        """ステージがキャッシュ対象かどうかを返す"""
+        return self.stage_ttls.get(stage, 0) > 0
+
+    def _count(self, stage: str, field: str):
+        with self._stats_lock:
+            stats = self._stats.setdefault(stage, {'hits': 0, 'misses': 0})
+            stats[field] += 1
+
+    def get(self, stage: str, key: str) -> Optional[str]:
+        """キャッシュ済みの応答を返す（メモリ → SQLite の順に参照）"""
+        if not self.is_enabled(stage):
+            return None
+        value = self.memory.get(key)
+        if value is None and self.sqlite is not None:
+            value = self.sqlite.get(key)
+            if value is not None:
+                # SQLite でヒットした応答はメモリにも載せる
+                self.memory.put(key, value, self.stage_ttls[stage])
+        self._count(stage, 'hits' if value is not None else 'misses')
+        return value
+
+    def put(self, stage: str, key: str, value: str):
+        """応答をキャッシュに保存する"""
+        if not self.is_enabled(stage):
+            return
+        ttl = self.stage_ttls[stage]
+        self.memory.put(key, value, ttl)
+        if self.sqlite is not None:
+            self.sqlite.put(key, value, ttl)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ステージごとのヒット・ミス数を返す"""
+        with self._stats_lock:
+            return {stage: dict(stats) for stage, stats in self._stats.items()}
+
+
+def _stage_ttls_from_env() -> Dict[str, float]:
+    """COMPLETION_CACHE_TTL_<STAGE> 形式の環境変数からステージごとの有効期限を読み込む"""
+    ttls = {}
+    for stage in DEFAULT_STAGE_TTLS:
+        value = os.environ.get(f"COMPLETION_CACHE_TTL_{stage.upper()}")
+        if value is not None:
+            ttls[stage] = float(value)
+    return ttls
+
+
+_default_cache: Optional[CompletionCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """環境変数の設定に基づくプロセス共通の応答キャッシュを返す関数"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = CompletionCache(
+                    max_entries=int(os.environ.get('COMPLETION_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+                    sqlite_path=os.environ.get('COMPLETION_CACHE_SQLITE_PATH') or None,
+                    stage_ttls=_stage_ttls_from_env()
+                )
+    return _default_cache
@@ -4,7 +4,83 @@ CSVファイルから企業データを抽出するモジュール
 
 import os
 import csv
-from typing import Dict, Any, Optional
+import codecs
+from typing import Dict, Any, Iterator, List, Optional
+
+# 企業データとして必要なフィールド
+REQUIRED_FIELDS = ["company_name", "industry", "business_description"]
+
+# ストリーミング読み込みの既定チャンクサイズ（行数）
+DEFAULT_CHUNK_SIZE = 1000
+
+# 文字コード判定に使う先頭バイト数と、判定候補（日本語のエクスポートで多いもの）
+ENCODING_SAMPLE_SIZE = 64 * 1024
+CANDIDATE_ENCODINGS = ["utf-8", "cp932", "euc_jp"]
+
+def detect_encoding(filepath: str, sample_size: int = ENCODING_SAMPLE_SIZE) -> str:
+    """CSVファイルの文字コードを判定する（BOM付きUTF-8・UTF-8・Shift_JIS(cp932)・EUC-JP）"""
+    with open(filepath, 'rb') as f:
+        sample = f.read(sample_size)
+    
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    
+    # 不正なバイトが最も少ない文字コードを採用する（一部の行だけが壊れているファイルに対応）
+    best_encoding, best_errors = "utf-8", None
+    for encoding in CANDIDATE_ENCODINGS:
+        # サンプル末尾で途切れたマルチバイト文字はエラーにしない
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        errors = decoder.decode(sample, final=len(sample) < sample_size).count('\ufffd')
+        if errors == 0:
+            return encoding
+        if best_errors is None or errors < best_errors:
+            best_encoding, best_errors = encoding, errors
+    
+    return best_encoding
+
+def iter_company_chunks(filepath: str, chunk_size: int = DEFAULT_CHUNK_SIZE, encoding: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """CSVファイルを先頭から順に読み、検証済みの企業データをチャンク単位で返すジェネレータ
+
+    ファイル全体をメモリに読み込まないため、大きな企業台帳でもメモリ使用量は一定に保たれる。
+    不正な行は読み込みを中断せず、行番号とエラー内容を各チャンクの errors に記録する。
+    
+    各チャンクは {"records": [...], "errors": [{"line": 行番号, "message": 内容}]} の形式。
+    """
+    if encoding is None:
+        encoding = detect_encoding(filepath)
+    
+    # 変換できないバイトは置換文字にして、該当行だけをエラーとして扱う
+    with open(filepath, 'r', encoding=encoding, errors='replace', newline='') as f:
+        csv_reader = csv.DictReader(f)
+        
+        missing_fields = [field for field in REQUIRED_FIELDS if field not in (csv_reader.fieldnames or [])]
+        if missing_fields:
+            raise ValueError(f"CSVファイルに必要なフィールドが含まれていません: {', '.join(missing_fields)}")
+        
+        records: List[Dict[str, str]] = []
+        errors: List[Dict[str, Any]] = []
+        for row in csv_reader:
+            line = csv_reader.line_num
+            if None in row:
+                errors.append({"line": line, "message": "列数がヘッダーより多い行です。"})
+                continue
+            
+            company_data = {field: (row.get(field) or "").strip() for field in REQUIRED_FIELDS}
+            empty_fields = [field for field, value in company_data.items() if not value]
+            if empty_fields:
+                errors.append({"line": line, "message": f"必要なフィールドが空です: {', '.join(empty_fields)}"})
+                continue
+            if any('\ufffd' in value for value in company_data.values()):
+                errors.append({"line": line, "message": f"文字コード（{encoding}）として読み取れない文字が含まれています。"})
+                continue
+            
+            records.append(company_data)
+            if len(records) >= chunk_size:
+                yield {"records": records, "errors": errors}
+                records, errors = [], []
+        
+        if records or errors:
+            yield {"records": records, "errors": errors}
 
 def process_csv_file(filepath: str) -> Dict[str, Any]:
     """CSVファイルから企業データを抽出する"""
@@ -25,7 +101,7 @@ def process_csv_file(filepath: str) -> Dict[str, Any]:
             }
         
         # CSVからデータを抽出
-        with open(filepath, 'r', encoding='utf-8') as f:
+        with open(filepath, 'r', encoding=detect_encoding(filepath), newline='') as f:
             csv_reader = csv.DictReader(f)
             # 最初の行を取得
             try:
@@ -37,8 +113,7 @@ def process_csv_file(filepath: str) -> Dict[str, Any]:
                 }
             
             # 必要なフィールドが存在するか確認
-            required_fields = ["company_name", "industry", "business_description"]
-            missing_fields = [field for field in required_fields if field not in first_row]
+            missing_fields = [field for field in REQUIRED_FIELDS if field not in first_row]
             
             if missing_fields:
                 return {
@@ -64,6 +139,44 @@ def process_csv_file(filepath: str) -> Dict[str, Any]:
             "message": f"CSVファイルの処理中にエラーが発生しました: {str(e)}"
         }
 
+def process_csv_rows(filepath: str) -> Dict[str, Any]:
+    """CSVファイルの全行から企業データを抽出する（不正な行は除外し、errors に記録する）"""
+    try:
+        if not os.path.exists(filepath):
+            return {
+                "status": "error",
+                "message": "ファイルが見つかりません。"
+            }
+        
+        companies = []
+        errors = []
+        for chunk in iter_company_chunks(filepath):
+            companies.extend(chunk["records"])
+            errors.extend(chunk["errors"])
+        
+        if not companies:
+            return {
+                "status": "error",
+                "message": "CSVファイルにデータが含まれていません。"
+            }
+        
+        return {
+            "status": "success",
+            "data": companies,
+            "errors": errors
+        }
+    
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"CSVファイルの処理中にエラーが発生しました: {str(e)}"
+        }
+
 def extract_company_data_from_csv(filepath: str) -> Optional[Dict[str, str]]:
     """CSVファイルから企業データを抽出する関数（アプリケーション用インターフェース）"""
     result = process_csv_file(filepath)
@@ -75,6 +188,16 @@ def extract_company_data_from_csv(filepath: str) -> Optional[Dict[str, str]]:
         print(f"Error extracting data from CSV: {result['message']}")
         return None
 
+def extract_companies_from_csv(filepath: str) -> Optional[List[Dict[str, str]]]:
+    """CSVファイルから全企業のデータを抽出する関数（アプリケーション用インターフェース）"""
+    result = process_csv_rows(filepath)
+    
+    if result["status"] == "success":
+        return result["data"]
+    else:
+        print(f"Error extracting data from CSV: {result['message']}")
+        return None
+
 # テスト用コード
 if __name__ == "__main__":
     # テスト用のCSVファイルパス
@@ -0,0 +1,236 @@
+"""
+埋め込みベクトルのディスクキャッシュモジュール
+(モデル, テキスト) のハッシュをキーに、メモリマップした行列へ埋め込みを保存する
+（float32、または EMBEDDING_VECTOR_FORMAT に従い正規化した float16 / int8）
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from vector_codec import DEFAULT_FORMAT, FORMAT_DTYPES, CompactVectors
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間ロックを行わない
+    fcntl = None
+
+# キャッシュの保存先と上限件数（モデルごと）
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'embeddings')
+DEFAULT_MAX_ENTRIES = 20000
+
+# キーのダイジェスト長（バイト）
+KEY_SIZE = 16
+
+# meta ファイルの各フィールドの位置
+_META_CAPACITY = 0
+_META_DIM = 1
+_META_COUNT = 2
+_META_GENERATION = 3
+
+
+def cache_key(model: str, text: str) -> bytes:
+    """モデル名とテキストからキャッシュキーを生成する関数"""
+    return hashlib.blake2b(f"{model}\0{text}".encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+
+# ベクトル形式ごとのベクトル行列のファイル名
+VECTOR_FILES = {'float32': 'vectors.f32', 'float16': 'vectors.f16', 'int8': 'vectors.i8'}
+
+
+class _ModelShard:
+    """1モデル分のキャッシュファイル群（ベクトル行列・キー索引・最終アクセス時刻、int8 では行ごとのスケール）"""
+
+    def __init__(self, directory: str, dim: int, capacity: int, vector_format: str = 'float32'):
+        self.directory = directory
+        self.format = vector_format
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, 'lock')
+        self._slots: Dict[bytes, int] = {}
+        self._generation = -1
+
+        with self.file_lock(exclusive=True):
+            meta_path = os.path.join(directory, 'meta.i8')
+            if os.path.exists(meta_path):
+                # 既存キャッシュの容量と次元を優先する
+                self.meta = np.memmap(meta_path, dtype=np.int64, mode='r+', shape=(4,))
+                capacity = int(self.meta[_META_CAPACITY])
+                dim = int(self.meta[_META_DIM])
+                mode = 'r+'
+            else:
+                mode = 'w+'
+            self.capacity = capacity
+            self.dim = dim
+            self.vectors = np.memmap(os.path.join(directory, VECTOR_FILES[vector_format]), dtype=FORMAT_DTYPES[vector_format], mode=mode, shape=(capacity, dim))
+            self.scales = np.memmap(os.path.join(directory, 'scales.f32'), dtype=np.float32, mode=mode, shape=(capacity,)) if vector_format == 'int8' else None
+            self.keys = np.memmap(os.path.join(directory, 'keys.bin'), dtype=np.uint8, mode=mode, shape=(capacity, KEY_SIZE))
+            self.access = np.memmap(os.path.join(directory, 'access.f64'), dtype=np.float64, mode=mode, shape=(capacity,))
+            if mode == 'w+':
+                # meta は最後に作成し、途中状態のキャッシュを他プロセスに見せない
+                self.meta = np.memmap(meta_path, dtype=np.int64, mode='w+', shape=(4,))
+                self.meta[:] = [capacity, dim, 0, 0]
+                self.meta.flush()
+
+    @contextmanager
+    def file_lock(self, exclusive: bool = False):
+        """プロセス間で共有するファイルロックを取得する"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _sync(self):
+        """他プロセスの書き込みがあればキー索引を再構築する"""
+        generation = int(self.meta[_META_GENERATION])
+        if generation == self._generation:
+            return
+        count = int(self.meta[_META_COUNT])
+        raw = self.keys[:count].tobytes()
+        self._slots = {raw[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(count)}
+        self._generation = generation
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        with self.file_lock():
+            self._sync()
+            now = time.time()
+            results = []
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    results.append(None)
+                    continue
+                self.access[slot] = now
+                vector = self.vectors[slot].astype(np.float32)
+                if self.scales is not None:
+                    vector *= self.scales[slot]
+                results.append(vector)
+            return results
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray):
+        if self.format != 'float32':
+            compact = CompactVectors.encode(vectors, self.format)
+            vectors, scales = compact.codes, compact.scales
+        else:
+            scales = None
+        with self.file_lock(exclusive=True):
+            self._sync()
+            now = time.time()
+            for position, (key, vector) in enumerate(zip(keys, vectors)):
+                slot = self._slots.get(key)
+                if slot is None:
+                    count = int(self.meta[_META_COUNT])
+                    if count < self.capacity:
+                        slot = count
+                        self.meta[_META_COUNT] = count + 1
+                    else:
+                        # 上限に達したら最も長く使われていないエントリを置き換える
+                        slot = int(np.argmin(self.access))
+                        self._slots.pop(self.keys[slot].tobytes(), None)
+                    self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                    self._slots[key] = slot
+                self.vectors[slot] = vector
+                if scales is not None:
+                    self.scales[slot] = scales[position]
+                self.access[slot] = now
+            self.meta[_META_GENERATION] += 1
+            self._generation = int(self.meta[_META_GENERATION])
+
+    def __len__(self) -> int:
+        return int(self.meta[_META_COUNT])
+
+
+class EmbeddingCache:
+    """モデルごとにシャードを持つ埋め込みキャッシュ（複数ワーカー間で共有可能）
+
+    vector_format が float16 / int8 の場合は正規化・量子化して保存し、取得時に float32 に戻す。
+    形式ごとに別のシャードを使う。
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES, vector_format: str = DEFAULT_FORMAT):
+        if vector_format not in VECTOR_FILES:
+            raise ValueError(f"未対応のベクトル形式です: {vector_format}")
+        self.directory = directory
+        self.max_entries = max_entries
+        self.vector_format = vector_format
+        self._shards: Dict[str, _ModelShard] = {}
+        self._lock = threading.RLock()
+
+    def _shard_dir(self, model: str) -> str:
+        name = model if self.vector_format == 'float32' else f"{model}@{self.vector_format}"
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.@-]', '_', name))
+
+    def _get_shard(self, model: str, dim: Optional[int] = None) -> Optional[_ModelShard]:
+        shard = self._shards.get(model)
+        if shard is not None:
+            return shard
+        directory = self._shard_dir(model)
+        if dim is None and not os.path.exists(os.path.join(directory, 'meta.i8')):
+            return None
+        shard = _ModelShard(directory, dim or 0, self.max_entries, self.vector_format)
+        self._shards[model] = shard
+        return shard
+
+    def preload(self, model: str) -> bool:
+        """モデルのキャッシュファイルを事前にメモリマップする（キャッシュがあれば True）"""
+        with self._lock:
+            return self._get_shard(model) is not None
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """複数テキストの埋め込みをキャッシュから取得する（未登録は None）"""
+        with self._lock:
+            shard = self._get_shard(model)
+            if shard is None:
+                return [None] * len(texts)
+            return shard.get_many([cache_key(model, text) for text in texts])
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """埋め込みをキャッシュから取得する"""
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors):
+        """複数テキストの埋め込みをキャッシュに保存する"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        with self._lock:
+            shard = self._get_shard(model, dim=vectors.shape[1])
+            if shard.dim != vectors.shape[1]:
+                # 次元が異なるベクトルは保存しない
+                return
+            shard.put_many([cache_key(model, text) for text in texts], vectors)
+
+    def put(self, model: str, text: str, vector):
+        """埋め込みをキャッシュに保存する"""
+        self.put_many(model, [text], np.asarray(vector, dtype=np.float32)[np.newaxis, :])
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """環境変数の設定に基づくプロセス共通の埋め込みキャッシュを返す関数
+
+    EMBEDDING_CACHE_MAX_ENTRIES=0 でキャッシュを無効化できる。
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                max_entries = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+                if max_entries <= 0:
+                    return None
+                directory = os.environ.get('EMBEDDING_CACHE_DIR', DEFAULT_CACHE_DIR)
+                _default_cache = EmbeddingCache(directory, max_entries)
+    return _default_cache
@@ -0,0 +1,349 @@
+"""
+バックグラウンドジョブ管理モジュール
+レポート生成などの時間のかかる処理を上限付きのワーカープールで実行し、状態・結果・取り消しを管理する
+ジョブの状態と結果はジョブストア（JOB_BACKEND=memory / sqlite）に保存し、sqlite では全ワーカーから参照・取り消しできる
+"""
+
+import os
+import time
+import uuid
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# ジョブを実行するワーカー数と、待機中・実行中ジョブの上限
+DEFAULT_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 2))
+DEFAULT_MAX_QUEUE_DEPTH = int(os.environ.get('JOB_MAX_QUEUE_DEPTH', 20))
+
+# 完了したジョブを保持する件数と期間（秒）
+DEFAULT_MAX_FINISHED_JOBS = 200
+DEFAULT_FINISHED_JOB_TTL = 3600
+
+# 他のワーカーからの取り消し要求を確認する間隔（秒）
+CANCEL_POLL_INTERVAL = float(os.environ.get('JOB_CANCEL_POLL_INTERVAL', 1.0))
+
+# ジョブの状態
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class QueueFullError(Exception):
+    """待機中のジョブが上限に達している場合の例外"""
+
+
+class Job:
+    """1件のジョブの状態"""
+
+    def __init__(self, job_id: str, kind: str):
+        self.job_id = job_id
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        # 実行中のジョブに取り消しを伝えるイベント（処理側で定期的に確認する）
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+
+class JobStore:
+    """ジョブの状態の保存先の共通インターフェース"""
+
+    # 他のプロセスと共有されるか（共有される場合は取り消し要求をポーリングで確認する）
+    shared = False
+
+    def add(self, job: Job):
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def start(self, job_id: str) -> bool:
+        """待機中のジョブを実行中にする（取り消し済み・削除済みであれば False）"""
+        raise NotImplementedError
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> bool:
+        """待機中のジョブは取り消し済みにし、実行中のジョブには取り消しを要求する（終了済み・未登録は False）"""
+        raise NotImplementedError
+
+    def cancel_requested(self, job_ids: Iterable[str]) -> List[str]:
+        """取り消しが要求されているジョブのIDを返す"""
+        raise NotImplementedError
+
+    def prune(self, max_finished_jobs: int, finished_job_ttl: float):
+        """古い完了済みジョブを削除する"""
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """プロセス内メモリのジョブストア（単一ワーカー向け）"""
+
+    def __init__(self):
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job: Job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def start(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = RUNNING
+            job.started_at = time.time()
+            return True
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.status = status
+                job.result = result
+                job.error = error
+                job.finished_at = time.time()
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING):
+                return False
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            return True
+
+    def cancel_requested(self, job_ids: Iterable[str]) -> List[str]:
+        with self._lock:
+            return [job_id for job_id in job_ids if job_id in self._jobs and self._jobs[job_id].cancel_event.is_set()]
+
+    def prune(self, max_finished_jobs: int, finished_job_ttl: float):
+        now = time.time()
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished_at is not None]
+            excess = len(finished) - max_finished_jobs
+            for job in finished:
+                if excess > 0 or now - job.finished_at > finished_job_ttl:
+                    del self._jobs[job.job_id]
+                    excess -= 1
+
+
+class SqliteJobStore(JobStore):
+    """複数ワーカー間で共有できる SQLite のジョブストア（結果は pickle で保存する）"""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL, result BLOB, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def add(self, job: Job):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (job_id, kind, status, created_at) VALUES (?, ?, ?, ?)",
+                         (job.job_id, job.kind, job.status, job.created_at))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT kind, status, created_at, started_at, finished_at, result, error FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = Job(job_id, row[0])
+        job.status, job.created_at, job.started_at, job.finished_at = row[1:5]
+        job.result = pickle.loads(row[5]) if row[5] is not None else None
+        job.error = row[6]
+        return job
+
+    def start(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ? AND status = ?",
+                                (RUNNING, time.time(), job_id, QUEUED)).rowcount > 0
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                         (status, pickle.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+    def cancel(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            if conn.execute("UPDATE jobs SET status = ?, finished_at = ?, cancel_requested = 1 WHERE job_id = ? AND status = ?",
+                            (CANCELLED, time.time(), job_id, QUEUED)).rowcount:
+                return True
+            return conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?",
+                                (job_id, RUNNING)).rowcount > 0
+
+    def cancel_requested(self, job_ids: Iterable[str]) -> List[str]:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({','.join('?' * len(job_ids))})",
+                                job_ids).fetchall()
+        return [row[0] for row in rows]
+
+    def prune(self, max_finished_jobs: int, finished_job_ttl: float):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - finished_job_ttl,))
+            conn.execute(
+                "DELETE FROM jobs WHERE job_id IN ("
+                "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (max_finished_jobs,)
+            )
+
+
+def create_job_store() -> JobStore:
+    """環境変数 JOB_BACKEND（memory / sqlite、省略時は SESSION_BACKEND と同じ）に基づいてジョブストアを作成する関数"""
+    backend = os.environ.get('JOB_BACKEND', os.environ.get('SESSION_BACKEND', 'memory')).lower()
+    if backend == 'sqlite':
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'jobs.db')
+        return SqliteJobStore(os.environ.get('JOB_DB_PATH', default_path))
+    if backend == 'memory':
+        return MemoryJobStore()
+    raise ValueError(f"未対応のジョブバックエンドです: {backend}")
+
+
+class JobQueue:
+    """上限付きのワーカープールでジョブを実行するキュー
+
+    ジョブはこのプロセスのワーカープールで実行し、状態と結果はジョブストアに保存する。
+    共有のジョブストアでは、どのワーカーからでも状態・結果の取得と取り消しができる
+    （他のワーカーで実行中のジョブへの取り消しは CANCEL_POLL_INTERVAL ごとに確認して伝える）。
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH,
+                 max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS, finished_job_ttl: float = DEFAULT_FINISHED_JOB_TTL,
+                 store: Optional[JobStore] = None, cancel_poll_interval: float = CANCEL_POLL_INTERVAL):
+        self.max_queue_depth = max_queue_depth
+        self.max_finished_jobs = max_finished_jobs
+        self.finished_job_ttl = finished_job_ttl
+        self.store = store if store is not None else MemoryJobStore()
+        self.cancel_poll_interval = cancel_poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        # このプロセスで待機中・実行中のジョブ（取り消しイベントと Future を持つ）
+        self._local: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def submit(self, func: Callable[..., Any], *args, kind: str = 'job', **kwargs) -> str:
+        """ジョブを投入してジョブIDを返す
+
+        func はキーワード引数 cancel_event（threading.Event）を受け取り、
+        セットされていれば処理を中断できる。
+        """
+        self.store.prune(self.max_finished_jobs, self.finished_job_ttl)
+        with self._lock:
+            if len(self._local) >= self.max_queue_depth:
+                raise QueueFullError("処理待ちのジョブが上限に達しています。しばらくしてから再度お試しください。")
+            job = Job(str(uuid.uuid4()), kind)
+            self.store.add(job)
+            self._local[job.job_id] = job
+            job.future = self._executor.submit(self._run, job, func, args, kwargs)
+        if self.store.shared:
+            self._start_poller()
+        return job.job_id
+
+    def _run(self, job: Job, func: Callable[..., Any], args, kwargs):
+        try:
+            if not self.store.start(job.job_id):
+                return
+            try:
+                result = func(*args, cancel_event=job.cancel_event, **kwargs)
+            except CancelledError:
+                status, result, error = CANCELLED, None, None
+            except Exception as e:
+                print(f"Error in job {job.job_id}: {str(e)}")
+                status, result, error = FAILED, None, str(e)
+            else:
+                status, error = (CANCELLED, None) if job.cancel_event.is_set() else (SUCCEEDED, None)
+            self.store.finish(job.job_id, status, result if status == SUCCEEDED else None, error)
+        finally:
+            with self._lock:
+                self._local.pop(job.job_id, None)
+
+    def _start_poller(self):
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(target=self._poll_cancellations, name='job-cancel-poller', daemon=True)
+            self._poller.start()
+
+    def _poll_cancellations(self):
+        """他のワーカーから要求された取り消しを、このプロセスで実行中のジョブに伝える"""
+        while not self._stopped.wait(self.cancel_poll_interval):
+            with self._lock:
+                local = dict(self._local)
+            if not local:
+                continue
+            try:
+                for job_id in self.store.cancel_requested(local):
+                    local[job_id].cancel_event.set()
+            except Exception as e:
+                print(f"Error polling job cancellations: {str(e)}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """ジョブを取り消す（待機中は即座に、実行中は次のステージ境界で中断される）"""
+        if not self.store.cancel(job_id):
+            return False
+        with self._lock:
+            job = self._local.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+            if job.future.cancel():
+                # 実行前に取り消されたジョブは _run が呼ばれないため、ここで管理対象から外す
+                with self._lock:
+                    self._local.pop(job_id, None)
+        return True
+
+    def queue_depth(self) -> int:
+        """このプロセスで待機中・実行中のジョブ数を返す"""
+        with self._lock:
+            return len(self._local)
+
+    def shutdown(self, wait: bool = True):
+        self._stopped.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -5,21 +5,113 @@ OpenAI APIを使用した企業間マッチング分析
 
 import os
 import json
+import time
+import queue
+import threading
+import contextvars
 import numpy as np
-from openai import OpenAI
-from typing import List, Dict, Any, Union
+import openai
+from concurrent.futures import CancelledError
+from typing import List, Dict, Any, Callable, Iterator, Tuple, Union
+from company_store import CompanyStore
+from completion_cache import completion_key, get_completion_cache
+from embedding_cache import get_embedding_cache
+from model_backend import ChatResult, Usage, get_backend
+from metrics import ReportMetrics, collect_report_metrics, record_call, record_fallback
+from rate_limiter import estimate_tokens, get_scheduler
+from pipeline import PipelineContext, Stage, memoize, run_stages
+from ann_index import IVFIndex
+from case_library import get_case_library
+from report_cache import get_report_cache, report_key
+from single_flight import get_single_flight
+from similarity import DEFAULT_MEMORY_BUDGET_MB, all_pairs_top_k, normalize_rows
 
-def get_embedding(text: str, model: str = "text-embedding-ada-002", api_key: str = None) -> List[float]:
-    """テキストのベクトル埋め込みを取得する関数"""
+# 1リクエストで送信する埋め込み対象テキストの最大件数
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 256))
+
+# 企業・HyDEドキュメントの埋め込みに使うモデル
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# 埋め込みの出力次元（text-embedding-3 系のように dimensions 指定に対応したモデルでのみ設定する。未設定ならモデルの既定次元）
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', 0)) or None
+
+# レポート生成モード（multi: セクションごとに LLM を呼び出す / single: 1回の構造化出力でまとめて生成する）
+REPORT_MODE = os.environ.get('REPORT_MODE', 'multi').lower()
+
+# パイプラインの版（プロンプト・スコア計算・ステージ構成を変更したら上げる。レポートキャッシュのキーに含まれる）
+PIPELINE_VERSION = "1"
+
+def embedding_cache_model(model: str) -> str:
+    """埋め込みキャッシュ上のモデル名を返す関数（次元を指定した埋め込みは別のモデルとしてキャッシュする）"""
+    return f"{model}:{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else model
+
+def get_embeddings(texts: List[str], model: str = EMBEDDING_MODEL, api_key: str = None, stage: str = 'embeddings') -> np.ndarray:
+    """複数テキストのベクトル埋め込みをまとめて取得し、行列（テキスト数×次元）で返す関数
+
+    stage は計測メトリクスに記録する呼び出し元の名前。
+    """
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
-    client = OpenAI(api_key=api_key)
-    response = client.embeddings.create(
-        model=model,
-        input=text
-    )
-    return response.data[0].embedding
+    texts = list(texts)
+    vectors: Dict[str, np.ndarray] = {}
+    
+    cache_model = embedding_cache_model(model)
+    
+    # キャッシュ済みの埋め込みはAPIを呼び出さない
+    unique_texts = list(dict.fromkeys(texts))
+    cache = get_embedding_cache()
+    if cache is not None:
+        start = time.perf_counter()
+        for text, cached in zip(unique_texts, cache.get_many(cache_model, unique_texts)):
+            if cached is not None:
+                vectors[text] = cached
+        if vectors:
+            record_call(stage, 'embedding', model, time.perf_counter() - start, cache_hit=True)
+    
+    # 未取得のテキストをバッチ単位で1リクエストにまとめて埋め込む
+    # 他のリクエストが埋め込み中のテキストは重複して送信せず、その結果を待つ
+    missing = [text for text in unique_texts if text not in vectors]
+    if missing:
+        flight = get_single_flight('embedding')
+        led, waiting = flight.claim([(cache_model, text) for text in missing])
+        pending = [text for _, text in led]
+        try:
+            backend = get_backend(api_key)
+            while pending:
+                batch = pending[:EMBEDDING_BATCH_SIZE]
+                estimated_tokens = sum(estimate_tokens(text) for text in batch)
+                retries = []
+                call_start = time.perf_counter()
+                result = get_scheduler().call(
+                    model,
+                    lambda: backend.embed(model, batch, dimensions=EMBEDDING_DIMENSIONS),
+                    estimated_tokens=estimated_tokens,
+                    on_retry=lambda attempt, error: retries.append(attempt)
+                )
+                record_call(stage, 'embedding', model, time.perf_counter() - call_start,
+                            prompt_tokens=result.usage.prompt_tokens if result.usage else estimated_tokens, retries=len(retries))
+                batch_vectors = result.vectors
+                if cache is not None:
+                    cache.put_many(cache_model, batch, batch_vectors)
+                for text, vector in zip(batch, batch_vectors):
+                    vectors[text] = vector
+                    flight.resolve((cache_model, text), vector)
+                pending = pending[len(batch):]
+        except BaseException as e:
+            for text in pending:
+                flight.resolve((cache_model, text), error=e)
+            raise
+        for (_, text), call in waiting.items():
+            vectors[text] = call.wait()
+    
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([vectors[text] for text in texts])
+
+def get_embedding(text: str, model: str = EMBEDDING_MODEL, api_key: str = None) -> List[float]:
+    """テキストのベクトル埋め込みを取得する関数（ディスクキャッシュを優先）"""
+    return get_embeddings([text], model=model, api_key=api_key)[0].tolist()
 
 def cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
     """2つのベクトル間のコサイン類似度を計算する関数"""
@@ -28,12 +120,84 @@ def cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
     norm_b = np.linalg.norm(vec_b)
     return dot_product / (norm_a * norm_b)
 
+# レート制限の見積もりに使う応答トークン数（max_tokens 未指定時）
+COMPLETION_TOKEN_ESTIMATE = 1000
+
+def _chat_completion(stage: str, system_prompt: str, user_prompt: str, api_key: str, model: str = "gpt-4o", on_delta: Callable[[str], None] = None, **params) -> str:
+    """チャット補完を実行して応答テキストを返す関数
+
+    stage ごとに有効期限が設定されていれば、同じリクエストの応答を応答キャッシュから返す。
+    on_delta を渡すとトークンをストリーミングで受信し、受信した断片ごとに呼び出す。
+    所要時間・トークン数・キャッシュヒット・リトライ回数は stage 名で計測メトリクスに記録する。
+    """
+    start = time.perf_counter()
+    cache = get_completion_cache()
+    key = completion_key(model, system_prompt, user_prompt, params)
+    cached = cache.get(stage, key)
+    if cached is not None:
+        record_call(stage, 'chat', model, time.perf_counter() - start, cache_hit=True)
+        if on_delta is not None:
+            on_delta(cached)
+        return cached
+    
+    def request() -> str:
+        backend = get_backend(api_key)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        estimated_tokens = estimate_tokens(system_prompt + user_prompt) + params.get('max_tokens', COMPLETION_TOKEN_ESTIMATE)
+        
+        retries = []
+        on_retry = lambda attempt, error: retries.append(attempt)
+        if on_delta is None:
+            call = lambda: backend.chat(model, messages, **params)
+        else:
+            sent = []
+            
+            def call() -> ChatResult:
+                # ストリームは読み終えるまで同時実行枠を保持し、読み込み中のエラーも再試行の対象にする
+                # （再試行では送信済みの断片と重複しないよう断片を送らず、完成した応答は呼び出し元がまとめて送る）
+                forward = not sent
+                parts = []
+                for delta in backend.chat_stream(model, messages, **params):
+                    parts.append(delta)
+                    if forward:
+                        sent.append(True)
+                        on_delta(delta)
+                content = "".join(parts)
+                # ストリーミングでは使用量が返らないため、文字数から見積もってトークンバケットに反映する
+                return ChatResult(content, Usage(estimate_tokens(system_prompt + user_prompt), estimate_tokens(content)))
+        
+        result = get_scheduler().call(model, call, estimated_tokens=estimated_tokens, on_retry=on_retry)
+        content = result.content.strip()
+        usage = result.usage or Usage(estimate_tokens(system_prompt + user_prompt), estimate_tokens(content))
+        
+        record_call(stage, 'chat', model, time.perf_counter() - start, prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens, retries=len(retries))
+        
+        cache.put(stage, key, content)
+        return content
+    
+    # 同じリクエストが実行中であれば、その応答を待って共有する
+    content, coalesced = get_single_flight('completion').do(key, request)
+    if coalesced and on_delta is not None:
+        on_delta(content)
+    return content
+
+def cosine_similarities(matrix, vector) -> np.ndarray:
+    """行列の各行とベクトルのコサイン類似度をまとめて計算する関数"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    vector = np.asarray(vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+    norms[norms == 0] = 1.0
+    return (matrix @ vector) / norms
+
 def generate_query_expansion(industry: str, business_description: str, api_key: str = None) -> str:
     """業種と事業内容から関連キーワードを生成する関数（クエリ拡張）"""
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
-    client = OpenAI(api_key=api_key)
     prompt = f"""
     以下の業種と事業内容から、ビジネスマッチングに役立つ関連キーワードを10個以内で生成してください。
     業種: {industry}
@@ -42,15 +206,12 @@ def generate_query_expansion(industry: str, business_description: str, api_key:
     関連キーワード（カンマ区切りで）:
     """
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "あなたはビジネスマッチングの専門家です。"},
-            {"role": "user", "content": prompt}
-        ]
+    keywords = _chat_completion(
+        'query_expansion',
+        system_prompt="あなたはビジネスマッチングの専門家です。",
+        user_prompt=prompt,
+        api_key=api_key
     )
-    
-    keywords = response.choices[0].message.content.strip()
     return keywords
 
 def generate_hyde_document(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None) -> str:
@@ -58,7 +219,6 @@ def generate_hyde_document(company_a: Dict[str, str], company_b: Dict[str, str],
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
-    client = OpenAI(api_key=api_key)
     prompt = f"""
     以下の2つの企業の情報から、両社の協業可能性について詳細な分析レポートを作成してください。
     
@@ -80,23 +240,35 @@ def generate_hyde_document(company_a: Dict[str, str], company_b: Dict[str, str],
     5. 成功確率の予測
     """
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "あなたはビジネスマッチングと事業開発の専門家です。"},
-            {"role": "user", "content": prompt}
-        ]
+    hyde_document = _chat_completion(
+        'hyde_document',
+        system_prompt="あなたはビジネスマッチングと事業開発の専門家です。",
+        user_prompt=prompt,
+        api_key=api_key
     )
-    
-    hyde_document = response.choices[0].message.content.strip()
     return hyde_document
 
-def find_similar_past_cases(hyde_document: str, api_key: str = None) -> List[Dict[str, str]]:
-    """HyDEドキュメントに類似した過去の成功事例を検索する関数"""
+def find_similar_past_cases(hyde_document: str, api_key: str = None, hyde_embedding=None, hyde_embedding_model: str = EMBEDDING_MODEL) -> List[Dict[str, str]]:
+    """HyDEドキュメントに類似した過去の成功事例を検索する関数
+
+    過去事例ライブラリ（case_library）があれば、HyDEドキュメントの埋め込みでライブラリを検索する。
+    hyde_embedding を渡すとその埋め込みを再利用する（hyde_embedding_model がライブラリのモデルと異なる場合や
+    次元が合わない場合は、ライブラリのモデルで埋め込み直す）。
+    ライブラリがない場合は LLM で事例を生成する。
+    """
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
-    client = OpenAI(api_key=api_key)
+    library = get_case_library()
+    if library is not None and len(library) > 0:
+        start = time.perf_counter()
+        # 次元が同じでもモデルが異なる埋め込みは比較できない
+        if hyde_embedding is None or hyde_embedding_model != library.model or len(hyde_embedding) != library.dim:
+            hyde_embedding = get_embeddings([hyde_document], model=library.model, api_key=api_key, stage='past_cases')[0]
+        cases = library.search(hyde_embedding)
+        record_call('past_cases', 'retrieval', library.model, time.perf_counter() - start)
+        return cases
+    
     prompt = f"""
     以下の企業間協業分析レポートに類似した過去の成功事例を2つ生成してください。
     各事例には、タイトル、日付、説明、ROI（投資収益率）を含めてください。
@@ -121,17 +293,16 @@ def find_similar_past_cases(hyde_document: str, api_key: str = None) -> List[Dic
     ]
     """
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "あなたはビジネス分析と事例調査の専門家です。JSONフォーマットで出力してください。"},
-            {"role": "user", "content": prompt}
-        ],
+    response_text = _chat_completion(
+        'past_cases',
+        system_prompt="あなたはビジネス分析と事例調査の専門家です。JSONフォーマットで出力してください。",
+        user_prompt=prompt,
+        api_key=api_key,
         response_format={"type": "json_object"}
     )
     
     try:
-        result = json.loads(response.choices[0].message.content.strip())
+        result = json.loads(response_text.strip())
         if "cases" in result:
             return result["cases"]
         else:
@@ -167,50 +338,73 @@ def find_similar_past_cases(hyde_document: str, api_key: str = None) -> List[Dic
             }
         ]
 
-def calculate_matching_score(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None) -> int:
-    """2つの企業間のマッチングスコアを計算する関数"""
-    if not api_key:
-        raise ValueError("API キーが設定されていません。")
-    
-    # 企業情報のテキスト化
-    company_a_text = f"{company_a['company_name']} {company_a['industry']} {company_a['business_description']}"
-    company_b_text = f"{company_b['company_name']} {company_b['industry']} {company_b['business_description']}"
-    
-    # クエリ拡張
-    company_a_keywords = generate_query_expansion(company_a['industry'], company_a['business_description'], api_key)
-    company_b_keywords = generate_query_expansion(company_b['industry'], company_b['business_description'], api_key)
-    
-    # 拡張テキスト
-    company_a_expanded = f"{company_a_text} {company_a_keywords}"
-    company_b_expanded = f"{company_b_text} {company_b_keywords}"
-    
-    # HyDEドキュメントの生成
-    hyde_document = generate_hyde_document(company_a, company_b, api_key)
-    
-    # ベクトル埋め込みの取得
-    company_a_embedding = get_embedding(company_a_expanded, api_key=api_key)
-    company_b_embedding = get_embedding(company_b_expanded, api_key=api_key)
-    hyde_embedding = get_embedding(hyde_document, api_key=api_key)
-    
-    # 類似度の計算
-    similarity_a_hyde = cosine_similarity(company_a_embedding, hyde_embedding)
-    similarity_b_hyde = cosine_similarity(company_b_embedding, hyde_embedding)
-    similarity_a_b = cosine_similarity(company_a_embedding, company_b_embedding)
+def company_text(company: Dict[str, str]) -> str:
+    """企業情報をテキスト化する関数"""
+    return f"{company['company_name']} {company['industry']} {company['business_description']}"
+
+def _score_from_embeddings(company_a_embedding, company_b_embedding, hyde_embedding) -> int:
+    """埋め込みベクトルからマッチングスコア（0-100）を計算する関数"""
+    # 類似度の計算（正規化は一度だけ行い、内積で求める）
+    company_a_vector, company_b_vector, hyde_vector = normalize_rows(np.stack([company_a_embedding, company_b_embedding, hyde_embedding]))
+    similarity_a_hyde = float(company_a_vector @ hyde_vector)
+    similarity_b_hyde = float(company_b_vector @ hyde_vector)
+    similarity_a_b = float(company_a_vector @ company_b_vector)
     
     # マッチングスコアの計算（0-100のスケール）
     matching_score = int((similarity_a_hyde * 0.3 + similarity_b_hyde * 0.3 + similarity_a_b * 0.4) * 100)
     
     # スコアの範囲を調整
-    matching_score = max(min(matching_score, 100), 0)
+    return max(min(matching_score, 100), 0)
+
+def _company_key(company: Dict[str, str]) -> tuple:
+    """企業情報をコンテキストのキーに使える形に変換する関数"""
+    return (company['company_name'], company['industry'], company['business_description'])
+
+def _query_expansion(company: Dict[str, str], api_key: str, context: PipelineContext = None) -> str:
+    """クエリ拡張をコンテキスト内で一度だけ生成する関数"""
+    key = ('query_expansion', company['industry'], company['business_description'])
+    return memoize(context, key, lambda: generate_query_expansion(company['industry'], company['business_description'], api_key))
+
+def _hyde_document(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str, context: PipelineContext = None) -> str:
+    """HyDEドキュメントをコンテキスト内で一度だけ生成する関数"""
+    key = ('hyde_document', _company_key(company_a), _company_key(company_b))
+    return memoize(context, key, lambda: generate_hyde_document(company_a, company_b, api_key))
+
+def _matching_score_stages(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str, context: PipelineContext = None) -> List[Stage]:
+    """マッチングスコア算出のステージ群を生成する関数
+
+    クエリ拡張（A・B）とHyDE生成は互いに独立しているため並列に実行され、
+    埋め込みはそれらの完了後に1リクエストで取得する。
+    各生成物はコンテキストに保存され、同じセッション内で再利用される。
+    """
+    def embeddings(company_a_keywords, company_b_keywords, hyde_document):
+        # 拡張テキスト
+        company_a_expanded = f"{company_text(company_a)} {company_a_keywords}"
+        company_b_expanded = f"{company_text(company_b)} {company_b_keywords}"
+        texts = (company_a_expanded, company_b_expanded, hyde_document)
+        return memoize(context, ('embeddings', texts), lambda: get_embeddings(list(texts), model=EMBEDDING_MODEL, api_key=api_key))
     
-    return matching_score
+    return [
+        Stage('company_a_keywords', lambda: _query_expansion(company_a, api_key, context)),
+        Stage('company_b_keywords', lambda: _query_expansion(company_b, api_key, context)),
+        Stage('hyde_document', lambda: _hyde_document(company_a, company_b, api_key, context)),
+        Stage('embeddings', embeddings, depends_on=['company_a_keywords', 'company_b_keywords', 'hyde_document']),
+        Stage('matching_score', lambda embeddings: _score_from_embeddings(*embeddings), depends_on=['embeddings'])
+    ]
+
+def calculate_matching_score(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None, max_workers: int = None, context: PipelineContext = None) -> int:
+    """2つの企業間のマッチングスコアを計算する関数"""
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    results = run_stages(_matching_score_stages(company_a, company_b, api_key, context), max_workers=max_workers)
+    return results['matching_score']
 
 def generate_strategy_recommendations(company_a: Dict[str, str], company_b: Dict[str, str], matching_score: int, api_key: str = None) -> List[str]:
     """マッチングスコアに基づいた戦略提案を生成する関数"""
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
-    client = OpenAI(api_key=api_key)
     prompt = f"""
     以下の2つの企業の情報とマッチングスコアに基づいて、具体的な協業戦略の提案を4つ生成してください。
     
@@ -229,16 +423,13 @@ def generate_strategy_recommendations(company_a: Dict[str, str], company_b: Dict
     各戦略提案は1文で簡潔に記述し、具体的かつ実行可能なものにしてください。
     """
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "あなたはビジネス戦略と協業の専門家です。"},
-            {"role": "user", "content": prompt}
-        ]
+    strategies_text = _chat_completion(
+        'strategies',
+        system_prompt="あなたはビジネス戦略と協業の専門家です。",
+        user_prompt=prompt,
+        api_key=api_key
     )
     
-    strategies_text = response.choices[0].message.content.strip()
-    
     # 戦略提案をリスト形式に変換
     strategies = []
     for line in strategies_text.split('\n'):
@@ -252,14 +443,14 @@ def generate_strategy_recommendations(company_a: Dict[str, str], company_b: Dict
     # 最大4つの戦略に制限
     return strategies[:4]
 
-def compare_companies(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None) -> Dict[str, str]:
-    """2つの企業を比較分析する関数"""
+def compare_companies(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None, context: PipelineContext = None) -> Dict[str, str]:
+    """2つの企業を比較分析する関数（生成したクエリ拡張はコンテキストに保存される）"""
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
     # クエリ拡張の生成
-    company_a_keywords = generate_query_expansion(company_a['industry'], company_a['business_description'], api_key)
-    company_b_keywords = generate_query_expansion(company_b['industry'], company_b['business_description'], api_key)
+    company_a_keywords = _query_expansion(company_a, api_key, context)
+    company_b_keywords = _query_expansion(company_b, api_key, context)
     
     # 分析結果の生成
     analysis_results = {
@@ -273,27 +464,90 @@ def compare_companies(company_a: Dict[str, str], company_b: Dict[str, str], api_
     
     return analysis_results
 
-def generate_matching_report(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None) -> Dict[str, Any]:
-    """2つの企業間のマッチングレポートを生成する関数"""
+def generate_matching_details(company_a: Dict[str, str], company_b: Dict[str, str], matching_score: int, api_key: str = None, on_delta: Callable[[str], None] = None) -> str:
+    """マッチングスコアに基づいたマッチング詳細を生成する関数（on_delta を渡すとトークン単位で通知する）"""
     if not api_key:
         raise ValueError("API キーが設定されていません。")
     
-    # マッチングスコアの計算
-    matching_score = calculate_matching_score(company_a, company_b, api_key)
+    prompt = f"""
+    以下の2つの企業の情報とマッチングスコアに基づいて、マッチング詳細を3〜4文で簡潔に説明してください。
+    
+    企業A:
+    企業名: {company_a['company_name']}
+    業種: {company_a['industry']}
+    事業内容: {company_a['business_description']}
+    
+    企業B:
+    企業名: {company_b['company_name']}
+    業種: {company_b['industry']}
+    事業内容: {company_b['business_description']}
+    
+    マッチングスコア: {matching_score}%
+    """
+    
+    return _chat_completion(
+        'matching_details',
+        system_prompt="あなたはビジネスマッチングの専門家です。",
+        user_prompt=prompt,
+        api_key=api_key,
+        on_delta=on_delta
+    )
+
+def _structured_report_schema(include_cases: bool) -> Dict[str, Any]:
+    """構造化レポートの JSON スキーマを生成する関数"""
+    properties = {
+        'strategies': {'type': 'array', 'items': {'type': 'string'}},
+        'matching_details': {'type': 'string'}
+    }
+    if include_cases:
+        properties['cases'] = {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {field: {'type': 'string'} for field in ('title', 'date', 'description', 'roi')},
+                'required': ['title', 'date', 'description', 'roi'],
+                'additionalProperties': False
+            }
+        }
+    return {'type': 'object', 'properties': properties, 'required': list(properties), 'additionalProperties': False}
+
+def _validate_structured_report(data: Any, include_cases: bool) -> Dict[str, Any]:
+    """構造化レポートの応答を検証し、レポートのセクションに変換する関数（不正な場合は ValueError）"""
+    if not isinstance(data, dict):
+        raise ValueError("構造化レポートがオブジェクトではありません。")
     
-    # HyDEドキュメントの生成
-    hyde_document = generate_hyde_document(company_a, company_b, api_key)
+    strategies = data.get('strategies')
+    if not isinstance(strategies, list) or not strategies or not all(isinstance(item, str) and item.strip() for item in strategies):
+        raise ValueError("strategies が文字列のリストではありません。")
+    details = data.get('matching_details')
+    if not isinstance(details, str) or not details.strip():
+        raise ValueError("matching_details が空です。")
     
-    # 類似した過去の成功事例の検索
-    past_cases = find_similar_past_cases(hyde_document, api_key)
+    sections = {'strategies': [item.strip() for item in strategies][:4], 'matching_details': details.strip()}
+    if include_cases:
+        cases = data.get('cases')
+        fields = ('title', 'date', 'description', 'roi')
+        if not isinstance(cases, list) or not cases or not all(
+                isinstance(case, dict) and all(isinstance(case.get(field), str) for field in fields) for case in cases):
+            raise ValueError("cases が事例のリストではありません。")
+        sections['past_cases'] = [{field: case[field] for field in fields} for case in cases]
+    return sections
+
+def generate_structured_report(company_a: Dict[str, str], company_b: Dict[str, str], matching_score: int, api_key: str = None, include_cases: bool = True) -> Dict[str, Any]:
+    """戦略提案・マッチング詳細・類似事例を1回の構造化出力（JSON スキーマ）でまとめて生成する関数
+
+    応答がスキーマに合わない場合は ValueError を送出する。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
     
-    # 戦略提案の生成
-    strategies = generate_strategy_recommendations(company_a, company_b, matching_score, api_key)
+    cases_instruction = """
+    3. cases: 両社の協業に類似した過去の成功事例を2つ（title: タイトル, date: YYYY-MM-DD, description: 詳細説明, roi: 投資収益率 XX%）""" if include_cases else ""
     
-    # マッチング詳細の生成
-    client = OpenAI(api_key=api_key)
     prompt = f"""
-    以下の2つの企業の情報とマッチングスコアに基づいて、マッチング詳細を3〜4文で簡潔に説明してください。
+    以下の2つの企業の情報とマッチングスコアに基づいて、次の項目をJSONで出力してください。
+    1. strategies: 具体的かつ実行可能な協業戦略の提案を4つ（各1文で簡潔に）
+    2. matching_details: マッチング詳細の説明（3〜4文で簡潔に）{cases_instruction}
     
     企業A:
     企業名: {company_a['company_name']}
@@ -308,32 +562,467 @@ def generate_matching_report(company_a: Dict[str, str], company_b: Dict[str, str
     マッチングスコア: {matching_score}%
     """
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "あなたはビジネスマッチングの専門家です。"},
-            {"role": "user", "content": prompt}
-        ]
+    response_text = _chat_completion(
+        'structured_report',
+        system_prompt="あなたはビジネスマッチングと協業戦略の専門家です。JSONフォーマットで出力してください。",
+        user_prompt=prompt,
+        api_key=api_key,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "matching_report", "strict": True, "schema": _structured_report_schema(include_cases)}
+        }
     )
     
-    matching_details = response.choices[0].message.content.strip()
-    
-    # マッチングレポートの作成
-    matching_report = {
-        'company_a': {
-            'name': company_a['company_name'],
-            'industry': company_a['industry'],
-            'description': company_a['business_description']
-        },
-        'company_b': {
-            'name': company_b['company_name'],
-            'industry': company_b['industry'],
-            'description': company_b['business_description']
-        },
-        'matching_score': matching_score,
-        'matching_details': matching_details,
-        'past_cases': past_cases,
-        'strategies': strategies
+    try:
+        data = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"構造化レポートのJSON解析に失敗しました: {str(e)}")
+    return _validate_structured_report(data, include_cases)
+
+def _try_structured_report(company_a: Dict[str, str], company_b: Dict[str, str], matching_score: int, api_key: str, include_cases: bool):
+    """構造化レポートを生成し、応答が不正な場合や API エラーの場合は None を返す関数（個別生成にフォールバックするため）
+
+    フォールバックの理由は計測メトリクス（structured_report ステージ）に記録する。それ以外の例外はそのまま送出する。
+    """
+    try:
+        return generate_structured_report(company_a, company_b, matching_score, api_key, include_cases=include_cases)
+    except ValueError:
+        reason = 'invalid_response'
+    except openai.APIError:
+        reason = 'api_error'
+    record_fallback('structured_report', reason)
+    return None
+
+def _matching_report_stages(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str, context: PipelineContext, on_details_delta: Callable[[str], None] = None, mode: str = None) -> List[Stage]:
+    """マッチングレポート生成のステージ群を生成する関数
+
+    mode='single' では戦略提案・マッチング詳細（・類似事例）を1回の構造化出力で生成し、
+    失敗した場合はセクションごとの生成にフォールバックする。
+    """
+    mode = (mode or REPORT_MODE).lower()
+    
+    # スコア算出で取得済みのHyDEドキュメントの埋め込みで類似事例を検索
+    def past_cases(hyde_document, embeddings):
+        return find_similar_past_cases(hyde_document, api_key, hyde_embedding=embeddings[2], hyde_embedding_model=EMBEDDING_MODEL)
+    
+    if mode == 'multi':
+        return _matching_score_stages(company_a, company_b, api_key, context) + [
+            Stage('past_cases', past_cases, depends_on=['hyde_document', 'embeddings']),
+            # 戦略提案とマッチング詳細の生成（スコア確定後に並列実行）
+            Stage('strategies', lambda matching_score: generate_strategy_recommendations(company_a, company_b, matching_score, api_key), depends_on=['matching_score']),
+            Stage('matching_details', lambda matching_score: generate_matching_details(company_a, company_b, matching_score, api_key, on_delta=on_details_delta), depends_on=['matching_score'])
+        ]
+    if mode != 'single':
+        raise ValueError(f"未対応のレポート生成モードです: {mode}")
+    
+    # 過去事例ライブラリがあれば事例は検索で取得し、構造化出力には含めない
+    library = get_case_library()
+    include_cases = library is None or len(library) == 0
+    
+    def matching_details(structured_report, matching_score):
+        if structured_report is None:
+            return generate_matching_details(company_a, company_b, matching_score, api_key, on_delta=on_details_delta)
+        if on_details_delta is not None:
+            on_details_delta(structured_report['matching_details'])
+        return structured_report['matching_details']
+    
+    stages = _matching_score_stages(company_a, company_b, api_key, context) + [
+        Stage('structured_report', lambda matching_score: _try_structured_report(company_a, company_b, matching_score, api_key, include_cases), depends_on=['matching_score']),
+        Stage('strategies', lambda structured_report, matching_score: structured_report['strategies'] if structured_report is not None
+              else generate_strategy_recommendations(company_a, company_b, matching_score, api_key), depends_on=['structured_report', 'matching_score']),
+        Stage('matching_details', matching_details, depends_on=['structured_report', 'matching_score'])
+    ]
+    if include_cases:
+        stages.append(Stage('past_cases', lambda structured_report, hyde_document, embeddings: structured_report['past_cases'] if structured_report is not None
+                            else past_cases(hyde_document, embeddings), depends_on=['structured_report', 'hyde_document', 'embeddings']))
+    else:
+        stages.append(Stage('past_cases', past_cases, depends_on=['hyde_document', 'embeddings']))
+    return stages
+
+def _company_summary(company: Dict[str, str]) -> Dict[str, str]:
+    """レポートに表示する企業情報を作成する関数"""
+    return {
+        'name': company['company_name'],
+        'industry': company['industry'],
+        'description': company['business_description']
     }
+
+def _report_cache_key(company_a: Dict[str, str], company_b: Dict[str, str], mode: str = None) -> str:
+    """レポートキャッシュのキー（生成モードと過去事例の取得方法もパイプラインの版に含める）"""
+    library = get_case_library()
+    version = f"{PIPELINE_VERSION}:{(mode or REPORT_MODE).lower()}:{'library' if library is not None and len(library) > 0 else 'llm'}"
+    return report_key(company_a, company_b, version)
+
+def generate_matching_report(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None, max_workers: int = None, context: PipelineContext = None, cancel_event: threading.Event = None, mode: str = None) -> Dict[str, Any]:
+    """2つの企業間のマッチングレポートを生成する関数
+
+    各ステージは依存関係（DAG）に従って並列実行されるため、
+    レポート生成の所要時間はクリティカルパスの長さに近くなる。
+    context を渡すと、同じセッションで生成済みのクエリ拡張・HyDEドキュメントを再利用する。
+    cancel_event がセットされると、次のステージ境界で処理を中断する。
+    mode で生成モード（multi / single）を指定する（省略時は REPORT_MODE）。
+    同じ企業ペアのレポートがレポートキャッシュにあれば、スコア算出を含むパイプライン全体を実行せずに返す。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    if context is None:
+        context = PipelineContext()
+    
+    report_cache = get_report_cache()
+    cache_key = _report_cache_key(company_a, company_b, mode) if report_cache is not None else None
+    
+    def build_report() -> Dict[str, Any]:
+        results = run_stages(_matching_report_stages(company_a, company_b, api_key, context, mode=mode), max_workers=max_workers, cancel_event=cancel_event)
+        
+        # マッチングレポートの作成
+        matching_report = {
+            'company_a': _company_summary(company_a),
+            'company_b': _company_summary(company_b),
+            'matching_score': results['matching_score'],
+            'matching_details': results['matching_details'],
+            'past_cases': results['past_cases'],
+            'strategies': results['strategies']
+        }
+        if report_cache is not None:
+            report_cache.put(cache_key, matching_report)
+        return matching_report
+    
+    with collect_report_metrics() as report_metrics:
+        cached = report_cache.get(cache_key) if report_cache is not None else None
+        if cached is None:
+            # 同じ企業ペアのレポートを生成中であれば、その完了を待って結果を共有する
+            # （待機中も自身の cancel_event で中断でき、実行中の側が取り消された場合は自身で生成する）
+            matching_report, coalesced = get_single_flight('report').do(cache_key or _report_cache_key(company_a, company_b, mode), build_report,
+                                                                        cancel_event=cancel_event)
+    
+    if cached is not None:
+        return {**cached, 'metrics': {**report_metrics.summary(), 'report_cache_hit': True}}
+    
+    return {**matching_report, 'metrics': {**report_metrics.summary(), 'report_cache_hit': False, 'coalesced': coalesced}}
+
+# ストリーミングで送信するレポートのセクション（スコアを最初に送る）
+REPORT_SECTIONS = ('matching_score', 'past_cases', 'strategies', 'matching_details')
+
+def _replay_report(report: Dict[str, Any], metrics: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """生成済みのレポートの各セクションを stream_matching_report と同じイベントの順で返すジェネレータ"""
+    for section in REPORT_SECTIONS:
+        yield section, report[section]
+    yield 'report', {**report, 'metrics': metrics}
+
+def stream_matching_report(company_a: Dict[str, str], company_b: Dict[str, str], api_key: str = None, max_workers: int = None, context: PipelineContext = None, cancel_event: threading.Event = None, mode: str = None) -> Iterator[Tuple[str, Any]]:
+    """マッチングレポートの各セクションを、ステージの完了順に (イベント名, データ) で返すジェネレータ
+
+    イベントは companies → matching_score → (past_cases / strategies / matching_details_delta / matching_details) → report の順。
+    matching_score より先に完了したセクションは、スコアの送信後にまとめて送る。
+    マッチング詳細は生成中のトークンを matching_details_delta として逐次送る。
+    同じ企業ペアのレポートを生成中であれば、その完了を待って各セクションをまとめて送る。
+    ジェネレータが途中で閉じられた場合はパイプラインを中断する。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    if context is None:
+        context = PipelineContext()
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    
+    companies = {'company_a': _company_summary(company_a), 'company_b': _company_summary(company_b)}
+    report_metrics = ReportMetrics()
+    yield 'companies', companies
+    
+    report_cache = get_report_cache()
+    cache_key = _report_cache_key(company_a, company_b, mode) if report_cache is not None else None
+    cached = report_cache.get(cache_key) if report_cache is not None else None
+    if cached is not None:
+        # キャッシュ済みのレポートは各セクションをまとめて送る
+        yield from _replay_report(cached, {**report_metrics.summary(), 'report_cache_hit': True})
+        return
+    
+    # 同じ企業ペアのレポートを生成中であれば（ストリーミング以外の生成を含む）、その完了を待って各セクションをまとめて送る
+    # （実行中の側が取り消された場合は自身で生成する）
+    flight = get_single_flight('report')
+    flight_key = cache_key or _report_cache_key(company_a, company_b, mode)
+    while True:
+        led, waiting = flight.claim([flight_key])
+        if led:
+            break
+        try:
+            report = waiting[flight_key].wait(cancel_event)
+        except CancelledError:
+            continue
+        except Exception as e:
+            yield 'error', {'message': str(e)}
+            return
+        yield from _replay_report(report, {**report_metrics.summary(), 'report_cache_hit': False, 'coalesced': True})
+        return
+    
+    events = queue.Queue()
+    done = object()
+    
+    def run():
+        try:
+            with collect_report_metrics() as report_metrics:
+                results = run_stages(
+                    _matching_report_stages(company_a, company_b, api_key, context, on_details_delta=lambda delta: events.put(('matching_details_delta', delta)), mode=mode),
+                    max_workers=max_workers,
+                    cancel_event=cancel_event,
+                    on_stage_complete=lambda name, result: events.put((name, result)) if name in REPORT_SECTIONS else None
+                )
+            report = {**companies, **{section: results[section] for section in REPORT_SECTIONS}}
+            if report_cache is not None:
+                report_cache.put(cache_key, report)
+            flight.resolve(flight_key, report)
+            events.put(('report', {**report, 'metrics': {**report_metrics.summary(), 'report_cache_hit': False, 'coalesced': False}}))
+        except BaseException as e:
+            flight.resolve(flight_key, error=e)
+            if isinstance(e, Exception):
+                events.put(('error', {'message': str(e)}))
+        finally:
+            events.put((done, None))
+    
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    worker.start()
+    
+    score_sent = False
+    finished = False
+    held = []
+    try:
+        while True:
+            event, data = events.get()
+            if event is done:
+                finished = True
+                break
+            if event == 'matching_score':
+                score_sent = True
+                yield event, data
+                for held_event in held:
+                    yield held_event
+                held = []
+            elif not score_sent and event in REPORT_SECTIONS + ('matching_details_delta',):
+                held.append((event, data))
+            else:
+                yield event, data
+    finally:
+        # クライアントの切断などで途中終了した場合は残りのステージを実行しない
+        if not finished:
+            cancel_event.set()
+
+# 企業のリスト、または列指向の CompanyStore を受け付ける
+Companies = Union[List[Dict[str, str]], CompanyStore]
+
+def embed_store(store: CompanyStore, api_key: str = None):
+    """CompanyStore の埋め込みが未設定の行だけを埋め込んでストアに保存する関数"""
+    missing = store.missing_embedding_rows()
+    if len(missing):
+        texts = [company_text(store[row_id]) for row_id in missing]
+        store.set_embeddings(missing, get_embeddings(texts, api_key=api_key, stage='corpus_embeddings'))
+
+def company_embeddings(companies: Companies, api_key: str = None) -> np.ndarray:
+    """企業群の埋め込み行列を返す関数
+
+    CompanyStore の場合は未設定の行だけを埋め込んでストアに保存し、float32 に復元した行列を返す。
+    """
+    if isinstance(companies, CompanyStore):
+        embed_store(companies, api_key=api_key)
+        return companies.embeddings
+    return get_embeddings([company_text(company) for company in companies], api_key=api_key, stage='corpus_embeddings')
+
+# 近似最近傍インデックスで候補を絞り込む企業数の下限（これより少ない場合は全件走査の方が速い）
+COMPANY_INDEX_MIN_SIZE = int(os.environ.get('COMPANY_INDEX_MIN_SIZE', 5000))
+
+# インデックスから取得する候補数の既定値（取得件数を指定しない順位付けで使う）
+INDEX_CANDIDATES = int(os.environ.get('INDEX_CANDIDATES', 1000))
+
+def build_company_index(companies: Companies, api_key: str = None, n_lists: int = None, directory: str = None) -> IVFIndex:
+    """企業の埋め込みから近似最近傍インデックスを構築する関数（IDはリスト内の位置・ストアの行ID）
+
+    CompanyStore の場合はストアごとに一度だけ構築してストアに保持し、その後に追加された行はインデックスにも追加する。
+    directory を指定すると保存済みのインデックスを読み込み、なければ構築して保存した上でメモリマップで読み込み直す。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
     
-    return matching_report
\ No newline at end of file
+    if not isinstance(companies, CompanyStore):
+        embeddings = company_embeddings(companies, api_key=api_key)
+        return IVFIndex.build(np.arange(len(companies)), embeddings, n_lists=n_lists)
+    
+    embed_store(companies, api_key=api_key)
+    index = companies.ann_index
+    if index is None:
+        if directory and os.path.exists(os.path.join(directory, 'meta.json')):
+            index = IVFIndex.load(directory)
+        else:
+            # コンパクトな埋め込みはチャンク単位で復元しながら登録する
+            index = IVFIndex.build(np.arange(len(companies)), companies.compact_embeddings(), n_lists=n_lists)
+            if directory:
+                index.save(directory)
+                index = IVFIndex.load(directory)
+        companies.ann_index = index
+    if len(index) < len(companies):
+        index.add(np.arange(len(index), len(companies)), companies.compact_embeddings()[len(index):])
+    return index
+
+def retrieve_candidates(target_company: Dict[str, str], index: IVFIndex, api_key: str = None, k: int = 50, nprobe: int = None) -> List[tuple]:
+    """インデックスから対象企業に類似した候補を検索し、(ID, 類似度) のリストを返す関数
+
+    HyDEスコアリングなどの高コストな処理の前段で、候補企業を絞り込むために使う。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    target_embedding = get_embeddings([company_text(target_company)], api_key=api_key, stage='target_embedding')[0]
+    ids, similarities = index.search(target_embedding, k=k, nprobe=nprobe)
+    return [(int(company_id), float(similarity)) for company_id, similarity in zip(ids, similarities)]
+
+def ranking_entry(rank: int, company: Dict[str, str], similarity: float) -> Dict[str, Any]:
+    """順位付け結果の1件分を作成する関数"""
+    return {
+        'rank': rank,
+        'company_name': company['company_name'],
+        'industry': company['industry'],
+        'business_description': company['business_description'],
+        'similarity': similarity,
+        'matching_score': max(min(int(similarity * 100), 100), 0)
+    }
+
+def rank_companies(target_company: Dict[str, str], companies: Companies, api_key: str = None, top_k: int = None, offset: int = 0, index: IVFIndex = None, nprobe: int = None) -> Dict[str, Any]:
+    """複数の企業を対象企業との類似度で順位付けする関数（1対多マッチング）
+
+    全企業のプロフィールを一括で埋め込み、1回の行列ベクトル積で類似度を計算する。
+    index（build_company_index で構築）を渡した場合、または COMPANY_INDEX_MIN_SIZE 件以上の CompanyStore では
+    全件走査せず、近似最近傍検索で上位を求める（nprobe で再現率と速度を調整する）。
+    この場合 top_k を省略すると上位 INDEX_CANDIDATES 件までを返し、retrieved に取得した候補数を含める。
+    offset と top_k でページングした結果を返す。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    if len(companies) == 0:
+        return {'total': 0, 'offset': offset, 'results': []}
+    
+    if index is None and isinstance(companies, CompanyStore) and len(companies) >= COMPANY_INDEX_MIN_SIZE:
+        index = build_company_index(companies, api_key=api_key)
+    
+    if index is not None:
+        end = offset + (INDEX_CANDIDATES if top_k is None else top_k)
+        candidates = retrieve_candidates(target_company, index, api_key=api_key, k=end, nprobe=nprobe)
+        results = [ranking_entry(rank, companies[company_id], similarity)
+                   for rank, (company_id, similarity) in enumerate(candidates[offset:end], start=offset + 1)]
+        return {'total': len(companies), 'retrieved': len(candidates), 'offset': offset, 'results': results}
+    
+    end = len(companies) if top_k is None else offset + top_k
+    
+    # 対象企業と全企業の埋め込みを取得
+    target_embedding = get_embeddings([company_text(target_company)], api_key=api_key, stage='target_embedding')[0]
+    if isinstance(companies, CompanyStore):
+        # 正規化・量子化済みの埋め込み（EMBEDDING_VECTOR_FORMAT）のまま類似度を計算する
+        embed_store(companies, api_key=api_key)
+        similarities = companies.compact_embeddings().scores(target_embedding)
+    else:
+        similarities = cosine_similarities(company_embeddings(companies, api_key=api_key), target_embedding)
+    
+    # 類似度の降順に並べ替え
+    order = np.argsort(-similarities, kind='stable')
+    results = [ranking_entry(rank, companies[company_index], float(similarities[company_index]))
+               for rank, company_index in enumerate(order[offset:end], start=offset + 1)]
+    
+    return {'total': len(companies), 'offset': offset, 'results': results}
+
+# カスケード方式で1リクエストあたりに許容するLLM呼び出し回数
+CASCADE_LLM_CALL_BUDGET = int(os.environ.get('CASCADE_LLM_CALL_BUDGET', 30))
+
+def rank_companies_cascade(target_company: Dict[str, str], companies: Companies, api_key: str = None, rerank_top_k: int = 10, llm_call_budget: int = None, index: IVFIndex = None, nprobe: int = None, context: PipelineContext = None, max_workers: int = None) -> Dict[str, Any]:
+    """2段階のカスケード方式で企業を順位付けする関数
+
+    1段目ではプロフィールの埋め込みだけで全候補を順位付けし（index を渡した場合や大規模な CompanyStore では
+    rank_companies と同じく近似最近傍インデックスで候補を検索し）、
+    2段目では上位 rerank_top_k 件のみクエリ拡張・HyDEを用いた calculate_matching_score で再評価する。
+    2段目のLLM呼び出し回数は llm_call_budget 以内に抑え、予算を超える候補は1段目のスコアのまま残す。
+    再評価した候補（reranked=True）は rerank_score の降順で常に残りの候補より上位に並ぶ。
+    matching_score は全候補で1段目の埋め込みスコアのままとし、2段目のスコアは rerank_score（再評価していない候補は None）に入れる。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    if llm_call_budget is None:
+        llm_call_budget = CASCADE_LLM_CALL_BUDGET
+    if context is None:
+        context = PipelineContext()
+    
+    # 1段目: 埋め込みのみによる順位付け
+    ranking = rank_companies(target_company, companies, api_key=api_key, index=index, nprobe=nprobe)
+    candidates = ranking['results']
+    
+    # 予算内で再評価できる候補数を決める
+    # 対象企業のクエリ拡張は1回のみ、候補ごとにクエリ拡張とHyDE生成の2回を要する
+    target_calls = 0 if ('query_expansion', target_company['industry'], target_company['business_description']) in context else 1
+    rerank_count = min(rerank_top_k, len(candidates), max((llm_call_budget - target_calls) // 2, 0))
+    
+    # 2段目: 上位候補のみ高コストなスコアリングを並列実行
+    reranked = candidates[:rerank_count]
+    stages = [
+        Stage(str(position), lambda entry=entry: calculate_matching_score(
+            {field: entry[field] for field in ('company_name', 'industry', 'business_description')},
+            target_company, api_key=api_key, context=context))
+        for position, entry in enumerate(reranked)
+    ]
+    scores = run_stages(stages, max_workers=max_workers) if stages else {}
+    
+    # 1段目のスコア（matching_score は類似度×100）と2段目のスコアは尺度が異なるため、再評価のスコアは rerank_score に分けて保持する
+    for position, entry in enumerate(candidates):
+        entry['reranked'] = position < rerank_count
+        entry['rerank_score'] = scores[str(position)] if entry['reranked'] else None
+    
+    # 再評価した候補を rerank_score 順に並べ、その後ろに残りの候補を1段目の順位のまま続ける
+    reranked.sort(key=lambda entry: entry['rerank_score'], reverse=True)
+    results = reranked + candidates[rerank_count:]
+    for rank, entry in enumerate(results, start=1):
+        entry['rank'] = rank
+    
+    cascade = {'total': ranking['total'], 'offset': 0, 'reranked': rerank_count, 'llm_call_budget': llm_call_budget, 'results': results}
+    if 'retrieved' in ranking:
+        cascade['retrieved'] = ranking['retrieved']
+    return cascade
+
+def iter_partner_pairs(companies: Companies, api_key: str = None, top_k: int = 5, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, start: int = 0) -> Iterator[Dict[str, Any]]:
+    """企業コーパス内の各企業について、類似度の高いパートナー候補を順に返すジェネレータ（多対多マッチング）
+
+    全企業の埋め込みを一括取得し、類似度行列をタイル単位で計算して各企業の上位 top_k 件のみを保持する。
+    CompanyStore の場合はコンパクトな埋め込みをタイルごとに復元して計算する。
+    start 以降の企業のみを返す（一括処理の再開用）。
+    """
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+    
+    if len(companies) == 0:
+        return
+    
+    if isinstance(companies, CompanyStore):
+        embed_store(companies, api_key=api_key)
+        indices, scores = all_pairs_top_k(companies.compact_embeddings(), k=top_k, memory_budget_mb=memory_budget_mb, normalized=True)
+    else:
+        indices, scores = all_pairs_top_k(company_embeddings(companies, api_key=api_key), k=top_k, memory_budget_mb=memory_budget_mb)
+    
+    for row in range(start, len(companies)):
+        company = companies[row]
+        partners = []
+        for index, similarity in zip(indices[row], scores[row]):
+            if index < 0:
+                continue
+            partner = companies[index]
+            partners.append({
+                'company_name': partner['company_name'],
+                'industry': partner['industry'],
+                'similarity': float(similarity),
+                'matching_score': max(min(int(similarity * 100), 100), 0)
+            })
+        yield {
+            'company_name': company['company_name'],
+            'industry': company['industry'],
+            'partners': partners
+        }
+
+def find_partner_pairs(companies: Companies, api_key: str = None, top_k: int = 5, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> List[Dict[str, Any]]:
+    """企業コーパス内の全企業について、類似度の高いパートナー候補を求める関数（多対多マッチング）"""
+    return list(iter_partner_pairs(companies, api_key=api_key, top_k=top_k, memory_budget_mb=memory_budget_mb))
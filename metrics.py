@@ -0,0 +1,264 @@
+"""
+計測モジュール
+LLM・埋め込み呼び出しごとの所要時間・トークン数・コスト・キャッシュヒット・リトライ回数を記録し、
+レポート単位の集計と Prometheus 形式のメトリクスを提供する
+"""
+
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from rate_limiter import get_scheduler
+from single_flight import single_flight_groups
+
+# 所要時間のヒストグラムのバケット境界（秒）
+CALL_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REPORT_DURATION_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# モデルごとの料金（USD / 100万トークン、input と output）。OPENAI_MODEL_PRICES に JSON で指定すると上書きできる
+DEFAULT_MODEL_PRICES = {
+    'gpt-4o': {'input': 2.5, 'output': 10.0},
+    'gpt-4o-mini': {'input': 0.15, 'output': 0.6},
+    'text-embedding-ada-002': {'input': 0.1, 'output': 0.0},
+    'text-embedding-3-small': {'input': 0.02, 'output': 0.0},
+    'text-embedding-3-large': {'input': 0.13, 'output': 0.0}
+}
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **json.loads(os.environ.get('OPENAI_MODEL_PRICES', '{}'))}
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """トークン数から API 呼び出しのコスト（USD）を計算する関数（料金が不明なモデルは 0）"""
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price.get('input', 0.0) + completion_tokens * price.get('output', 0.0)) / 1_000_000
+
+
+class CallRecord:
+    """1回の LLM・埋め込み呼び出しの計測値"""
+
+    __slots__ = ('stage', 'kind', 'model', 'duration', 'prompt_tokens', 'completion_tokens', 'cache_hit', 'retries', 'cost')
+
+    def __init__(self, stage: str, kind: str, model: str, duration: float, prompt_tokens: int = 0,
+                 completion_tokens: int = 0, cache_hit: bool = False, retries: int = 0):
+        self.stage = stage
+        self.kind = kind
+        self.model = model
+        self.duration = duration
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cache_hit = cache_hit
+        self.retries = retries
+        self.cost = 0.0 if cache_hit else call_cost(model, prompt_tokens, completion_tokens)
+
+
+class Histogram:
+    """ラベルごとの累積ヒストグラム（Prometheus の histogram 型）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        # バケットごとの件数、合計、件数の順に保持する
+        series = self._series.setdefault(labels, [0.0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            base = _format_labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + (repr(float(bound)),))} {count:g}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + ('+Inf',))} {series[-1]:g}")
+            lines.append(f"{self.name}_sum{base} {series[-2]:g}")
+            lines.append(f"{self.name}_count{base} {series[-1]:g}")
+        return lines
+
+
+class Counter:
+    """ラベルごとの累積カウンタ（Prometheus の counter 型）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def format_gauge(name: str, help_text: str, value: float) -> str:
+    """ラベルなしの gauge を Prometheus 形式で出力する関数"""
+    return f"# HELP {name} {help_text}\n# TYPE {name} gauge\n{name} {value:g}\n"
+
+
+class MetricsRegistry:
+    """プロセス全体の呼び出しメトリクス"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.call_duration = Histogram('matching_llm_call_duration_seconds', "LLM・埋め込み呼び出しの所要時間",
+                                       ('stage', 'kind', 'model', 'cache'), CALL_DURATION_BUCKETS)
+        self.calls = Counter('matching_llm_calls_total', "LLM・埋め込み呼び出し回数", ('stage', 'kind', 'model', 'cache'))
+        self.tokens = Counter('matching_llm_tokens_total', "消費トークン数", ('stage', 'model', 'type'))
+        self.cost = Counter('matching_llm_cost_usd_total', "推定コスト（USD）", ('stage', 'model'))
+        self.retries = Counter('matching_llm_retries_total', "リトライ回数", ('stage', 'model'))
+        self.report_duration = Histogram('matching_report_duration_seconds', "マッチングレポート生成の所要時間",
+                                         (), REPORT_DURATION_BUCKETS)
+        self.fallbacks = Counter('matching_fallbacks_total', "失敗したステージを別の方法で生成し直した回数", ('stage', 'reason'))
+
+    def observe_call(self, record: CallRecord):
+        cache = 'hit' if record.cache_hit else 'miss'
+        with self._lock:
+            self.call_duration.observe((record.stage, record.kind, record.model, cache), record.duration)
+            self.calls.inc((record.stage, record.kind, record.model, cache))
+            if not record.cache_hit:
+                self.tokens.inc((record.stage, record.model, 'prompt'), record.prompt_tokens)
+                self.tokens.inc((record.stage, record.model, 'completion'), record.completion_tokens)
+                self.cost.inc((record.stage, record.model), record.cost)
+            if record.retries:
+                self.retries.inc((record.stage, record.model), record.retries)
+
+    def observe_report(self, duration: float):
+        with self._lock:
+            self.report_duration.observe((), duration)
+
+    def observe_fallback(self, stage: str, reason: str):
+        with self._lock:
+            self.fallbacks.inc((stage, reason))
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式でメトリクスを出力する（スケジューラの統計を含む）"""
+        with self._lock:
+            lines = []
+            for metric in (self.call_duration, self.calls, self.tokens, self.cost, self.retries, self.report_duration, self.fallbacks):
+                lines.extend(metric.render())
+        scheduler = get_scheduler()
+        text = "\n".join(lines) + "\n"
+        for name, value in scheduler.stats.items():
+            text += f"# HELP openai_scheduler_{name}_total スケジューラの {name} 件数\n# TYPE openai_scheduler_{name}_total counter\n"
+            text += f"openai_scheduler_{name}_total {value:g}\n"
+        text += format_gauge('openai_scheduler_concurrency', "スケジューラの現在の同時実行数の上限", scheduler.concurrency)
+        groups = single_flight_groups()
+        for name, help_text in (('executed', "実際に実行した処理の件数"), ('coalesced', "実行中の同じ処理の結果を共有した件数")):
+            text += f"# HELP matching_single_flight_{name}_total {help_text}\n# TYPE matching_single_flight_{name}_total counter\n"
+            for group in groups:
+                text += f"matching_single_flight_{name}_total{_format_labels(('group',), (group.name,))} {group.stats[name]:g}\n"
+        return text
+
+
+class ReportMetrics:
+    """1つのレポート生成中の呼び出しを集計するコレクタ"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._records: List[CallRecord] = []
+        self._fallbacks: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, record: CallRecord):
+        with self._lock:
+            self._records.append(record)
+
+    def add_fallback(self, stage: str, reason: str):
+        with self._lock:
+            self._fallbacks[stage] = reason
+
+    def summary(self) -> Dict[str, Any]:
+        """レポート全体とステージごとの合計を返す"""
+        with self._lock:
+            records = list(self._records)
+            fallbacks = dict(self._fallbacks)
+        duration = self.duration if self.duration is not None else time.perf_counter() - self.started_at
+
+        def totals(items: List[CallRecord]) -> Dict[str, Any]:
+            return {
+                'calls': len(items),
+                'cache_hits': sum(1 for record in items if record.cache_hit),
+                'duration_seconds': round(sum(record.duration for record in items), 3),
+                'prompt_tokens': sum(record.prompt_tokens for record in items if not record.cache_hit),
+                'completion_tokens': sum(record.completion_tokens for record in items if not record.cache_hit),
+                'retries': sum(record.retries for record in items),
+                'cost_usd': round(sum(record.cost for record in items), 6)
+            }
+
+        stages: Dict[str, List[CallRecord]] = {}
+        for record in records:
+            stages.setdefault(record.stage, []).append(record)
+        summary = totals(records)
+        # 呼び出しの所要時間の合計は並列実行のため経過時間を上回ることがある
+        summary['call_duration_seconds'] = summary.pop('duration_seconds')
+        summary['duration_seconds'] = round(duration, 3)
+        summary['models'] = sorted({record.model for record in records})
+        summary['stages'] = {stage: totals(items) for stage, items in stages.items()}
+        # フォールバックしたステージとその理由
+        summary['fallbacks'] = fallbacks
+        return summary
+
+
+_registry = MetricsRegistry()
+_current_report: contextvars.ContextVar = contextvars.ContextVar('report_metrics', default=None)
+
+
+def get_registry() -> MetricsRegistry:
+    """プロセス共通のメトリクスレジストリを返す関数"""
+    return _registry
+
+
+@contextmanager
+def collect_report_metrics() -> Iterator[ReportMetrics]:
+    """ブロック内（パイプラインのステージを含む）の呼び出しを集計する"""
+    report = ReportMetrics()
+    token = _current_report.set(report)
+    try:
+        yield report
+    finally:
+        _current_report.reset(token)
+        report.duration = time.perf_counter() - report.started_at
+        _registry.observe_report(report.duration)
+
+
+def record_call(stage: str, kind: str, model: str, duration: float, prompt_tokens: int = 0,
+                completion_tokens: int = 0, cache_hit: bool = False, retries: int = 0) -> CallRecord:
+    """呼び出し1回の計測値をプロセス全体のメトリクスと実行中のレポートに記録する関数"""
+    record = CallRecord(stage, kind, model, duration, prompt_tokens, completion_tokens, cache_hit, retries)
+    _registry.observe_call(record)
+    report = _current_report.get()
+    if report is not None:
+        report.add(record)
+    return record
+
+
+def record_fallback(stage: str, reason: str):
+    """ステージの失敗により別の方法で生成し直したことをプロセス全体のメトリクスと実行中のレポートに記録する関数"""
+    _registry.observe_fallback(stage, reason)
+    report = _current_report.get()
+    if report is not None:
+        report.add_fallback(stage, reason)
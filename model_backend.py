@@ -0,0 +1,210 @@
+"""
+モデルバックエンドモジュール
+LLM・埋め込みの呼び出し先を切り替えるインターフェースと、OpenAI 実装・オフライン用スタブ実装
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+import numpy as np
+import openai
+
+from openai_client import get_openai_client
+
+
+class Usage:
+    """API 呼び出しのトークン使用量"""
+
+    __slots__ = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class ChatResult:
+    """チャット補完の結果"""
+
+    def __init__(self, content: str, usage: Optional[Usage] = None):
+        self.content = content
+        self.usage = usage
+
+
+class EmbeddingResult:
+    """埋め込みの結果（入力順に並んだ float32 行列）"""
+
+    def __init__(self, vectors: np.ndarray, usage: Optional[Usage] = None):
+        self.vectors = vectors
+        self.usage = usage
+
+
+class ModelBackend:
+    """LLM・埋め込みを提供するバックエンドのインターフェース"""
+
+    def chat(self, model: str, messages: List[Dict[str, str]], **params) -> ChatResult:
+        raise NotImplementedError
+
+    def chat_stream(self, model: str, messages: List[Dict[str, str]], **params) -> Iterator[str]:
+        """応答テキストの断片を順に返すイテレータを返す（接続は呼び出し時に確立する）"""
+        raise NotImplementedError
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int] = None) -> EmbeddingResult:
+        """テキストを埋め込む（dimensions は出力次元の指定に対応したモデルでのみ使用する）"""
+        raise NotImplementedError
+
+
+class OpenAIBackend(ModelBackend):
+    """OpenAI API を使用するバックエンド"""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.client = get_openai_client(api_key, base_url)
+
+    @staticmethod
+    def _usage(usage) -> Optional[Usage]:
+        if usage is None:
+            return None
+        return Usage(usage.prompt_tokens or 0, getattr(usage, 'completion_tokens', 0) or 0)
+
+    def chat(self, model: str, messages: List[Dict[str, str]], **params) -> ChatResult:
+        response = self.client.chat.completions.create(model=model, messages=messages, **params)
+        return ChatResult(response.choices[0].message.content, self._usage(response.usage))
+
+    def chat_stream(self, model: str, messages: List[Dict[str, str]], **params) -> Iterator[str]:
+        stream = self.client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+
+        def deltas():
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        return deltas()
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int] = None) -> EmbeddingResult:
+        params = {'dimensions': dimensions} if dimensions else {}
+        response = self.client.embeddings.create(model=model, input=texts, **params)
+        vectors = np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+        return EmbeddingResult(vectors, self._usage(response.usage))
+
+
+# スタブが返す定型の応答
+STUB_CHAT_RESPONSE = """1. 両社の強みを組み合わせた共同商品の開発と、相互の販路を活用した販売を行う。
+2. 地域の観光資源と連携した体験型プログラムを企画し、新規顧客層を開拓する。
+3. 両社の顧客データを活用し、共同でのマーケティング施策を展開する。
+4. 小規模な実証プロジェクトから開始し、成果に応じて協業範囲を拡大する。"""
+
+STUB_JSON_RESPONSE = {
+    "cases": [
+        {"title": "異業種連携による共同商品開発", "date": "2024-01-15", "description": "スタブ応答の事例です。", "roi": "120%"},
+        {"title": "地域企業の共同プロモーション", "date": "2023-10-01", "description": "スタブ応答の事例です。", "roi": "110%"}
+    ]
+}
+
+STUB_STRUCTURED_RESPONSE = {
+    "strategies": [line[3:] for line in STUB_CHAT_RESPONSE.split("\n")],
+    "matching_details": "両社は地域資源を活かした事業を展開しており、相互の販路と顧客基盤を活用した協業が期待できます。",
+    **STUB_JSON_RESPONSE
+}
+
+
+class StubBackend(ModelBackend):
+    """API キーなしで動作する決定的なスタブバックエンド（ベンチマーク・動作確認用）
+
+    埋め込みはテキストのハッシュから生成した固定ベクトル、チャット補完は定型文を返す。
+    latency（秒）と latency_jitter で応答遅延を、error_rate で一時的なエラー（HTTP 500）の発生率を模擬する。
+    """
+
+    def __init__(self, dim: int = 1536, latency: float = 0.0, latency_jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {'chat': 0, 'embed': 0}
+
+    def _simulate(self, kind: str):
+        with self._lock:
+            self.calls[kind] += 1
+            delay = self.latency + self._random.uniform(0, self.latency_jitter)
+            failed = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            request = httpx.Request('POST', f'https://stub.invalid/{kind}')
+            raise openai.InternalServerError("スタブバックエンドの模擬エラーです。", response=httpx.Response(500, request=request), body=None)
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    @staticmethod
+    def _content(params: Dict[str, Any]) -> str:
+        response_format = params.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            # スキーマに含まれる項目だけを返す
+            properties = response_format['json_schema']['schema'].get('properties', {})
+            return json.dumps({key: value for key, value in STUB_STRUCTURED_RESPONSE.items() if key in properties}, ensure_ascii=False)
+        if response_format.get('type') == 'json_object':
+            return json.dumps(STUB_JSON_RESPONSE, ensure_ascii=False)
+        return STUB_CHAT_RESPONSE
+
+    @staticmethod
+    def _usage(messages: List[Dict[str, str]], content: str) -> Usage:
+        return Usage(sum(len(message['content']) for message in messages), len(content))
+
+    def chat(self, model: str, messages: List[Dict[str, str]], **params) -> ChatResult:
+        self._simulate('chat')
+        content = self._content(params)
+        return ChatResult(content, self._usage(messages, content))
+
+    def chat_stream(self, model: str, messages: List[Dict[str, str]], **params) -> Iterator[str]:
+        self._simulate('chat')
+        content = self._content(params)
+        return iter([content[i:i + 16] for i in range(0, len(content), 16)])
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int] = None) -> EmbeddingResult:
+        self._simulate('embed')
+        vectors = np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        if dimensions and dimensions < self.dim:
+            vectors = vectors[:, :dimensions] / np.linalg.norm(vectors[:, :dimensions], axis=1, keepdims=True)
+        return EmbeddingResult(vectors, Usage(sum(len(text) for text in texts)))
+
+
+_override_backend: Optional[ModelBackend] = None
+_stub_backend: Optional[StubBackend] = None
+_backend_lock = threading.Lock()
+
+
+def set_backend(backend: Optional[ModelBackend]):
+    """すべての呼び出しで使用するバックエンドを差し替える（None で既定に戻す）"""
+    global _override_backend
+    _override_backend = backend
+
+
+def get_backend(api_key: str) -> ModelBackend:
+    """使用するバックエンドを返す関数
+
+    set_backend で差し替えられていればそれを、MODEL_BACKEND=stub であればスタブ
+    （STUB_LATENCY, STUB_ERROR_RATE で設定）を、それ以外は OpenAI バックエンドを返す。
+    """
+    global _stub_backend
+    if _override_backend is not None:
+        return _override_backend
+    if os.environ.get('MODEL_BACKEND', 'openai').lower() == 'stub':
+        with _backend_lock:
+            if _stub_backend is None:
+                _stub_backend = StubBackend(
+                    latency=float(os.environ.get('STUB_LATENCY', 0.0)),
+                    error_rate=float(os.environ.get('STUB_ERROR_RATE', 0.0))
+                )
+        return _stub_backend
+    return OpenAIBackend(api_key)
@@ -0,0 +1,58 @@
+"""
+OpenAI クライアント管理モジュール
+APIキーとベースURLごとにクライアントを1つだけ生成し、HTTP接続をプロセス全体で再利用する
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import OpenAI
+
+# 接続プールの設定（環境変数で上書き可能）
+MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 10))
+KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 60.0))
+REQUEST_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 120.0))
+
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _build_http_client() -> httpx.Client:
+    """keep-alive 接続プールを持つ HTTP クライアントを生成する関数"""
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+    return httpx.Client(limits=limits, timeout=REQUEST_TIMEOUT)
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """APIキーとベースURLに対応する共有クライアントを返す関数（スレッドセーフ）"""
+    if not api_key:
+        raise ValueError("API キーが設定されていません。")
+
+    base_url = base_url or os.environ.get('OPENAI_BASE_URL') or None
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # リトライは rate_limiter のスケジューラで行うため、クライアント側のリトライは無効にする
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=_build_http_client(), max_retries=0)
+            _clients[key] = client
+    return client
+
+
+def close_openai_clients():
+    """共有クライアントをすべて閉じる関数（テストやシャットダウン時に使用）"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
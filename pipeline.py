@@ -0,0 +1,136 @@
+"""
+ステージ実行モジュール
+依存関係（DAG）を持つ処理ステージを、上限付きのスレッドプールで並列実行する
+"""
+
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+# 1パイプラインあたりの最大並列数
+DEFAULT_MAX_WORKERS = int(os.environ.get('PIPELINE_MAX_WORKERS', 4))
+
+
+class PipelineContext:
+    """ステージ間・エンドポイント間で共有する中間生成物（キーワード・HyDE・埋め込みなど）
+
+    同じキーの生成物は1つのコンテキスト内で一度だけ計算される。
+    同時に同じキーが要求された場合は、後続の呼び出しが最初の計算の完了を待つ。
+    """
+
+    def __init__(self):
+        self._values: Dict[Hashable, Any] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """キーに対応する生成物を返し、未計算であれば func で計算して保存する"""
+        if key in self._values:
+            return self._values[key]
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._values:
+                self._values[key] = func()
+            return self._values[key]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # ロックは保存せず、生成物のみをシリアライズする（セッションストア用）
+        return {'_values': dict(self._values)}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__init__()
+        self._values.update(state['_values'])
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self._values.get(key, default)
+
+    def set(self, key: Hashable, value: Any):
+        self._values[key] = value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._values
+
+
+def memoize(context: Optional[PipelineContext], key: Hashable, func: Callable[[], Any]) -> Any:
+    """コンテキストがあれば生成物を再利用し、なければそのまま計算する関数"""
+    if context is None:
+        return func()
+    return context.get_or_compute(key, func)
+
+
+class Stage:
+    """パイプラインの1ステージ（依存ステージの結果をキーワード引数として受け取る）"""
+
+    def __init__(self, name: str, func: Callable[..., Any], depends_on: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name!r}, depends_on={self.depends_on!r})"
+
+
+def _validate_stages(stages: List[Stage]):
+    """ステージ名の重複・未定義の依存・循環依存を検出する"""
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError("ステージ名が重複しています。")
+    known = set(names)
+    for stage in stages:
+        unknown = [dep for dep in stage.depends_on if dep not in known]
+        if unknown:
+            raise ValueError(f"ステージ {stage.name} の依存先が存在しません: {', '.join(unknown)}")
+
+    # トポロジカルソートで循環を検出
+    remaining = {stage.name: set(stage.depends_on) for stage in stages}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"ステージに循環依存があります: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def run_stages(stages: List[Stage], max_workers: Optional[int] = None, cancel_event: Optional[threading.Event] = None,
+               on_stage_complete: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+    """依存関係を満たしたステージから順に並列実行し、ステージ名→結果の辞書を返す関数
+
+    いずれかのステージで例外が発生した場合は、未開始のステージを取り消して例外を送出する。
+    cancel_event がセットされた場合は、次のステージ境界で CancelledError を送出する。
+    on_stage_complete を渡すと、各ステージの完了時に (ステージ名, 結果) で呼び出される。
+    """
+    _validate_stages(stages)
+    results: Dict[str, Any] = {}
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS) as executor:
+        try:
+            while pending or running:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise CancelledError()
+
+                # 依存ステージがすべて完了したステージを投入
+                for name in [name for name, stage in pending.items() if all(dep in results for dep in stage.depends_on)]:
+                    stage = pending.pop(name)
+                    kwargs = {dep: results[dep] for dep in stage.depends_on}
+                    # 呼び出し元のコンテキスト（API呼び出しの優先度など）を引き継いで実行する
+                    running[executor.submit(contextvars.copy_context().run, stage.func, **kwargs)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    if on_stage_complete is not None:
+                        on_stage_complete(name, results[name])
+        except BaseException:
+            for future in running:
+                future.cancel()
+            raise
+
+    return results
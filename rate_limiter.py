@@ -0,0 +1,303 @@
+"""
+OpenAI API リクエストスケジューラモジュール
+モデルごとのリクエスト数・トークン数のトークンバケット、優先度付きの同時実行数制御、
+Retry-After を考慮した指数バックオフ（ジッター付き）で、レート制限内に収まるように API を呼び出す
+"""
+
+import os
+import json
+import time
+import heapq
+import random
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+# 優先度（値が小さいほど先に実行される）
+INTERACTIVE = 0
+BULK = 10
+
+# 既定のレート制限と同時実行数、リトライ設定（環境変数で上書き可能）
+DEFAULT_RPM = int(os.environ.get('OPENAI_DEFAULT_RPM', 500))
+DEFAULT_TPM = int(os.environ.get('OPENAI_DEFAULT_TPM', 300000))
+MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 8))
+MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 5))
+BASE_DELAY = float(os.environ.get('OPENAI_RETRY_BASE_DELAY', 1.0))
+MAX_DELAY = float(os.environ.get('OPENAI_RETRY_MAX_DELAY', 60.0))
+
+_priority: contextvars.ContextVar = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """ブロック内の API 呼び出しの優先度を設定する（例: 一括処理では BULK）"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算する関数（日本語は1文字あたり約1トークンとして見積もる）"""
+    return max(1, len(text))
+
+
+class TokenBucket:
+    """1分あたりの上限で補充されるトークンバケット"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """トークンが利用可能になるまでの待ち時間（秒）を返す（トークンは消費しない）"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (amount - self._tokens) / self.rate)
+
+    def consume(self, amount: float):
+        """トークンを消費する"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+    def refund(self, amount: float):
+        """予約したトークンの過剰分を戻す（負の値で追加の消費）"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class _PriorityGate:
+    """優先度順に入場させる、上限を変更可能なセマフォ"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority: int):
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            while self._waiters[0] != entry or self.active >= self.limit:
+                self._condition.wait()
+            heapq.heappop(self._waiters)
+            self.active += 1
+            self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def set_limit(self, limit: int):
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+
+class _PriorityAdmission:
+    """トークンバケットへの入場を優先度順に待たせる待ち行列
+
+    トークンを取得できるのは待ち行列の先頭の呼び出しだけで、先頭はトークンが補充されるまで待ってから取得する。
+    待機中に優先度の高い呼び出しが到着すればその呼び出しが先頭になり、次に補充されたトークンを先に取得する。
+    """
+
+    def __init__(self, buckets: Dict[str, TokenBucket]):
+        self.buckets = buckets
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority: int, amounts: Dict[str, float]):
+        """すべてのバケットから amounts のトークンを取得できるまで待ち、取得する"""
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    if self._waiters[0] != entry:
+                        self._condition.wait()
+                        continue
+                    delay = max(self.buckets[name].wait_time(amount) for name, amount in amounts.items())
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                for name, amount in amounts.items():
+                    self.buckets[name].consume(amount)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """エラーレスポンスの Retry-After ヘッダーから待ち時間（秒）を取得する"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        return None
+    return None
+
+
+# openai は起動時間に影響するため、エラー発生時にはじめて読み込む
+def _is_retryable(error: Exception) -> bool:
+    import openai
+    return isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError))
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    import openai
+    return isinstance(error, openai.RateLimitError)
+
+
+class RequestScheduler:
+    """すべての LLM・埋め込み呼び出しが経由するスケジューラ
+
+    - モデルごとに RPM（リクエスト数/分）と TPM（トークン数/分）のトークンバケットで送信ペースを制御する
+    - 429 を受けたら同時実行数を半減し、成功が続けば1ずつ戻す（AIMD）
+    - リトライ時は Retry-After を優先し、なければ指数バックオフにジッターを加えて待つ
+    - 対話的なリクエスト（INTERACTIVE）は、トークンバケットの待ちでも同時実行枠の待ちでも一括処理（BULK）より先に実行する
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, int]]] = None, default_rpm: int = DEFAULT_RPM,
+                 default_tpm: int = DEFAULT_TPM, max_concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES,
+                 base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY):
+        self.limits = limits or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._gate = _PriorityGate(max_concurrency)
+        self._admissions: Dict[str, _PriorityAdmission] = {}
+        self._lock = threading.Lock()
+        self._successes = 0
+        self.stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'failures': 0}
+
+    def _model_admission(self, model: str) -> _PriorityAdmission:
+        with self._lock:
+            admission = self._admissions.get(model)
+            if admission is None:
+                limits = self.limits.get(model, {})
+                admission = _PriorityAdmission({
+                    'requests': TokenBucket(limits.get('rpm', self.default_rpm)),
+                    'tokens': TokenBucket(limits.get('tpm', self.default_tpm))
+                })
+                self._admissions[model] = admission
+            return admission
+
+    def _model_buckets(self, model: str) -> Dict[str, TokenBucket]:
+        return self._model_admission(model).buckets
+
+    @property
+    def concurrency(self) -> int:
+        """現在の同時実行数の上限"""
+        return self._gate.limit
+
+    def _on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._gate.limit < self.max_concurrency and self._successes >= self._gate.limit:
+                self._successes = 0
+                self._gate.set_limit(self._gate.limit + 1)
+
+    def _on_rate_limited(self):
+        with self._lock:
+            self._successes = 0
+            self.stats['rate_limited'] += 1
+            self._gate.set_limit(max(1, self._gate.limit // 2))
+
+    def call(self, model: str, func: Callable[[], Any], estimated_tokens: int = 0, priority: Optional[int] = None,
+             on_retry: Optional[Callable[[int, Exception], None]] = None) -> Any:
+        """レート制限とリトライを適用して func を実行し、その結果を返す
+
+        func の戻り値に usage.total_tokens があれば、見積もりとの差分をトークンバケットに反映する。
+        """
+        if priority is None:
+            priority = _priority.get()
+        admission = self._model_admission(model)
+        buckets = admission.buckets
+
+        # バケットの容量を超える見積もりは容量まで切り詰めて予約されるため、実績との差分も予約した量を基準にする
+        reserved_tokens = min(estimated_tokens, buckets['tokens'].capacity)
+
+        attempt = 0
+        while True:
+            # トークンバケットは同時実行枠の外で優先度順に待ち、待機中に他のモデルの呼び出しを妨げない
+            admission.acquire(priority, {'requests': 1, 'tokens': reserved_tokens})
+            self._gate.acquire(priority)
+            try:
+                with self._lock:
+                    self.stats['requests'] += 1
+                result = func()
+            except Exception as e:
+                error = e
+            else:
+                usage = getattr(result, 'usage', None)
+                total_tokens = getattr(usage, 'total_tokens', None)
+                if isinstance(total_tokens, int):
+                    buckets['tokens'].refund(reserved_tokens - total_tokens)
+                self._on_success()
+                return result
+            finally:
+                self._gate.release()
+
+            if not _is_retryable(error) or attempt >= self.max_retries:
+                with self._lock:
+                    self.stats['failures'] += 1
+                raise error
+
+            if _is_rate_limited(error):
+                self._on_rate_limited()
+            delay = _retry_after(error)
+            if delay is None:
+                # フルジッター付きの指数バックオフ
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            attempt += 1
+            with self._lock:
+                self.stats['retries'] += 1
+            if on_retry is not None:
+                on_retry(attempt, error)
+            time.sleep(min(delay, self.max_delay))
+
+
+_default_scheduler: Optional[RequestScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """プロセス共通のスケジューラを返す関数
+
+    モデルごとの上限は OPENAI_RATE_LIMITS に JSON で指定する（例: {"gpt-4o": {"rpm": 500, "tpm": 30000}}）。
+    """
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_scheduler_lock:
+            if _default_scheduler is None:
+                limits = json.loads(os.environ.get('OPENAI_RATE_LIMITS', '{}'))
+                _default_scheduler = RequestScheduler(limits=limits)
+    return _default_scheduler
@@ -0,0 +1,75 @@
+"""
+レポートキャッシュモジュール
+同じ企業ペア・同じパイプラインの版のマッチングレポートを有効期限付きで保持し、パイプライン全体の実行を省略する
+"""
+
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+from typing import Any, Dict, Optional
+
+from completion_cache import LRUCache
+
+# レポートの有効期限（秒、0 で無効）と最大保持件数
+DEFAULT_TTL = float(os.environ.get('REPORT_CACHE_TTL', 24 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 500))
+
+COMPANY_FIELDS = ('company_name', 'industry', 'business_description')
+
+
+def _canonical_company(company: Dict[str, str]) -> Dict[str, str]:
+    """表記ゆれ（全角・半角、前後の空白）を除いた企業情報"""
+    return {field: unicodedata.normalize('NFKC', str(company[field])).strip() for field in COMPANY_FIELDS}
+
+
+def report_key(company_a: Dict[str, str], company_b: Dict[str, str], version: str) -> str:
+    """企業A・企業B・パイプラインの版からレポートのキャッシュキーを生成する関数"""
+    payload = json.dumps([version, _canonical_company(company_a), _canonical_company(company_b)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def report_etag(report: Dict[str, Any]) -> str:
+    """レポートの内容から ETag を生成する関数（リクエストごとに変わる metrics は含めない）"""
+    payload = json.dumps({key: value for key, value in report.items() if key != 'metrics'}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class ReportCache:
+    """有効期限と件数上限を持つレポートキャッシュ（プロセス内 LRU）"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self._entries = LRUCache(max_entries)
+        self._stats = {'hits': 0, 'misses': 0}
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        report = self._entries.get(key)
+        with self._stats_lock:
+            self._stats['hits' if report is not None else 'misses'] += 1
+        return report
+
+    def put(self, key: str, report: Dict[str, Any]):
+        self._entries.put(key, {key_: value for key_, value in report.items() if key_ != 'metrics'}, self.ttl)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+_default_cache: Optional[ReportCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_report_cache() -> Optional[ReportCache]:
+    """プロセス共通のレポートキャッシュを返す関数（REPORT_CACHE_TTL=0 で無効化し None を返す）"""
+    global _default_cache
+    if DEFAULT_TTL <= 0 or DEFAULT_MAX_ENTRIES <= 0:
+        return None
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ReportCache()
+    return _default_cache
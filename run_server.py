@@ -3,7 +3,7 @@
 HTMLファイルを静的ファイルとして提供するシンプルなFlaskサーバー
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 import os
 import uuid
 import sys
@@ -12,10 +12,14 @@ import sys
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
-from matching_algorithm import generate_query_expansion, generate_hyde_document, calculate_matching_score, generate_strategy_recommendations, generate_matching_report
+from metrics import get_registry
+from warmup import start_warmup
 
 app = Flask(__name__, static_folder='static')
 
+# マッチング処理のモジュールはバックグラウンドで読み込み、各エンドポイントでは必要になった時点で参照する
+warmup_state = start_warmup()
+
 @app.route('/')
 def index():
     """メインページを表示"""
@@ -143,6 +147,8 @@ def analyze_matching():
             'business_description': '天然素材を使用した製品開発に強み。蜂蜜エキスを含む化粧品ラインが人気。'
         }
         
+        from matching_algorithm import generate_query_expansion
+        
         # クエリ拡張の生成
         company_a_keywords = generate_query_expansion(company_a['industry'], company_a['business_description'])
         
@@ -185,6 +191,8 @@ def matching_results():
             'business_description': '天然素材を使用した製品開発に強み。蜂蜜エキスを含む化粧品ラインが人気。'
         }
         
+        from matching_algorithm import generate_matching_report
+        
         # 実際のマッチングレポートを生成
         results = generate_matching_report(company_a, company_b)
         
@@ -193,5 +201,17 @@ def matching_results():
     except Exception as e:
         return jsonify({"status": "error", "message": f"結果の取得中にエラーが発生しました: {str(e)}"}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 形式のメトリクスを返す"""
+    return Response(get_registry().render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """ウォームアップが完了してリクエストを処理できるかを返す"""
+    if not warmup_state.is_ready:
+        return jsonify({"status": "error", "message": "起動処理中です。", "warmup": warmup_state.to_dict()}), 503
+    return jsonify({"status": "success", "warmup": warmup_state.to_dict()})
+
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=8080, debug=False) 
\ No newline at end of file
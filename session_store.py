@@ -0,0 +1,293 @@
+"""
+セッションデータ保存モジュール
+セッションごとの企業情報・分析結果を有効期限付きで保持し、期限切れのセッションはアップロードファイルとともに削除する
+"""
+
+import os
+import time
+import pickle
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# セッションの有効期限（秒、最終アクセスから）と、メモリ上に保持する最大セッション数
+DEFAULT_TTL = int(os.environ.get('SESSION_TTL', 6 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', 1000))
+
+# プロセス内の領域（CompanyStore・PipelineContext など保存しないオブジェクト）を保持する最大セッション数
+DEFAULT_MAX_LOCAL_ENTRIES = int(os.environ.get('SESSION_LOCAL_MAX_ENTRIES', 32))
+
+# 期限切れのセッションを削除する間隔（秒）
+DEFAULT_SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', 600))
+
+
+def _remove_files(files: Iterable[str]):
+    """セッションに紐づくファイル（ディレクトリ）を削除する"""
+    for filepath in files:
+        try:
+            if os.path.isdir(filepath):
+                shutil.rmtree(filepath)
+            elif os.path.exists(filepath):
+                os.remove(filepath)
+        except Exception as e:
+            print(f"Error removing file: {str(e)}")
+
+
+class SessionStore:
+    """セッションストアの共通インターフェース
+
+    セッションデータは企業情報・分析結果などの小さなフィールドの辞書として保存し、
+    update で指定したフィールドだけを書き換える（同時に別のフィールドを更新したリクエストの結果を上書きしない）。
+    CompanyStore や PipelineContext などの大きなオブジェクトは保存せず、local で取得するプロセス内の領域に置く。
+    files に登録したファイルはセッションの削除・期限切れ時に一緒に削除される。
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_local_entries: int = DEFAULT_MAX_LOCAL_ENTRIES):
+        self.ttl = ttl
+        self.max_local_entries = max_local_entries
+        self._local: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._local_lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop_sweeper = threading.Event()
+
+    def create(self, session_id: str, data: Dict[str, Any], files: Iterable[str] = ()):
+        raise NotImplementedError
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        """指定したフィールドだけを更新する（セッションがなければ False）"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def local(self, session_id: str) -> Dict[str, Any]:
+        """セッションごとのプロセス内の領域を返す（保存されず他のワーカーとは共有しない。上限を超えると古いものから破棄される）"""
+        with self._local_lock:
+            entry = self._local.get(session_id)
+            if entry is None:
+                entry = self._local[session_id] = {}
+                while len(self._local) > self.max_local_entries:
+                    self._local.popitem(last=False)
+            else:
+                self._local.move_to_end(session_id)
+            return entry
+
+    def _drop_local(self, session_ids: Iterable[str]):
+        with self._local_lock:
+            for session_id in session_ids:
+                self._local.pop(session_id, None)
+
+    def start_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL):
+        """期限切れのセッションとそのファイルを定期的に削除するバックグラウンドスレッドを開始する"""
+        if self._sweeper is not None:
+            return
+
+        def sweep():
+            while not self._stop_sweeper.wait(interval):
+                try:
+                    self.purge_expired()
+                except Exception as e:
+                    print(f"Error purging sessions: {str(e)}")
+
+        self._stop_sweeper.clear()
+        self._sweeper = threading.Thread(target=sweep, name='session-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._stop_sweeper.set()
+            self._sweeper.join()
+            self._sweeper = None
+
+
+class MemorySessionStore(SessionStore):
+    """プロセス内メモリの LRU＋有効期限付きセッションストア（単一ワーカー向け）"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES, max_local_entries: int = DEFAULT_MAX_LOCAL_ENTRIES):
+        super().__init__(ttl, max_local_entries)
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Dict[str, Any], List[str]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str, data: Dict[str, Any], files: Iterable[str] = ()):
+        removed, evicted = [], []
+        with self._lock:
+            self._entries[session_id] = (time.time() + self.ttl, dict(data), list(files))
+            self._entries.move_to_end(session_id)
+            expired, expired_files = self._purge_locked()
+            evicted.extend(expired)
+            removed.extend(expired_files)
+            while len(self._entries) > self.max_entries:
+                evicted_id, (_, _, files_to_remove) = self._entries.popitem(last=False)
+                evicted.append(evicted_id)
+                removed.extend(files_to_remove)
+        self._drop_local(evicted)
+        _remove_files(removed)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires_at, data, files = entry
+            if expires_at < time.time():
+                del self._entries[session_id]
+                expired_files = files
+            else:
+                # アクセスがあったセッションは有効期限を延長する
+                self._entries[session_id] = (time.time() + self.ttl, data, files)
+                self._entries.move_to_end(session_id)
+                return dict(data)
+        self._drop_local([session_id])
+        _remove_files(expired_files)
+        return None
+
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] < time.time():
+                return False
+            entry[1].update(fields)
+            self._entries[session_id] = (time.time() + self.ttl, entry[1], entry[2])
+            return True
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return False
+        self._drop_local([session_id])
+        _remove_files(entry[2])
+        return True
+
+    def _purge_locked(self) -> Tuple[List[str], List[str]]:
+        now = time.time()
+        expired = [session_id for session_id, (expires_at, _, _) in self._entries.items() if expires_at < now]
+        files = []
+        for session_id in expired:
+            files.extend(self._entries.pop(session_id)[2])
+        return expired, files
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            expired, files = self._purge_locked()
+        self._drop_local(expired)
+        _remove_files(files)
+        return len(expired)
+
+
+class SqliteSessionStore(SessionStore):
+    """複数ワーカー間で共有できる SQLite のセッションストア
+
+    フィールドごとに pickle した行として保存するため、update は指定したフィールドの行だけを書き換え、
+    get のたびに新しいオブジェクトが返される。
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, max_local_entries: int = DEFAULT_MAX_LOCAL_ENTRIES):
+        super().__init__(ttl, max_local_entries)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_entries ("
+                "session_id TEXT PRIMARY KEY, files TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS session_entries_expires_at ON session_entries (expires_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_fields ("
+                "session_id TEXT NOT NULL, name TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (session_id, name))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _field_rows(session_id: str, fields: Dict[str, Any]) -> List[Tuple[str, str, bytes]]:
+        return [(session_id, name, pickle.dumps(value)) for name, value in fields.items()]
+
+    def create(self, session_id: str, data: Dict[str, Any], files: Iterable[str] = ()):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_entries (session_id, files, expires_at) VALUES (?, ?, ?)",
+                (session_id, "\n".join(files), time.time() + self.ttl)
+            )
+            conn.execute("DELETE FROM session_fields WHERE session_id = ?", (session_id,))
+            conn.executemany("INSERT INTO session_fields (session_id, name, value) VALUES (?, ?, ?)", self._field_rows(session_id, data))
+        self.purge_expired()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT files, expires_at FROM session_entries WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                conn.execute("DELETE FROM session_entries WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM session_fields WHERE session_id = ?", (session_id,))
+                expired_files = row[0]
+            else:
+                conn.execute("UPDATE session_entries SET expires_at = ? WHERE session_id = ?", (time.time() + self.ttl, session_id))
+                fields = conn.execute("SELECT name, value FROM session_fields WHERE session_id = ?", (session_id,)).fetchall()
+                return {name: pickle.loads(value) for name, value in fields}
+        self._drop_local([session_id])
+        _remove_files(filter(None, expired_files.split("\n")))
+        return None
+
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        rows = self._field_rows(session_id, fields)
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE session_entries SET expires_at = ? WHERE session_id = ? AND expires_at >= ?",
+                (time.time() + self.ttl, session_id, time.time())
+            ).rowcount
+            if not updated:
+                return False
+            conn.executemany("INSERT OR REPLACE INTO session_fields (session_id, name, value) VALUES (?, ?, ?)", rows)
+        return True
+
+    def delete(self, session_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT files FROM session_entries WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM session_entries WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_fields WHERE session_id = ?", (session_id,))
+        self._drop_local([session_id])
+        _remove_files(filter(None, row[0].split("\n")))
+        return True
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT session_id, files FROM session_entries WHERE expires_at < ?", (now,)).fetchall()
+            # 選択後に他のワーカーのアクセスで延長されたセッションは削除しない
+            rows = [row for row in rows
+                    if conn.execute("DELETE FROM session_entries WHERE session_id = ? AND expires_at < ?", (row[0], now)).rowcount]
+            conn.executemany("DELETE FROM session_fields WHERE session_id = ?", [(row[0],) for row in rows])
+        self._drop_local(row[0] for row in rows)
+        for _, files in rows:
+            _remove_files(filter(None, files.split("\n")))
+        return len(rows)
+
+
+def create_session_store() -> SessionStore:
+    """環境変数 SESSION_BACKEND（memory / sqlite）に基づいてセッションストアを作成する関数"""
+    backend = os.environ.get('SESSION_BACKEND', 'memory').lower()
+    if backend == 'sqlite':
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'sessions.db')
+        return SqliteSessionStore(os.environ.get('SESSION_DB_PATH', default_path))
+    if backend == 'memory':
+        return MemorySessionStore()
+    raise ValueError(f"未対応のセッションバックエンドです: {backend}")
@@ -0,0 +1,93 @@
+"""
+類似度計算モジュール
+企業コーパス全体の総当たり類似度を、行列全体を保持せずにタイル単位で計算する
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+# タイル計算に使う作業メモリの既定上限（MB）
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """各行を L2 正規化した float32 行列を返す関数（内積がコサイン類似度になる）"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _tile_size(n: int, memory_budget_mb: float) -> int:
+    """類似度ブロック（タイル×タイル）と候補のマージ用領域が予算に収まる行数を返す"""
+    # 1要素あたり、類似度(4B)・符号反転の一時領域(4B)・argpartition の添字(8B)を見込む
+    tile = int((memory_budget_mb * 1024 * 1024 / 16) ** 0.5)
+    return max(1, min(n, tile))
+
+
+def _merge_top_k(best_scores: np.ndarray, best_indices: np.ndarray, block: np.ndarray, block_indices: np.ndarray, k: int):
+    """現在の上位k件とブロックの候補をマージして上位k件を更新する（行ごとのストリーミング選択）"""
+    if block.shape[1] > k:
+        # ブロック内でまず上位k件に絞り込む
+        part = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        block = np.take_along_axis(block, part, axis=1)
+        candidates = block_indices[part]
+    else:
+        candidates = np.broadcast_to(block_indices, block.shape)
+    scores = np.concatenate([best_scores, block], axis=1)
+    indices = np.concatenate([best_indices, candidates], axis=1)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores[:] = np.take_along_axis(scores, part, axis=1)
+    best_indices[:] = np.take_along_axis(indices, part, axis=1)
+
+
+def all_pairs_top_k(embeddings, k: int = 10, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                    normalized: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """全企業間のコサイン類似度から、各企業の上位k件のパートナーを求める関数
+
+    N×N の類似度行列は保持せず、タイルごとに計算して上位k件だけを残す。
+    類似度は対称なので上三角のタイルのみ計算し、両側の候補を更新する。
+    embeddings には np.memmap や vector_codec.CompactVectors も渡せる（タイル単位で読み込まれる）。
+
+    Returns:
+        (indices, scores): いずれも N×k。類似度の降順に並び、候補が不足する場合は index=-1
+    """
+    n = embeddings.shape[0]
+    if n == 0 or k <= 0:
+        return np.zeros((n, 0), dtype=np.int64), np.zeros((n, 0), dtype=np.float32)
+
+    best_scores = np.full((n, k), -np.inf, dtype=np.float32)
+    best_indices = np.full((n, k), -1, dtype=np.int64)
+    tile = _tile_size(n, memory_budget_mb)
+
+    for row_start in range(0, n, tile):
+        row_end = min(row_start + tile, n)
+        rows = embeddings[row_start:row_end]
+        rows = rows.astype(np.float32) if normalized else normalize_rows(rows)
+        row_indices = np.arange(row_start, row_end)
+
+        for col_start in range(row_start, n, tile):
+            col_end = min(col_start + tile, n)
+            if col_start == row_start:
+                cols = rows
+            else:
+                cols = embeddings[col_start:col_end]
+                cols = cols.astype(np.float32) if normalized else normalize_rows(cols)
+            col_indices = np.arange(col_start, col_end)
+
+            block = rows @ cols.T
+            if col_start == row_start:
+                # 自分自身とのペアは除外する
+                np.fill_diagonal(block, -np.inf)
+                _merge_top_k(best_scores[row_start:row_end], best_indices[row_start:row_end], block, col_indices, k)
+            else:
+                _merge_top_k(best_scores[row_start:row_end], best_indices[row_start:row_end], block, col_indices, k)
+                _merge_top_k(best_scores[col_start:col_end], best_indices[col_start:col_end], block.T, row_indices, k)
+
+    # 各行を類似度の降順に並べ替える
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_indices = np.take_along_axis(best_indices, order, axis=1)
+    best_indices[~np.isfinite(best_scores)] = -1
+    return best_indices, best_scores
@@ -0,0 +1,124 @@
+"""
+同一処理の重複実行を抑止するモジュール（single-flight）
+同じキーの処理が実行中であれば新たに実行せず、実行中の処理の完了を待って同じ結果を返す
+"""
+
+import threading
+from concurrent.futures import CancelledError
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# 待機中に呼び出し元の cancel_event を確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.05
+
+
+class _Call:
+    """実行中の処理1件"""
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self, cancel_event: Optional[threading.Event] = None) -> Any:
+        """完了を待って結果を返す（cancel_event がセットされたら待機をやめて CancelledError を送出する）"""
+        if cancel_event is None:
+            self.done.wait()
+        else:
+            while not self.done.wait(CANCEL_POLL_INTERVAL):
+                if cancel_event.is_set():
+                    raise CancelledError()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """キーごとに実行中の処理を1つにまとめるグループ
+
+    do はキー1つの処理に、claim / resolve / wait は複数キーをまとめて処理する場合（埋め込みのバッチなど）に使う。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key: Hashable, func: Callable[[], Any], cancel_event: Optional[threading.Event] = None) -> Tuple[Any, bool]:
+        """func を実行して (結果, 他の実行を待ったかどうか) を返す
+
+        待機中は呼び出し元の cancel_event を確認し、セットされたら CancelledError を送出する。
+        待っていた実行が取り消された場合は、その取り消しを引き継がずに改めて実行する（または次の実行を待つ）。
+        """
+        while True:
+            led, waiting = self.claim([key])
+            if not waiting:
+                break
+            try:
+                return waiting[key].wait(cancel_event), True
+            except CancelledError:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise
+        try:
+            value = func()
+        except BaseException as e:
+            self.resolve(key, error=e)
+            raise
+        self.resolve(key, value)
+        return value, False
+
+    def claim(self, keys: Iterable[Hashable]) -> Tuple[List[Hashable], Dict[Hashable, _Call]]:
+        """キーの実行を引き受ける
+
+        (自分が実行するキーのリスト, 他で実行中のキーと待機用オブジェクト) を返す。
+        引き受けたキーは必ず resolve すること。
+        """
+        led, waiting = [], {}
+        with self._lock:
+            for key in keys:
+                if key in waiting or key in led:
+                    continue
+                call = self._calls.get(key)
+                if call is not None:
+                    waiting[key] = call
+                else:
+                    self._calls[key] = _Call()
+                    led.append(key)
+            self.stats['executed'] += len(led)
+            self.stats['coalesced'] += len(waiting)
+        return led, waiting
+
+    def resolve(self, key: Hashable, value: Any = None, error: Optional[BaseException] = None):
+        """引き受けたキーの結果（またはエラー）を待機中の呼び出し元に渡す"""
+        with self._lock:
+            call = self._calls.pop(key, None)
+        if call is not None:
+            call.value = value
+            call.error = error
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """名前ごとのプロセス共通グループを返す関数（report / embedding / completion）"""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = SingleFlight(name)
+            _groups[name] = group
+        return group
+
+
+def single_flight_groups() -> List[SingleFlight]:
+    """作成済みのグループの一覧"""
+    with _groups_lock:
+        return list(_groups.values())
@@ -308,9 +308,62 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // 結果表示
+    // ジョブ状態の確認間隔（ミリ秒）
+    const JOB_POLL_INTERVAL = 2000;
+    
+    // 結果表示（Server-Sent Events に対応していれば、完了したセクションから順に表示する）
     function showResults() {
-        fetch('/api/matching_results', {
+        if (!window.EventSource) {
+            submitResultsJob();
+            return;
+        }
+        
+        const source = new EventSource(`/api/matching_results/stream?session_id=${encodeURIComponent(sessionId)}`);
+        let matchingDetails = '';
+        let received = false;
+        
+        source.addEventListener('companies', event => {
+            received = true;
+            const data = JSON.parse(event.data);
+            showResultsContainer();
+            renderCompanies(data.company_a, data.company_b);
+        });
+        source.addEventListener('matching_score', event => {
+            renderMatchingScore(JSON.parse(event.data));
+        });
+        source.addEventListener('matching_details_delta', event => {
+            matchingDetails += JSON.parse(event.data);
+            renderMatchingDetails(matchingDetails);
+        });
+        source.addEventListener('matching_details', event => {
+            matchingDetails = JSON.parse(event.data);
+            renderMatchingDetails(matchingDetails);
+        });
+        source.addEventListener('past_cases', event => {
+            renderPastCases(JSON.parse(event.data));
+        });
+        source.addEventListener('strategies', event => {
+            renderStrategies(JSON.parse(event.data));
+        });
+        source.addEventListener('report', () => {
+            source.close();
+        });
+        source.addEventListener('error', event => {
+            source.close();
+            if (event.data) {
+                showErrorMessage(JSON.parse(event.data).message);
+            } else if (!received) {
+                // ストリーミングに接続できない場合はジョブ方式で結果を取得
+                submitResultsJob();
+            } else {
+                showErrorMessage('結果の取得中に接続が切断されました。もう一度お試しください。');
+            }
+        });
+    }
+    
+    // レポート生成ジョブを投入し、完了まで状態を確認する
+    function submitResultsJob() {
+        fetch('/api/jobs/matching_results', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -320,58 +373,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
-                // ステップ2から結果表示へ移行
-                stepTwoContainer.style.display = 'none';
-                resultsContainer.style.display = 'block';
-                
-                // 企業A情報の表示
-                document.getElementById('company-a-name').textContent = data.results.company_a.name;
-                document.getElementById('company-a-category').textContent = data.results.company_a.industry;
-                document.getElementById('company-a-description').textContent = data.results.company_a.description;
-                
-                // 企業B情報の表示
-                document.getElementById('company-b-name').textContent = data.results.company_b.name;
-                document.getElementById('company-b-category').textContent = data.results.company_b.industry;
-                document.getElementById('company-b-description').textContent = data.results.company_b.description;
-                
-                // マッチングスコアの表示
-                document.getElementById('matching-score-value').textContent = data.results.matching_score;
-                document.getElementById('matching-details-text').textContent = data.results.matching_details;
-                
-                // 過去の成功事例の表示
-                const pastCases = data.results.past_cases;
-                if (pastCases.length > 0 && pastCases[0]) {
-                    const case1 = pastCases[0];
-                    document.getElementById('case1-title').textContent = case1.title;
-                    document.getElementById('case1-date').textContent = case1.date;
-                    document.getElementById('case1-description').textContent = case1.description;
-                    document.getElementById('case1-roi').textContent = `ROI: ${case1.roi}`;
-                }
-                
-                if (pastCases.length > 1 && pastCases[1]) {
-                    const case2 = pastCases[1];
-                    document.getElementById('case2-title').textContent = case2.title;
-                    document.getElementById('case2-date').textContent = case2.date;
-                    document.getElementById('case2-description').textContent = case2.description;
-                    document.getElementById('case2-roi').textContent = `ROI: ${case2.roi}`;
-                }
-                
-                // 戦略提案の表示
-                const strategies = data.results.strategies;
-                const strategyList = document.getElementById('strategy-list');
-                strategyList.innerHTML = '';
-                
-                strategies.forEach(strategy => {
-                    const strategyItem = document.createElement('div');
-                    strategyItem.className = 'strategy-item';
-                    strategyItem.innerHTML = `
-                        <div class="strategy-icon">
-                            <i class="fas fa-lightbulb"></i>
-                        </div>
-                        <div class="strategy-text">${strategy}</div>
-                    `;
-                    strategyList.appendChild(strategyItem);
-                });
+                pollJobResult(data.job_id);
             } else {
                 showErrorMessage(data.message);
             }
@@ -382,6 +384,103 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // ジョブの結果を取得（未完了の場合は一定間隔で再確認）
+    function pollJobResult(jobId) {
+        fetch(`/api/jobs/${jobId}/result`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'pending') {
+                setTimeout(() => pollJobResult(jobId), JOB_POLL_INTERVAL);
+            } else {
+                renderResults(data);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showErrorMessage('結果の取得中にエラーが発生しました。もう一度お試しください。');
+        });
+    }
+    
+    // 結果表示エリアへの切り替え
+    function showResultsContainer() {
+        stepTwoContainer.style.display = 'none';
+        resultsContainer.style.display = 'block';
+    }
+    
+    // 企業情報の表示
+    function renderCompanies(companyA, companyB) {
+        // 企業A情報の表示
+        document.getElementById('company-a-name').textContent = companyA.name;
+        document.getElementById('company-a-category').textContent = companyA.industry;
+        document.getElementById('company-a-description').textContent = companyA.description;
+        
+        // 企業B情報の表示
+        document.getElementById('company-b-name').textContent = companyB.name;
+        document.getElementById('company-b-category').textContent = companyB.industry;
+        document.getElementById('company-b-description').textContent = companyB.description;
+    }
+    
+    // マッチングスコアの表示
+    function renderMatchingScore(matchingScore) {
+        document.getElementById('matching-score-value').textContent = matchingScore;
+    }
+    
+    // マッチング詳細の表示
+    function renderMatchingDetails(matchingDetails) {
+        document.getElementById('matching-details-text').textContent = matchingDetails;
+    }
+    
+    // 過去の成功事例の表示
+    function renderPastCases(pastCases) {
+        if (pastCases.length > 0 && pastCases[0]) {
+            const case1 = pastCases[0];
+            document.getElementById('case1-title').textContent = case1.title;
+            document.getElementById('case1-date').textContent = case1.date;
+            document.getElementById('case1-description').textContent = case1.description;
+            document.getElementById('case1-roi').textContent = `ROI: ${case1.roi}`;
+        }
+        
+        if (pastCases.length > 1 && pastCases[1]) {
+            const case2 = pastCases[1];
+            document.getElementById('case2-title').textContent = case2.title;
+            document.getElementById('case2-date').textContent = case2.date;
+            document.getElementById('case2-description').textContent = case2.description;
+            document.getElementById('case2-roi').textContent = `ROI: ${case2.roi}`;
+        }
+    }
+    
+    // 戦略提案の表示
+    function renderStrategies(strategies) {
+        const strategyList = document.getElementById('strategy-list');
+        strategyList.innerHTML = '';
+        
+        strategies.forEach(strategy => {
+            const strategyItem = document.createElement('div');
+            strategyItem.className = 'strategy-item';
+            strategyItem.innerHTML = `
+                <div class="strategy-icon">
+                    <i class="fas fa-lightbulb"></i>
+                </div>
+                <div class="strategy-text">${strategy}</div>
+            `;
+            strategyList.appendChild(strategyItem);
+        });
+    }
+    
+    // マッチング結果の描画
+    function renderResults(data) {
+        if (data.status === 'success') {
+            showResultsContainer();
+            renderCompanies(data.results.company_a, data.results.company_b);
+            renderMatchingScore(data.results.matching_score);
+            renderMatchingDetails(data.results.matching_details);
+            renderPastCases(data.results.past_cases);
+            renderStrategies(data.results.strategies);
+        } else {
+            showErrorMessage(data.message);
+        }
+    }
+    
     // リセットボタン
     resetButton.addEventListener('click', function() {
         // ページをリロード
@@ -0,0 +1,68 @@
+"""
+テスト共通の設定
+OpenAI API を呼び出さないようにスタブバックエンドを使い、プロセス共通のキャッシュを無効にしてから各モジュールを読み込む
+"""
+
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('MODEL_BACKEND', 'stub')
+os.environ.setdefault('EMBEDDING_CACHE_MAX_ENTRIES', '0')
+os.environ.setdefault('REPORT_CACHE_TTL', '0')
+os.environ.setdefault('CASE_LIBRARY_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'no_case_library'))
+os.environ.setdefault('OPENAI_DEFAULT_RPM', '1000000000')
+os.environ.setdefault('OPENAI_DEFAULT_TPM', '1000000000')
+for _stage in ('QUERY_EXPANSION', 'HYDE_DOCUMENT', 'PAST_CASES', 'STRATEGIES', 'MATCHING_DETAILS', 'STRUCTURED_REPORT'):
+    os.environ.setdefault(f'COMPLETION_CACHE_TTL_{_stage}', '0')
+
+import pytest
+
+from model_backend import StubBackend, set_backend
+
+# スタブ使用時に API キーの確認を通すためのダミー値
+API_KEY = 'stub'
+
+COMPANY_A = {
+    "company_name": "株式会社サンプル製菓",
+    "industry": "製造業",
+    "business_description": "地元の果物を使用した和菓子の製造・販売。観光客向けの土産物を中心に展開している。"
+}
+
+COMPANY_B = {
+    "company_name": "サンプル観光ホテル",
+    "industry": "宿泊業",
+    "business_description": "温泉地の旅館を運営。地域の食材を使った料理と体験プログラムを提供している。"
+}
+
+
+@pytest.fixture
+def stub_backend():
+    """呼び出し回数を確認できるスタブバックエンドを設定する"""
+    backend = StubBackend(dim=32)
+    set_backend(backend)
+    yield backend
+    set_backend(None)
+
+
+@pytest.fixture
+def client(stub_backend, monkeypatch):
+    """スタブバックエンドを使う Flask のテストクライアント"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'OPENAI_API_KEY', API_KEY)
+    return app_module.create_app(warm_up=False).test_client()
+
+
+def upload_session(client) -> str:
+    """企業Aの CSV と企業Bの情報をアップロードしてセッションIDを返す"""
+    csv = "company_name,industry,business_description\n{company_name},{industry},{business_description}\n".format(**COMPANY_A)
+    response = client.post('/api/upload_and_match', data={
+        'file': (io.BytesIO(csv.encode('utf-8')), 'companies.csv'),
+        'target_company_name': COMPANY_B['company_name'],
+        'target_industry': COMPANY_B['industry'],
+        'target_business_description': COMPANY_B['business_description']
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['session_id']
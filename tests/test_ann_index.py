@@ -0,0 +1,144 @@
+"""
+近似最近傍インデックスのテスト
+"""
+
+import numpy as np
+
+from ann_index import IVFIndex
+from company_store import CompanyStore
+from conftest import API_KEY, COMPANY_A
+from matching_algorithm import build_company_index, rank_companies, rank_companies_cascade
+from similarity import normalize_rows
+from vector_codec import CompactVectors
+
+
+def _clustered(count: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, dim)).astype(np.float32)
+    return normalize_rows(centers[rng.integers(0, 20, count)] + 0.3 * rng.standard_normal((count, dim)).astype(np.float32))
+
+
+def _companies(count: int):
+    return [{"company_name": f"企業{i}", "industry": "製造業", "business_description": f"事業内容{i}"} for i in range(count)]
+
+
+def test_search_matches_brute_force_with_all_lists():
+    vectors = _clustered(500)
+    index = IVFIndex.build(np.arange(500), vectors, n_lists=10)
+    query = vectors[7]
+
+    ids, scores = index.search(query, k=10, nprobe=10)
+
+    expected = np.argsort(-(vectors @ query), kind='stable')[:10]
+    assert set(ids.tolist()) == set(expected.tolist())
+    assert np.all(np.diff(scores) <= 1e-6)
+
+
+def test_nprobe_trades_recall_for_fewer_scanned_lists():
+    vectors = _clustered(2000)
+    index = IVFIndex.build(np.arange(2000), vectors, n_lists=40)
+    queries = vectors[:50]
+
+    def recall(nprobe):
+        hits = 0
+        for query in queries:
+            ids, _ = index.search(query, k=10, nprobe=nprobe)
+            hits += len(set(ids.tolist()) & set(np.argsort(-(vectors @ query))[:10].tolist()))
+        return hits / (10 * len(queries))
+
+    assert recall(1) <= recall(8) <= recall(40)
+    assert recall(40) == 1.0
+
+
+def test_build_from_compact_vectors():
+    vectors = _clustered(300)
+    compact = CompactVectors.encode(vectors, 'int8')
+
+    index = IVFIndex.build(np.arange(300), compact, n_lists=5)
+
+    assert len(index) == 300
+    ids, _ = index.search(vectors[3], k=1, nprobe=5)
+    assert ids[0] == 3
+
+
+def test_save_and_load(tmp_path):
+    vectors = _clustered(400)
+    index = IVFIndex.build(np.arange(100, 500), vectors, n_lists=8, nprobe=3)
+    index.save(str(tmp_path))
+
+    for mmap in (True, False):
+        loaded = IVFIndex.load(str(tmp_path), mmap=mmap)
+        assert len(loaded) == 400
+        assert loaded.nprobe == 3
+        for query in vectors[:5]:
+            expected_ids, expected_scores = index.search(query, k=5)
+            ids, scores = loaded.search(query, k=5)
+            np.testing.assert_array_equal(ids, expected_ids)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+
+def test_add_replaces_and_delete_removes():
+    vectors = _clustered(200)
+    index = IVFIndex.build(np.arange(200), vectors, n_lists=4)
+
+    # 同じIDで追加すると置き換えられ、件数は増えない
+    index.add([5], -vectors[5:6])
+    assert len(index) == 200
+    ids, _ = index.search(-vectors[5], k=1, nprobe=4)
+    assert ids[0] == 5
+
+    index.add([1000], vectors[9:10])
+    assert len(index) == 201
+
+    index.delete([5, 1000])
+    assert len(index) == 199
+    ids, _ = index.search(vectors[9], k=200, nprobe=4)
+    assert 5 not in ids and 1000 not in ids
+
+
+def test_company_index_is_built_once_per_store_and_follows_new_rows(stub_backend, tmp_path, monkeypatch):
+    store = CompanyStore.from_companies(_companies(50))
+    directory = str(tmp_path / 'index')
+
+    index = build_company_index(store, api_key=API_KEY, n_lists=4, directory=directory)
+    assert store.ann_index is index
+    assert build_company_index(store, api_key=API_KEY) is index
+
+    store.add({"company_name": "追加企業", "industry": "小売業", "business_description": "追加の事業内容"})
+    assert len(build_company_index(store, api_key=API_KEY)) == 51
+
+    # 保存済みのインデックスは新しいストアでも構築し直さずに読み込む
+    def fail_build(*args, **kwargs):
+        raise AssertionError("インデックスが構築し直されました")
+
+    monkeypatch.setattr(IVFIndex, 'build', fail_build)
+    reloaded = CompanyStore.from_companies(_companies(50))
+    assert len(build_company_index(reloaded, api_key=API_KEY, directory=directory)) == 50
+
+
+def test_rank_companies_uses_index_as_retrieval_step(stub_backend):
+    store = CompanyStore.from_companies(_companies(200))
+    index = build_company_index(store, api_key=API_KEY, n_lists=4)
+
+    exact = rank_companies(COMPANY_A, store, api_key=API_KEY, top_k=10)
+    approximate = rank_companies(COMPANY_A, store, api_key=API_KEY, top_k=10, index=index, nprobe=4)
+
+    assert approximate['total'] == 200
+    assert [entry['company_name'] for entry in approximate['results']] == [entry['company_name'] for entry in exact['results']]
+
+    cascade = rank_companies_cascade(COMPANY_A, store, api_key=API_KEY, rerank_top_k=2, index=index, nprobe=4)
+    assert cascade['retrieved'] == 200
+    assert cascade['reranked'] == 2
+
+
+def test_large_store_builds_index_automatically(stub_backend, monkeypatch):
+    import matching_algorithm
+    monkeypatch.setattr(matching_algorithm, 'COMPANY_INDEX_MIN_SIZE', 100)
+    monkeypatch.setattr(matching_algorithm, 'INDEX_CANDIDATES', 30)
+    store = CompanyStore.from_companies(_companies(150))
+
+    ranking = rank_companies(COMPANY_A, store, api_key=API_KEY)
+
+    assert store.ann_index is not None
+    assert ranking['total'] == 150
+    assert len(ranking['results']) == ranking['retrieved'] == 30
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+import bulk_match
+from company_store import CompanyStore
+from model_backend import StubBackend, set_backend
+
+
+class CrashingBackend(StubBackend):
+    """指定した回数の埋め込みの後に失敗するスタブ"""
+
+    def __init__(self, fail_after):
+        super().__init__(dim=16)
+        self.fail_after = fail_after
+
+    def embed(self, model, texts, dimensions=None):
+        if self.calls['embed'] >= self.fail_after:
+            raise RuntimeError("停止")
+        return super().embed(model, texts, dimensions)
+
+
+def _companies(count):
+    return [{'company_name': f"企業{i}", 'industry': "製造業", 'business_description': f"部品{i}の製造"} for i in range(count)]
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    yield str(tmp_path / 'state')
+    set_backend(None)
+
+
+def test_resumes_embedding_from_completed_batches(state_dir):
+    set_backend(CrashingBackend(fail_after=3))
+    with pytest.raises(RuntimeError):
+        bulk_match.embed_corpus(CompanyStore.from_companies(_companies(100)), 'stub', state_dir, batch_size=10, workers=1)
+    assert len(os.listdir(os.path.join(state_dir, 'batches'))) == 3
+
+    backend = StubBackend(dim=16)
+    set_backend(backend)
+    store = CompanyStore.from_companies(_companies(100))
+    stats = bulk_match.embed_corpus(store, 'stub', state_dir, batch_size=10, workers=3)
+
+    assert stats == {'reused': 30, 'embedded': 70}
+    assert backend.calls['embed'] == 7
+    assert not os.path.exists(os.path.join(state_dir, 'batches'))
+    assert np.allclose(store.embeddings[0], backend.embed('m', [bulk_match.company_text(store[0])]).vectors[0], atol=1e-6)
+
+
+def test_only_changed_rows_are_re_embedded(state_dir):
+    set_backend(StubBackend(dim=16))
+    bulk_match.embed_corpus(CompanyStore.from_companies(_companies(20)), 'stub', state_dir, batch_size=8)
+
+    companies = _companies(21)
+    companies[5]['business_description'] = "変更後の説明"
+    stats = bulk_match.embed_corpus(CompanyStore.from_companies(companies), 'stub', state_dir, batch_size=8)
+    assert stats == {'reused': 19, 'embedded': 2}
+
+
+def test_ingest_corpus_embeds_chunk_by_chunk_and_skips_bad_rows(state_dir, tmp_path, capsys):
+    filepath = tmp_path / 'corpus.csv'
+    lines = ["company_name,industry,business_description"]
+    lines += [f"企業{i},製造業,部品{i}の製造" for i in range(25)]
+    lines.insert(4, "不完全な企業,,説明")
+    filepath.write_text("\n".join(lines) + "\n", encoding='cp932')
+
+    set_backend(StubBackend(dim=16))
+    store, stats = bulk_match.ingest_corpus(str(filepath), 'stub', state_dir, chunk_size=10, batch_size=4)
+
+    assert len(store) == 25
+    assert stats == {'reused': 0, 'embedded': 25, 'invalid_rows': 1}
+    assert len(store.missing_embedding_rows()) == 0
+    assert "5行目" in capsys.readouterr().err
+
+    _, stats = bulk_match.ingest_corpus(str(filepath), 'stub', state_dir, chunk_size=7)
+    assert stats['reused'] == 25 and stats['embedded'] == 0
+
+
+@pytest.mark.parametrize('top_k', ['0', '-3'])
+def test_top_k_below_one_is_rejected(top_k, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['bulk_match.py', 'companies.csv', '--partners', '--output', str(tmp_path / 'out.jsonl'), '--top-k', top_k])
+
+    with pytest.raises(SystemExit) as exit_info:
+        bulk_match.main()
+
+    assert exit_info.value.code == 2
+    assert "--top-k" in capsys.readouterr().err
+    assert not os.path.exists(tmp_path / 'out.jsonl')
@@ -0,0 +1,91 @@
+"""
+過去事例ライブラリのテスト
+"""
+
+import numpy as np
+import pytest
+
+import case_library
+import matching_algorithm
+from case_library import CaseLibrary, case_text, get_case_library
+from conftest import API_KEY, COMPANY_A, COMPANY_B
+
+CASES = [
+    {'title': f"事例{i}", 'date': "2024-01-01", 'description': f"協業事例{i}の説明", 'roi': f"{100 + i}%"}
+    for i in range(8)
+]
+
+
+def _library(stub_backend, model):
+    embeddings = stub_backend.embed(model, [case_text(case) for case in CASES]).vectors
+    stub_backend.calls['embed'] = 0
+    return CaseLibrary.build(CASES, embeddings, model, n_lists=2)
+
+
+def test_hyde_embedding_from_another_model_is_re_embedded(stub_backend, monkeypatch):
+    # スタブの埋め込みはモデルによらず同じ次元になる
+    library = _library(stub_backend, 'text-embedding-3-small')
+    monkeypatch.setattr(matching_algorithm, 'get_case_library', lambda: library)
+    hyde_embedding = stub_backend.embed(matching_algorithm.EMBEDDING_MODEL, ["別の文書"]).vectors[0]
+    stub_backend.calls['embed'] = 0
+
+    cases = matching_algorithm.find_similar_past_cases("HyDE文書", api_key=API_KEY, hyde_embedding=hyde_embedding)
+
+    assert stub_backend.calls['embed'] == 1
+    assert cases == library.search(stub_backend.embed(library.model, ["HyDE文書"]).vectors[0])
+
+
+def test_hyde_embedding_from_the_library_model_is_reused(stub_backend, monkeypatch):
+    library = _library(stub_backend, matching_algorithm.EMBEDDING_MODEL)
+    monkeypatch.setattr(matching_algorithm, 'get_case_library', lambda: library)
+    hyde_embedding = stub_backend.embed(library.model, [case_text(CASES[3])]).vectors[0]
+    stub_backend.calls['embed'] = 0
+
+    cases = matching_algorithm.find_similar_past_cases("HyDE文書", api_key=API_KEY, hyde_embedding=hyde_embedding)
+
+    assert stub_backend.calls['embed'] == 0
+    assert cases[0]['title'] == "事例3"
+    assert np.isclose(cases[0]['similarity'], 1.0, atol=1e-3)
+
+
+def test_search_returns_nearest_cases_with_similarity(stub_backend):
+    library = _library(stub_backend, 'model')
+    query = stub_backend.embed('model', [case_text(CASES[5])]).vectors[0]
+
+    cases = library.search(query, k=3)
+
+    assert len(cases) == 3 and cases[0]['title'] == "事例5"
+    assert [case['similarity'] for case in cases] == sorted((case['similarity'] for case in cases), reverse=True)
+    assert set(cases[0]) == {'title', 'date', 'description', 'roi', 'similarity'}
+
+
+def test_cases_without_required_fields_are_rejected():
+    with pytest.raises(ValueError, match="roi"):
+        CaseLibrary.build([{'title': "事例", 'date': "2024-01-01", 'description': "説明"}], np.ones((1, 4), dtype=np.float32), 'model')
+
+
+def test_saved_library_is_loaded_from_case_library_dir(stub_backend, tmp_path, monkeypatch):
+    library = _library(stub_backend, 'model')
+    library.save(str(tmp_path))
+    monkeypatch.setenv('CASE_LIBRARY_DIR', str(tmp_path))
+    monkeypatch.setattr(case_library, '_default_library', None)
+    monkeypatch.setattr(case_library, '_default_library_loaded', False)
+
+    loaded = get_case_library()
+
+    assert loaded is get_case_library()
+    assert len(loaded) == len(CASES) and loaded.model == 'model' and loaded.dim == library.dim
+    query = stub_backend.embed('model', [case_text(CASES[2])]).vectors[0]
+    assert loaded.search(query) == library.search(query)
+
+
+def test_report_retrieves_past_cases_instead_of_generating_them(stub_backend, monkeypatch):
+    library = _library(stub_backend, matching_algorithm.EMBEDDING_MODEL)
+    monkeypatch.setattr(matching_algorithm, 'get_case_library', lambda: library)
+
+    report = matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='multi')
+
+    # スコア算出の埋め込みを再利用するため、過去事例のための LLM 呼び出しも埋め込みも行わない
+    assert stub_backend.calls == {'chat': 5, 'embed': 1}
+    assert {case['title'] for case in report['past_cases']} <= {case['title'] for case in CASES}
+    assert report['metrics']['stages']['past_cases']['calls'] == 1
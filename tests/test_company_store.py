@@ -0,0 +1,88 @@
+"""
+列指向の企業データストアのテスト
+"""
+
+import numpy as np
+import pytest
+
+from company_store import INITIAL_CAPACITY, CompanyRecord, CompanyStore
+from conftest import API_KEY, COMPANY_A
+from matching_algorithm import rank_companies
+from vector_codec import CompactVectors
+
+
+def _companies(count, industries=("製造業", "宿泊業", "小売業")):
+    return [{"company_name": f"企業{i}", "industry": industries[i % len(industries)], "business_description": f"事業内容{i}"}
+            for i in range(count)]
+
+
+def test_records_behave_like_company_dicts():
+    store = CompanyStore.from_companies(_companies(3))
+    record = store[1]
+
+    assert isinstance(record, CompanyRecord) and not hasattr(record, '__dict__')
+    assert record['company_name'] == "企業1" and record.get('industry') == "宿泊業"
+    assert record.to_dict() == _companies(3)[1]
+    assert store[-1].row_id == 2
+    with pytest.raises(KeyError):
+        record['missing']
+    with pytest.raises(IndexError):
+        store[3]
+
+
+def test_industries_are_dictionary_encoded():
+    store = CompanyStore.from_companies(_companies(9))
+
+    assert store.industries == ["製造業", "宿泊業", "小売業"]
+    assert store.industry_codes.tolist() == [0, 1, 2] * 3
+    assert store.rows_in_industry("宿泊業").tolist() == [1, 4, 7]
+    assert store.rows_in_industry("建設業").tolist() == []
+    # 同じ業種の文字列は1つのオブジェクトを共有する
+    assert store[0]['industry'] is store[3]['industry']
+
+
+def test_embeddings_survive_growth_beyond_initial_capacity():
+    store = CompanyStore(vector_format='float32')
+    store.extend(_companies(2))
+    vectors = np.random.default_rng(0).standard_normal((2, 8)).astype(np.float32)
+    store.set_embeddings([0, 1], vectors)
+
+    store.extend(_companies(INITIAL_CAPACITY + 10))
+
+    assert len(store) == INITIAL_CAPACITY + 12
+    embeddings = store.embeddings
+    assert embeddings.shape == (len(store), 8) and embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings[:2], vectors / np.linalg.norm(vectors, axis=1, keepdims=True), atol=1e-6)
+    assert store.missing_embedding_rows().tolist() == list(range(2, len(store)))
+    assert store.has_embeddings([0, 2]).tolist() == [True, False]
+
+
+@pytest.mark.parametrize('vector_format', ['float16', 'int8'])
+def test_embeddings_are_kept_only_in_the_compact_format(vector_format):
+    store = CompanyStore.from_companies(_companies(4), vector_format=vector_format)
+    store.set_embeddings(range(4), np.random.default_rng(1).standard_normal((4, 16)))
+
+    compact = store.compact_embeddings()
+    assert compact.format == vector_format and compact.codes.dtype == np.dtype(vector_format)
+    with pytest.raises(ValueError):
+        store.set_compact_embeddings([0], CompactVectors.encode(np.ones((1, 16)), 'float32'))
+    with pytest.raises(ValueError):
+        store.set_embeddings([0], np.ones((1, 8)))
+
+
+def test_from_csv_skips_invalid_rows(tmp_path):
+    filepath = tmp_path / 'companies.csv'
+    filepath.write_text("company_name,industry,business_description\n企業A,製造業,説明A\n企業B,,説明B\n企業C,小売業,説明C\n", encoding='utf-8')
+
+    store = CompanyStore.from_csv(str(filepath), chunk_size=1)
+
+    assert [record['company_name'] for record in store] == ["企業A", "企業C"]
+
+
+def test_matching_accepts_store_and_list_alike(stub_backend):
+    companies = _companies(12)
+
+    from_list = rank_companies(COMPANY_A, companies, api_key=API_KEY)
+    from_store = rank_companies(COMPANY_A, CompanyStore.from_companies(companies), api_key=API_KEY)
+
+    assert [entry['company_name'] for entry in from_store['results']] == [entry['company_name'] for entry in from_list['results']]
@@ -0,0 +1,69 @@
+"""
+LLM 応答キャッシュのテスト
+"""
+
+import time
+
+import matching_algorithm
+from completion_cache import CompletionCache, LRUCache, completion_key
+from conftest import API_KEY
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1, ttl=60)
+    cache.put('b', 2, ttl=60)
+    cache.get('a')
+    cache.put('c', 3, ttl=60)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    cache.put('short', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('short') is None
+
+
+def test_key_depends_on_every_request_field():
+    base = completion_key('gpt-4o', 'system', 'user', {'temperature': 0})
+
+    assert completion_key('gpt-4o', 'system', 'user', {'temperature': 0}) == base
+    assert completion_key('gpt-4o-mini', 'system', 'user', {'temperature': 0}) != base
+    assert completion_key('gpt-4o', 'other', 'user', {'temperature': 0}) != base
+    assert completion_key('gpt-4o', 'system', 'other', {'temperature': 0}) != base
+    assert completion_key('gpt-4o', 'system', 'user', {'temperature': 1}) != base
+
+
+def test_stages_without_ttl_are_not_cached():
+    cache = CompletionCache(stage_ttls={'query_expansion': 60, 'strategies': 0})
+    cache.put('strategies', 'key', 'value')
+    cache.put('query_expansion', 'key', 'value')
+
+    assert cache.get('strategies', 'key') is None
+    assert cache.get('query_expansion', 'key') == 'value'
+    assert cache.stats() == {'query_expansion': {'hits': 1, 'misses': 0}}
+
+
+def test_sqlite_store_is_shared_between_caches(tmp_path):
+    path = str(tmp_path / 'completions.db')
+    writer = CompletionCache(sqlite_path=path, stage_ttls={'query_expansion': 60})
+    reader = CompletionCache(sqlite_path=path, stage_ttls={'query_expansion': 60})
+
+    writer.put('query_expansion', 'key', 'キーワード')
+
+    assert reader.get('query_expansion', 'key') == 'キーワード'
+    # SQLite でヒットした応答はメモリにも載る
+    assert reader.memory.get('key') == 'キーワード'
+
+
+def test_query_expansion_is_served_from_cache(stub_backend, monkeypatch):
+    cache = CompletionCache(stage_ttls={'query_expansion': 60})
+    monkeypatch.setattr(matching_algorithm, 'get_completion_cache', lambda: cache)
+
+    first = matching_algorithm.generate_query_expansion("製造業", "和菓子の製造", api_key=API_KEY)
+    second = matching_algorithm.generate_query_expansion("製造業", "和菓子の製造", api_key=API_KEY)
+    matching_algorithm.generate_query_expansion("宿泊業", "旅館の運営", api_key=API_KEY)
+
+    assert first == second
+    assert stub_backend.calls['chat'] == 2
+    assert cache.stats()['query_expansion'] == {'hits': 1, 'misses': 2}
@@ -0,0 +1,83 @@
+import codecs
+
+import pytest
+
+from csv_extractor import detect_encoding, iter_company_chunks, process_csv_rows
+
+HEADER = "company_name,industry,business_description\n"
+ROWS = "株式会社サンプル製菓,製造業,和菓子の製造・販売\nサンプル観光ホテル,宿泊業,温泉旅館の運営\n"
+
+
+def _write(tmp_path, content: bytes, name='companies.csv'):
+    filepath = tmp_path / name
+    filepath.write_bytes(content)
+    return str(filepath)
+
+
+@pytest.mark.parametrize('encoding, expected', [
+    ('utf-8', 'utf-8'),
+    ('cp932', 'cp932'),
+    ('euc_jp', 'euc_jp')
+])
+def test_detects_japanese_encodings(tmp_path, encoding, expected):
+    filepath = _write(tmp_path, (HEADER + ROWS).encode(encoding))
+
+    assert detect_encoding(filepath) == expected
+    records = [record for chunk in iter_company_chunks(filepath) for record in chunk['records']]
+    assert [record['company_name'] for record in records] == ["株式会社サンプル製菓", "サンプル観光ホテル"]
+
+
+def test_detects_utf8_bom(tmp_path):
+    filepath = _write(tmp_path, codecs.BOM_UTF8 + (HEADER + ROWS).encode('utf-8'))
+
+    assert detect_encoding(filepath) == 'utf-8-sig'
+    chunk = next(iter_company_chunks(filepath))
+    assert chunk['records'][0]['company_name'] == "株式会社サンプル製菓"
+
+
+def test_multibyte_character_split_at_sample_boundary(tmp_path):
+    content = (HEADER + ROWS * 50).encode('cp932')
+    filepath = _write(tmp_path, content)
+
+    # サンプルの末尾がマルチバイト文字の途中で切れても cp932 と判定する
+    for sample_size in range(len(HEADER) + 1, len(HEADER) + 8):
+        assert detect_encoding(filepath, sample_size=sample_size) == 'cp932'
+
+
+def test_bad_rows_are_reported_without_stopping(tmp_path):
+    content = (
+        HEADER
+        + "企業A,製造業,説明A\n"
+        + "企業B,,説明B\n"
+        + "企業C,小売業,説明C,余分な列\n"
+    ).encode('cp932') + "企業D,飲食業,".encode('cp932') + b"\x85\x40\n" + "企業E,建設業,説明E\n".encode('cp932')
+    filepath = _write(tmp_path, content)
+
+    chunks = list(iter_company_chunks(filepath, chunk_size=1, encoding='cp932'))
+
+    records = [record['company_name'] for chunk in chunks for record in chunk['records']]
+    errors = [error for chunk in chunks for error in chunk['errors']]
+    assert records == ["企業A", "企業E"]
+    assert [error['line'] for error in errors] == [3, 4, 5]
+    assert "industry" in errors[0]['message']
+    assert "列数" in errors[1]['message']
+    assert "cp932" in errors[2]['message']
+    assert all(len(chunk['records']) <= 1 for chunk in chunks)
+
+
+def test_missing_columns_are_rejected(tmp_path):
+    filepath = _write(tmp_path, "company_name,industry\n企業A,製造業\n".encode('utf-8'))
+
+    with pytest.raises(ValueError, match="business_description"):
+        next(iter_company_chunks(filepath))
+    assert process_csv_rows(filepath)['status'] == 'error'
+
+
+def test_process_csv_rows_collects_records_and_errors(tmp_path):
+    filepath = _write(tmp_path, (HEADER + ROWS + "企業C,,\n").encode('utf-8'))
+
+    result = process_csv_rows(filepath)
+
+    assert result['status'] == 'success'
+    assert len(result['data']) == 2
+    assert result['errors'][0]['line'] == 4
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import matching_algorithm
+from conftest import API_KEY
+from embedding_cache import EmbeddingCache
+from similarity import normalize_rows
+
+
+def _vectors(count, dim=8, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32))
+
+
+@pytest.mark.parametrize('vector_format, tolerance', [('float32', 0), ('float16', 1e-3), ('int8', 1e-2)])
+def test_round_trip(tmp_path, vector_format, tolerance):
+    cache = EmbeddingCache(str(tmp_path), max_entries=10, vector_format=vector_format)
+    vectors = _vectors(3)
+    cache.put_many('model', ['a', 'b', 'c'], vectors)
+
+    results = cache.get_many('model', ['a', 'missing', 'c'])
+
+    assert results[1] is None
+    np.testing.assert_allclose(results[0], vectors[0], atol=tolerance)
+    np.testing.assert_allclose(results[2], vectors[2], atol=tolerance)
+    assert cache.get('other-model', 'a') is None
+
+
+def test_least_recently_used_entry_is_replaced(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=2)
+    vectors = _vectors(3)
+    cache.put('model', 'a', vectors[0])
+    cache.put('model', 'b', vectors[1])
+    cache.get('model', 'a')
+    cache.put('model', 'c', vectors[2])
+
+    assert cache.get('model', 'b') is None
+    np.testing.assert_array_equal(cache.get('model', 'a'), vectors[0])
+    np.testing.assert_array_equal(cache.get('model', 'c'), vectors[2])
+
+
+def test_entries_are_shared_between_cache_instances(tmp_path):
+    # 別プロセスのキャッシュと同じく、同じディレクトリのシャードを共有する
+    writer = EmbeddingCache(str(tmp_path), max_entries=10)
+    reader = EmbeddingCache(str(tmp_path), max_entries=10)
+    assert reader.get('model', 'a') is None
+
+    vector = _vectors(1)[0]
+    writer.put('model', 'a', vector)
+
+    np.testing.assert_array_equal(reader.get('model', 'a'), vector)
+    assert reader.preload('model') and not reader.preload('unknown-model')
+
+
+def test_vectors_with_other_dimensions_are_not_stored(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=10)
+    cache.put('model', 'a', _vectors(1, dim=8)[0])
+    cache.put('model', 'b', _vectors(1, dim=4)[0])
+
+    assert cache.get('model', 'b') is None
+
+
+def test_get_embeddings_only_embeds_uncached_texts(stub_backend, tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path), max_entries=100)
+    monkeypatch.setattr(matching_algorithm, 'get_embedding_cache', lambda: cache)
+
+    first = matching_algorithm.get_embeddings(['a', 'b', 'a'], api_key=API_KEY)
+    assert stub_backend.calls['embed'] == 1
+
+    second = matching_algorithm.get_embeddings(['b', 'a'], api_key=API_KEY)
+    assert stub_backend.calls['embed'] == 1
+    np.testing.assert_array_equal(second, first[[1, 0]])
+
+    matching_algorithm.get_embeddings(['a', 'c'], api_key=API_KEY)
+    assert stub_backend.calls['embed'] == 2
@@ -0,0 +1,39 @@
+"""
+複数テキストの埋め込みを一括で取得する get_embeddings のテスト
+"""
+
+import numpy as np
+import pytest
+
+import matching_algorithm
+from conftest import API_KEY, COMPANY_A, COMPANY_B
+
+
+def test_texts_are_embedded_in_one_request_in_input_order(stub_backend):
+    vectors = matching_algorithm.get_embeddings(['b', 'a', 'b'], api_key=API_KEY)
+
+    assert stub_backend.calls['embed'] == 1
+    assert vectors.shape == (3, stub_backend.dim) and vectors.dtype == np.float32
+    np.testing.assert_array_equal(vectors, stub_backend.embed('model', ['b', 'a', 'b']).vectors)
+
+
+def test_large_inputs_are_split_into_batches(stub_backend, monkeypatch):
+    monkeypatch.setattr(matching_algorithm, 'EMBEDDING_BATCH_SIZE', 2)
+
+    vectors = matching_algorithm.get_embeddings([f"テキスト{i}" for i in range(5)], api_key=API_KEY)
+
+    assert stub_backend.calls['embed'] == 3
+    assert len(vectors) == 5
+
+
+def test_matching_score_embeds_all_texts_in_one_request(stub_backend):
+    matching_algorithm.calculate_matching_score(COMPANY_A, COMPANY_B, api_key=API_KEY)
+
+    # 拡張した企業A・企業BとHyDEドキュメントの3件を1回で埋め込む
+    assert stub_backend.calls['embed'] == 1
+
+
+def test_empty_input_and_missing_api_key():
+    assert matching_algorithm.get_embeddings([], api_key=API_KEY).shape == (0, 0)
+    with pytest.raises(ValueError):
+        matching_algorithm.get_embeddings(['a'])
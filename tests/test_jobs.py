@@ -0,0 +1,171 @@
+"""
+バックグラウンドジョブのテスト
+"""
+
+import time
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from conftest import upload_session
+from jobs import JobQueue, MemoryJobStore, QueueFullError, SqliteJobStore, CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("条件が満たされませんでした")
+        time.sleep(0.01)
+
+
+def _cancellable(started: threading.Event, cancel_event=None):
+    """取り消されるまで待つジョブ"""
+    started.set()
+    while not cancel_event.wait(0.01):
+        pass
+    raise CancelledError()
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store_factory(request, tmp_path):
+    if request.param == 'memory':
+        store = MemoryJobStore()
+        return lambda: store
+    return lambda: SqliteJobStore(str(tmp_path / 'jobs.db'))
+
+
+def test_job_succeeds_and_keeps_result(store_factory):
+    queue = JobQueue(max_workers=1, store=store_factory())
+    try:
+        job_id = queue.submit(lambda value, cancel_event=None: {'value': value}, 3, kind='test')
+        _wait_for(lambda: queue.get(job_id).status == SUCCEEDED)
+
+        job = queue.get(job_id)
+        assert job.kind == 'test'
+        assert job.result == {'value': 3}
+        assert job.started_at is not None and job.finished_at >= job.started_at
+        _wait_for(lambda: queue.queue_depth() == 0)
+    finally:
+        queue.shutdown()
+
+
+def test_job_failure_records_error(store_factory):
+    def fail(cancel_event=None):
+        raise ValueError("失敗しました")
+
+    queue = JobQueue(max_workers=1, store=store_factory())
+    try:
+        job_id = queue.submit(fail)
+        _wait_for(lambda: queue.get(job_id).status == FAILED)
+        assert queue.get(job_id).error == "失敗しました"
+        assert queue.get(job_id).result is None
+    finally:
+        queue.shutdown()
+
+
+def test_cancel_queued_and_running_jobs(store_factory):
+    queue = JobQueue(max_workers=1, store=store_factory())
+    try:
+        started = threading.Event()
+        running = queue.submit(_cancellable, started)
+        assert started.wait(5)
+        queued = queue.submit(lambda cancel_event=None: 'unused')
+        assert queue.get(queued).status == QUEUED
+        assert queue.get(running).status == RUNNING
+
+        assert queue.cancel(queued)
+        assert queue.get(queued).status == CANCELLED
+        assert queue.cancel(running)
+        _wait_for(lambda: queue.get(running).status == CANCELLED)
+
+        # 終了済みのジョブは取り消せない
+        assert not queue.cancel(running)
+        assert not queue.cancel('missing')
+        _wait_for(lambda: queue.queue_depth() == 0)
+    finally:
+        queue.shutdown()
+
+
+def test_queue_depth_limit():
+    queue = JobQueue(max_workers=1, max_queue_depth=1)
+    started = threading.Event()
+    try:
+        job_id = queue.submit(_cancellable, started)
+        with pytest.raises(QueueFullError):
+            queue.submit(lambda cancel_event=None: None)
+        queue.cancel(job_id)
+    finally:
+        queue.shutdown()
+
+
+def test_shared_store_serves_other_workers(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    # 同じジョブストアを共有する2つのワーカー
+    worker_a = JobQueue(max_workers=1, store=SqliteJobStore(path), cancel_poll_interval=0.02)
+    worker_b = JobQueue(max_workers=1, store=SqliteJobStore(path), cancel_poll_interval=0.02)
+    try:
+        done = worker_a.submit(lambda cancel_event=None: {'matching_score': 80})
+        _wait_for(lambda: worker_b.get(done) is not None and worker_b.get(done).status == SUCCEEDED)
+        assert worker_b.get(done).result == {'matching_score': 80}
+
+        # 別のワーカーで実行中のジョブも取り消せる
+        started = threading.Event()
+        running = worker_a.submit(_cancellable, started)
+        assert started.wait(5)
+        assert worker_b.cancel(running)
+        _wait_for(lambda: worker_b.get(running).status == CANCELLED)
+    finally:
+        worker_a.shutdown()
+        worker_b.shutdown()
+
+
+def test_finished_jobs_are_pruned(store_factory):
+    queue = JobQueue(max_workers=1, max_finished_jobs=1, store=store_factory())
+    try:
+        first = queue.submit(lambda cancel_event=None: 1)
+        _wait_for(lambda: queue.get(first).status == SUCCEEDED)
+        second = queue.submit(lambda cancel_event=None: 2)
+        _wait_for(lambda: queue.get(second).status == SUCCEEDED)
+        queue.submit(lambda cancel_event=None: 3)
+
+        assert queue.get(first) is None
+        assert queue.get(second) is not None
+    finally:
+        queue.shutdown()
+
+
+def test_matching_results_job_endpoints(client):
+    session_id = upload_session(client)
+    try:
+        response = client.post('/api/jobs/matching_results', json={'session_id': session_id})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+
+        def status():
+            return client.get(f'/api/jobs/{job_id}').get_json()['job']['status']
+
+        _wait_for(lambda: status() not in (QUEUED, RUNNING), timeout=10)
+        assert status() == SUCCEEDED
+
+        result = client.get(f'/api/jobs/{job_id}/result')
+        assert result.status_code == 200
+        assert result.headers['ETag']
+        report = result.get_json()['results']
+        assert report['matching_score'] is not None
+
+        # ジョブの結果はセッションにも保存され、ETag で再検証できる
+        cached = client.get('/api/matching_results', query_string={'session_id': session_id}, headers={'If-None-Match': result.headers['ETag']})
+        assert cached.status_code == 304
+
+        assert client.post(f'/api/jobs/{job_id}/cancel').status_code == 409
+    finally:
+        client.post('/api/cleanup_session', json={'session_id': session_id})
+
+
+def test_job_endpoints_reject_unknown_jobs_and_sessions(client):
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/result').status_code == 404
+    assert client.post('/api/jobs/missing/cancel').status_code == 404
+    assert client.post('/api/jobs/matching_results', json={'session_id': 'missing'}).status_code == 400
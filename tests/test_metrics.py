@@ -0,0 +1,64 @@
+"""
+呼び出しごとの計測と /metrics のテスト
+"""
+
+import pytest
+
+from conftest import API_KEY, COMPANY_A, COMPANY_B
+from matching_algorithm import generate_matching_report
+from metrics import CallRecord, MetricsRegistry, call_cost, collect_report_metrics, record_call
+
+
+def test_report_metrics_total_every_stage(stub_backend):
+    report = generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='multi')
+    metrics = report['metrics']
+
+    assert set(metrics['stages']) >= {'query_expansion', 'hyde_document', 'embeddings', 'past_cases', 'strategies', 'matching_details'}
+    assert metrics['calls'] == sum(stage['calls'] for stage in metrics['stages'].values())
+    assert metrics['calls'] == stub_backend.calls['chat'] + stub_backend.calls['embed']
+    assert metrics['prompt_tokens'] > 0 and metrics['completion_tokens'] > 0 and metrics['cost_usd'] > 0
+    assert metrics['models'] == ['gpt-4o', 'text-embedding-ada-002']
+    assert metrics['duration_seconds'] > 0
+
+
+def test_cache_hits_are_counted_without_tokens_or_cost():
+    with collect_report_metrics() as report:
+        record_call('query_expansion', 'chat', 'gpt-4o', 0.5, prompt_tokens=100, completion_tokens=50)
+        record_call('query_expansion', 'chat', 'gpt-4o', 0.001, prompt_tokens=100, completion_tokens=50, cache_hit=True)
+        record_call('embeddings', 'embedding', 'text-embedding-ada-002', 0.2, prompt_tokens=30, retries=2)
+
+    summary = report.summary()
+    assert summary['calls'] == 3 and summary['cache_hits'] == 1 and summary['retries'] == 2
+    assert summary['prompt_tokens'] == 130 and summary['completion_tokens'] == 50
+    assert summary['cost_usd'] == pytest.approx(call_cost('gpt-4o', 100, 50) + call_cost('text-embedding-ada-002', 30, 0), abs=1e-6)
+    assert summary['stages']['query_expansion']['cache_hits'] == 1
+    assert call_cost('unknown-model', 100, 100) == 0.0
+
+
+def test_registry_renders_prometheus_histograms_and_counters():
+    registry = MetricsRegistry()
+    registry.observe_call(CallRecord('strategies', 'chat', 'gpt-4o', 0.3, prompt_tokens=10, completion_tokens=5))
+    registry.observe_report(4.0)
+
+    text = registry.render()
+    assert '# TYPE matching_llm_call_duration_seconds histogram' in text
+    assert 'matching_llm_call_duration_seconds_bucket{stage="strategies",kind="chat",model="gpt-4o",cache="miss",le="0.5"} 1' in text
+    assert 'matching_llm_calls_total{stage="strategies",kind="chat",model="gpt-4o",cache="miss"} 1' in text
+    assert 'matching_llm_tokens_total{stage="strategies",model="gpt-4o",type="completion"} 5' in text
+    assert 'matching_report_duration_seconds_count 1' in text
+    assert 'openai_scheduler_requests_total' in text
+
+
+def test_metrics_endpoints(client, stub_backend):
+    generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY)
+    response = client.get('/metrics')
+
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'matching_llm_calls_total{stage="matching_details"' in body
+    assert 'matching_job_queue_depth' in body
+
+    import run_server
+    server_response = run_server.app.test_client().get('/metrics')
+    assert server_response.status_code == 200
+    assert 'matching_llm_calls_total' in server_response.get_data(as_text=True)
@@ -0,0 +1,87 @@
+"""
+モデルバックエンド（オフラインのスタブ）とベンチマークのテスト
+"""
+
+import json
+import time
+
+import numpy as np
+import openai
+import pytest
+
+import benchmark
+import model_backend
+from model_backend import STUB_CHAT_RESPONSE, StubBackend, get_backend, set_backend
+from rate_limiter import RequestScheduler
+
+MESSAGES = [{'role': 'user', 'content': "テスト"}]
+
+
+def test_stub_embeddings_are_deterministic_unit_vectors():
+    backend = StubBackend(dim=16)
+    first = backend.embed('model', ['a', 'b']).vectors
+    second = StubBackend(dim=16).embed('model', ['b', 'a']).vectors
+
+    assert first.shape == (2, 16) and first.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-6)
+    np.testing.assert_array_equal(first, second[::-1])
+    assert backend.embed('model', ['a'], dimensions=8).vectors.shape == (1, 8)
+
+
+def test_stub_completions_are_canned_and_streamable():
+    backend = StubBackend()
+
+    assert backend.chat('gpt-4o', MESSAGES).content == STUB_CHAT_RESPONSE
+    assert "".join(backend.chat_stream('gpt-4o', MESSAGES)) == STUB_CHAT_RESPONSE
+    assert 'cases' in json.loads(backend.chat('gpt-4o', MESSAGES, response_format={'type': 'json_object'}).content)
+    schema = {'type': 'json_schema', 'json_schema': {'schema': {'properties': {'strategies': {}}}}}
+    assert list(json.loads(backend.chat('gpt-4o', MESSAGES, response_format=schema).content)) == ['strategies']
+    assert backend.calls == {'chat': 4, 'embed': 0}
+
+
+def test_stub_simulates_latency_and_transient_errors():
+    slow = StubBackend(latency=0.05)
+    start = time.perf_counter()
+    slow.chat('gpt-4o', MESSAGES)
+    assert time.perf_counter() - start >= 0.05
+
+    failing = StubBackend(error_rate=1.0)
+    with pytest.raises(openai.InternalServerError):
+        failing.chat('gpt-4o', MESSAGES)
+
+    # 模擬エラーはスケジューラの再試行の対象になる
+    scheduler = RequestScheduler(max_retries=2, base_delay=0)
+    with pytest.raises(openai.InternalServerError):
+        scheduler.call('gpt-4o', lambda: failing.chat('gpt-4o', MESSAGES))
+    assert failing.calls['chat'] == 4 and scheduler.stats['retries'] == 2
+
+
+def test_backend_selection(monkeypatch):
+    override = StubBackend()
+    set_backend(override)
+    try:
+        assert get_backend('key') is override
+    finally:
+        set_backend(None)
+
+    monkeypatch.setattr(model_backend, '_stub_backend', None)
+    monkeypatch.setenv('MODEL_BACKEND', 'stub')
+    monkeypatch.setenv('STUB_LATENCY', '0.01')
+    stub = get_backend('key')
+    assert isinstance(stub, StubBackend) and stub.latency == 0.01
+    assert get_backend('key') is stub
+
+
+def test_benchmark_writes_machine_readable_results(tmp_path, monkeypatch):
+    output = tmp_path / 'bench.json'
+    monkeypatch.setattr('sys.argv', ['benchmark.py', '--sizes', '20', '--repeat', '2', '--output', str(output)])
+
+    benchmark.main()
+
+    report = json.loads(output.read_text(encoding='utf-8'))
+    names = [result['name'] for result in report['results']]
+    assert names == ['calculate_matching_score', 'generate_matching_report', 'csv_ingestion', 'rank_companies_cold', 'rank_companies_warm']
+    for result in report['results']:
+        assert result['runs'] == 2 and 0 <= result['min_ms'] <= result['p50_ms'] <= result['max_ms']
+    assert report['results'][2]['params'] == {'corpus_size': 20}
+    assert report['backend']['calls']['chat'] > 0
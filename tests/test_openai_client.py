@@ -0,0 +1,64 @@
+"""
+共有 OpenAI クライアントのテスト
+"""
+
+import threading
+
+import pytest
+
+import openai_client
+from model_backend import OpenAIBackend
+from openai_client import close_openai_clients, get_openai_client
+
+
+@pytest.fixture(autouse=True)
+def _close_clients():
+    yield
+    close_openai_clients()
+
+
+def test_client_is_shared_per_api_key_and_base_url():
+    client = get_openai_client('key-a')
+
+    assert get_openai_client('key-a') is client
+    assert OpenAIBackend('key-a').client is client
+    assert get_openai_client('key-b') is not client
+    assert get_openai_client('key-a', base_url='http://localhost:8080/v1') is not client
+
+
+def test_concurrent_requests_get_one_client():
+    clients = []
+    barrier = threading.Barrier(8)
+
+    def get():
+        barrier.wait()
+        clients.append(get_openai_client('key-concurrent'))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
+
+
+def test_client_uses_pooled_connections_without_its_own_retries(monkeypatch):
+    monkeypatch.setattr(openai_client, 'MAX_CONNECTIONS', 7)
+    monkeypatch.setattr(openai_client, 'MAX_KEEPALIVE_CONNECTIONS', 3)
+
+    client = get_openai_client('key-pool')
+
+    pool = client._client._transport._pool
+    assert (pool._max_connections, pool._max_keepalive_connections) == (7, 3)
+    # リトライはスケジューラで行う
+    assert client.max_retries == 0
+
+
+def test_closed_clients_are_rebuilt():
+    client = get_openai_client('key-close')
+    close_openai_clients()
+
+    assert get_openai_client('key-close') is not client
+    with pytest.raises(ValueError):
+        get_openai_client('')
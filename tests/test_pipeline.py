@@ -0,0 +1,157 @@
+"""
+ステージ実行（DAG）と中間生成物のメモ化のテスト
+"""
+
+import time
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from conftest import API_KEY, COMPANY_A, COMPANY_B
+from matching_algorithm import calculate_matching_score, generate_matching_report
+from model_backend import StubBackend, set_backend
+from pipeline import PipelineContext, Stage, memoize, run_stages
+
+
+def test_stages_receive_dependency_results():
+    stages = [
+        Stage('a', lambda: 1),
+        Stage('b', lambda: 2),
+        Stage('sum', lambda a, b: a + b, depends_on=['a', 'b']),
+        Stage('double', lambda sum: sum * 2, depends_on=['sum'])
+    ]
+
+    results = run_stages(stages)
+
+    assert results == {'a': 1, 'b': 2, 'sum': 3, 'double': 6}
+
+
+def test_independent_stages_run_in_parallel():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait_for_others():
+        # 3つのステージが同時に実行されていなければタイムアウトする
+        barrier.wait()
+        return True
+
+    results = run_stages([Stage(str(i), wait_for_others) for i in range(3)], max_workers=3)
+
+    assert all(results.values())
+
+
+def test_dependent_stage_starts_after_its_dependencies():
+    finished = []
+
+    def slow():
+        time.sleep(0.05)
+        finished.append('slow')
+        return 'slow'
+
+    def after(slow):
+        finished.append('after')
+        return slow
+
+    run_stages([Stage('after', after, depends_on=['slow']), Stage('slow', slow)])
+
+    assert finished == ['slow', 'after']
+
+
+@pytest.mark.parametrize('stages, message', [
+    ([Stage('a', lambda: 1), Stage('a', lambda: 2)], "重複"),
+    ([Stage('a', lambda b: b, depends_on=['b'])], "存在しません"),
+    ([Stage('a', lambda b: b, depends_on=['b']), Stage('b', lambda a: a, depends_on=['a'])], "循環")
+])
+def test_invalid_graphs_are_rejected(stages, message):
+    with pytest.raises(ValueError, match=message):
+        run_stages(stages)
+
+
+def test_stage_error_cancels_pending_stages():
+    called = []
+
+    def fail():
+        raise RuntimeError("失敗")
+
+    with pytest.raises(RuntimeError):
+        run_stages([Stage('fail', fail), Stage('next', lambda fail: called.append(fail), depends_on=['fail'])])
+
+    assert called == []
+
+
+def test_cancel_event_stops_at_stage_boundary():
+    cancel_event = threading.Event()
+    called = []
+
+    def first():
+        cancel_event.set()
+        return 1
+
+    with pytest.raises(CancelledError):
+        run_stages([Stage('first', first), Stage('second', lambda first: called.append(first), depends_on=['first'])],
+                   cancel_event=cancel_event)
+
+    assert called == []
+
+
+def test_on_stage_complete_reports_each_stage():
+    completed = []
+
+    run_stages([Stage('a', lambda: 1), Stage('b', lambda a: a + 1, depends_on=['a'])],
+               on_stage_complete=lambda name, result: completed.append((name, result)))
+
+    assert completed == [('a', 1), ('b', 2)]
+
+
+def test_report_stages_overlap_llm_latency():
+    # 直列に実行すると 6 回以上の LLM 呼び出しの遅延が積み上がる
+    latency = 0.1
+    backend = StubBackend(dim=32, latency=latency)
+    set_backend(backend)
+    try:
+        start = time.perf_counter()
+        report = generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='multi')
+        elapsed = time.perf_counter() - start
+    finally:
+        set_backend(None)
+
+    assert report['matching_score'] is not None
+    assert elapsed < latency * backend.calls['chat']
+
+
+def test_context_computes_each_key_once_under_concurrency():
+    context = PipelineContext()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    threads = [threading.Thread(target=context.get_or_compute, args=('key', compute)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert context.get('key') == 'value' and 'key' in context
+
+
+def test_memoize_without_context_always_computes():
+    calls = []
+    memoize(None, 'key', lambda: calls.append(1))
+    memoize(None, 'key', lambda: calls.append(1))
+
+    assert len(calls) == 2
+
+
+def test_report_reuses_query_expansion_and_hyde_from_context(stub_backend):
+    context = PipelineContext()
+    calculate_matching_score(COMPANY_A, COMPANY_B, api_key=API_KEY, context=context)
+    # クエリ拡張2回とHyDE生成1回
+    assert stub_backend.calls['chat'] == 3
+
+    generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, context=context, mode='multi')
+    # レポートでは過去事例・戦略提案・マッチング詳細のみ生成する
+    assert stub_backend.calls['chat'] == 6
@@ -0,0 +1,71 @@
+"""
+1対多の順位付けとカスケード方式のテスト
+"""
+
+from company_store import CompanyStore
+from conftest import API_KEY, COMPANY_A, upload_session
+from matching_algorithm import rank_companies, rank_companies_cascade
+
+
+def _companies(count: int):
+    return [{"company_name": f"企業{i}", "industry": "製造業", "business_description": f"事業内容{i}"} for i in range(count)]
+
+
+def test_rank_companies_pages_in_similarity_order(stub_backend):
+    store = CompanyStore.from_companies(_companies(30))
+
+    full = rank_companies(COMPANY_A, store, api_key=API_KEY)
+    page = rank_companies(COMPANY_A, store, api_key=API_KEY, top_k=5, offset=10)
+
+    similarities = [entry['similarity'] for entry in full['results']]
+    assert similarities == sorted(similarities, reverse=True)
+    assert [entry['rank'] for entry in page['results']] == list(range(11, 16))
+    assert [entry['company_name'] for entry in page['results']] == [entry['company_name'] for entry in full['results'][10:15]]
+
+
+def test_cascade_keeps_stage_scores_separate_and_reranked_first(stub_backend):
+    store = CompanyStore.from_companies(_companies(20))
+    stage_one = rank_companies(COMPANY_A, store, api_key=API_KEY)
+
+    cascade = rank_companies_cascade(COMPANY_A, store, api_key=API_KEY, rerank_top_k=4)
+
+    results = cascade['results']
+    assert cascade['reranked'] == 4
+    assert [entry['reranked'] for entry in results] == [True] * 4 + [False] * 16
+    rerank_scores = [entry['rerank_score'] for entry in results[:4]]
+    assert rerank_scores == sorted(rerank_scores, reverse=True)
+    assert all(entry['rerank_score'] is None for entry in results[4:])
+
+    # matching_score は全候補で1段目の埋め込みスコアのまま
+    stage_one_scores = {entry['company_name']: entry['matching_score'] for entry in stage_one['results']}
+    assert all(entry['matching_score'] == stage_one_scores[entry['company_name']] for entry in results)
+    assert [entry['company_name'] for entry in results[4:]] == [entry['company_name'] for entry in stage_one['results'][4:]]
+    assert [entry['rank'] for entry in results] == list(range(1, 21))
+
+
+def test_cascade_respects_llm_call_budget(stub_backend):
+    store = CompanyStore.from_companies(_companies(20))
+
+    cascade = rank_companies_cascade(COMPANY_A, store, api_key=API_KEY, rerank_top_k=10, llm_call_budget=7)
+
+    # 対象企業のクエリ拡張1回＋候補ごとに2回
+    assert cascade['reranked'] == 3
+    assert stub_backend.calls['chat'] <= 7
+
+
+def test_rank_endpoint_keeps_rankings_out_of_the_session_record(client, stub_backend):
+    import app as app_module
+    session_id = upload_session(client)
+    try:
+        first = client.post('/api/rank_companies', json={'session_id': session_id, 'per_page': 5})
+        calls = dict(stub_backend.calls)
+        second = client.post('/api/rank_companies', json={'session_id': session_id, 'per_page': 5})
+
+        assert first.status_code == 200 and first.get_json()['total'] == 1
+        assert second.get_json()['results'] == first.get_json()['results']
+        # 2回目のページ要求はプロセス内に保持した順位付けを使う
+        assert stub_backend.calls == calls
+        assert not any(field.startswith('ranking') for field in app_module.session_store.get(session_id))
+        assert (0, None) in app_module.session_store.local(session_id)['rankings']
+    finally:
+        client.post('/api/cleanup_session', json={'session_id': session_id})
@@ -0,0 +1,116 @@
+"""
+リクエストスケジューラのテスト
+"""
+
+import time
+import threading
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+import matching_algorithm
+from conftest import API_KEY
+from model_backend import StubBackend, set_backend
+from rate_limiter import BULK, INTERACTIVE, RequestScheduler
+
+
+def test_token_bucket_wait_does_not_hold_concurrency_slot():
+    scheduler = RequestScheduler(default_rpm=1000000, default_tpm=600, max_concurrency=1)
+    # バケットを使い切り、次の呼び出しが約0.5秒待つようにする
+    scheduler.call('throttled', lambda: None, estimated_tokens=600)
+
+    waiting = threading.Thread(target=scheduler.call, args=('throttled', lambda: None), kwargs={'estimated_tokens': 5})
+    waiting.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    scheduler.call('other', lambda: None, estimated_tokens=5)
+    elapsed = time.monotonic() - start
+    waiting.join()
+
+    assert elapsed < 0.3
+
+
+def test_refund_uses_capped_reservation():
+    scheduler = RequestScheduler(default_rpm=1000000, default_tpm=100, max_concurrency=1)
+    usage = SimpleNamespace(usage=SimpleNamespace(total_tokens=50))
+
+    # 見積もり1000はバケット容量の100に切り詰めて予約され、実績50との差分50だけが戻る
+    scheduler.call('model', lambda: usage, estimated_tokens=1000)
+
+    tokens = scheduler._model_buckets('model')['tokens']
+    assert 49 <= tokens._tokens <= 52
+
+
+def test_interactive_call_overtakes_queued_bulk_calls_under_rpm_limit():
+    # 1分あたり240リクエスト（0.25秒に1件）のバケットを使い切る
+    scheduler = RequestScheduler(default_rpm=240, default_tpm=1000000, max_concurrency=8)
+    for _ in range(240):
+        scheduler.call('model', lambda: None)
+
+    finished = []
+
+    def call(name, priority):
+        scheduler.call('model', lambda: finished.append(name), priority=priority)
+
+    bulk_calls = [threading.Thread(target=call, args=(f'bulk{i}', BULK)) for i in range(3)]
+    for thread in bulk_calls:
+        thread.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    call('interactive', INTERACTIVE)
+    elapsed = time.monotonic() - start
+    for thread in bulk_calls:
+        thread.join()
+
+    # 先に待っていた一括処理より先に、最初に補充されたトークンで実行される
+    assert finished[0] == 'interactive'
+    assert elapsed < 0.4
+    assert sorted(finished[1:]) == ['bulk0', 'bulk1', 'bulk2']
+
+
+class _InterruptedStreamBackend(StubBackend):
+    """最初のストリームだけ途中で接続が切れるスタブ"""
+
+    def __init__(self, scheduler):
+        super().__init__(dim=32)
+        self.scheduler = scheduler
+        self.active_during_stream = []
+        self.streams = 0
+
+    def chat_stream(self, model, messages, **params):
+        self.streams += 1
+        interrupted = self.streams == 1
+
+        def deltas():
+            for delta in ("前半", "後半"):
+                self.active_during_stream.append(self.scheduler._gate.active)
+                yield delta
+                if interrupted:
+                    raise openai.APIConnectionError(request=httpx.Request('POST', 'https://stub.invalid/chat'))
+        return deltas()
+
+
+def test_streamed_completion_holds_slot_and_retries_interrupted_stream(monkeypatch):
+    scheduler = RequestScheduler(default_rpm=1000000, default_tpm=1000000, max_concurrency=1, base_delay=0)
+    monkeypatch.setattr(matching_algorithm, 'get_scheduler', lambda: scheduler)
+    backend = _InterruptedStreamBackend(scheduler)
+    set_backend(backend)
+    deltas = []
+    try:
+        content = matching_algorithm._chat_completion('matching_details', "system", "途中で切れるストリーム", api_key=API_KEY,
+                                                      on_delta=deltas.append)
+    finally:
+        set_backend(None)
+
+    assert content == "前半後半"
+    assert backend.streams == 2 and scheduler.stats['retries'] == 1
+    # 断片の読み込み中も同時実行枠を保持している
+    assert backend.active_during_stream and all(active == 1 for active in backend.active_during_stream)
+    # 再試行したストリームの断片は送らない
+    assert deltas == ["前半"]
+    # 見積もりとの差分がトークンバケットに戻されている（2回の試行でそれぞれ見積もりを予約）
+    tokens = scheduler._model_buckets('gpt-4o')['tokens']
+    assert tokens._tokens > tokens.capacity - 2 * matching_algorithm.COMPLETION_TOKEN_ESTIMATE
@@ -0,0 +1,68 @@
+"""
+レポートキャッシュと /api/matching_results の条件付き GET のテスト
+"""
+
+import matching_algorithm
+from conftest import API_KEY, COMPANY_A, COMPANY_B, upload_session
+from report_cache import ReportCache, report_etag, report_key
+
+
+def test_key_ignores_notation_differences_but_not_content():
+    key = report_key(COMPANY_A, COMPANY_B, 'v1')
+    padded = dict(COMPANY_A, company_name=f"  {COMPANY_A['company_name']} ")
+
+    assert report_key(padded, COMPANY_B, 'v1') == key
+    assert report_key(COMPANY_B, COMPANY_A, 'v1') != key
+    assert report_key(COMPANY_A, COMPANY_B, 'v2') != key
+
+
+def test_etag_ignores_metrics():
+    report = {'matching_score': 80, 'strategies': ['協業']}
+
+    assert report_etag({**report, 'metrics': {'total_seconds': 1}}) == report_etag(report)
+    assert report_etag({**report, 'matching_score': 81}) != report_etag(report)
+
+
+def test_identical_pair_is_served_from_cache(stub_backend, monkeypatch):
+    cache = ReportCache(ttl=60)
+    monkeypatch.setattr(matching_algorithm, 'get_report_cache', lambda: cache)
+
+    first = matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY)
+    calls = dict(stub_backend.calls)
+    second = matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY)
+
+    assert stub_backend.calls == calls
+    assert not first['metrics']['report_cache_hit'] and second['metrics']['report_cache_hit']
+    assert report_etag(first) == report_etag(second)
+    assert cache.stats()['hits'] == 1
+
+
+def test_matching_results_etag_and_not_modified(client, stub_backend):
+    session_id = upload_session(client)
+    try:
+        first = client.get('/api/matching_results', query_string={'session_id': session_id})
+        assert first.status_code == 200
+        etag = first.headers['ETag']
+        assert first.headers['Cache-Control'] == 'private, no-cache'
+
+        calls = dict(stub_backend.calls)
+        not_modified = client.get('/api/matching_results', query_string={'session_id': session_id}, headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304
+        assert not_modified.data == b''
+        assert not_modified.headers['ETag'] == etag
+
+        # POST でも ETag が一致すれば再生成しない
+        posted = client.post('/api/matching_results', json={'session_id': session_id}, headers={'If-None-Match': etag})
+        assert posted.status_code == 304
+        assert stub_backend.calls == calls
+
+        changed = client.get('/api/matching_results', query_string={'session_id': session_id}, headers={'If-None-Match': '"other"'})
+        assert changed.status_code == 200
+        assert changed.get_json()['results']['matching_score'] == first.get_json()['results']['matching_score']
+    finally:
+        client.post('/api/cleanup_session', json={'session_id': session_id})
+
+
+def test_matching_results_rejects_unknown_session(client):
+    response = client.get('/api/matching_results', query_string={'session_id': 'missing'})
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+"""
+セッションストアのテスト
+"""
+
+import os
+import time
+
+import pytest
+
+from session_store import MemorySessionStore, SqliteSessionStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make(ttl=60):
+        if request.param == 'memory':
+            return MemorySessionStore(ttl=ttl)
+        return SqliteSessionStore(str(tmp_path / 'sessions.db'), ttl=ttl)
+    return make
+
+
+def _upload(tmp_path):
+    filepath = tmp_path / 'upload.csv'
+    filepath.write_text("company_name\n", encoding='utf-8')
+    index_dir = tmp_path / 'upload.csv.index'
+    index_dir.mkdir()
+    (index_dir / 'meta.json').write_text("{}", encoding='utf-8')
+    return str(filepath), str(index_dir)
+
+
+def test_update_changes_only_given_fields(make_store):
+    store = make_store()
+    store.create('s1', {'company_a': {'company_name': 'A'}, 'analysis_results': None, 'matching_results': None})
+
+    # 同じセッションを取得した2つのリクエストが別々のフィールドを更新しても、互いの結果を上書きしない
+    first, second = store.get('s1'), store.get('s1')
+    assert store.update('s1', {'analysis_results': {'score': 1}})
+    assert store.update('s1', {'matching_results': {'score': 2}})
+
+    data = store.get('s1')
+    assert data['analysis_results'] == {'score': 1}
+    assert data['matching_results'] == {'score': 2}
+    assert data['company_a'] == {'company_name': 'A'}
+    assert first['analysis_results'] is None and second['matching_results'] is None
+    assert not store.update('missing', {'analysis_results': {}})
+
+
+def test_expired_session_removes_files_and_local_objects(make_store, tmp_path):
+    store = make_store(ttl=0.05)
+    filepath, index_dir = _upload(tmp_path)
+    store.create('s1', {'filepath': filepath}, files=[filepath, index_dir])
+    store.local('s1')['companies'] = object()
+
+    time.sleep(0.1)
+    assert store.purge_expired() == 1
+
+    assert store.get('s1') is None
+    assert not os.path.exists(filepath) and not os.path.exists(index_dir)
+    assert 'companies' not in store.local('s1')
+
+
+def test_sweeper_purges_without_access(make_store, tmp_path):
+    store = make_store(ttl=0.05)
+    filepath, index_dir = _upload(tmp_path)
+    store.create('s1', {'filepath': filepath}, files=[filepath, index_dir])
+
+    store.start_sweeper(interval=0.05)
+    try:
+        deadline = time.time() + 5
+        while os.path.exists(filepath) and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        store.stop_sweeper()
+
+    assert not os.path.exists(filepath) and not os.path.exists(index_dir)
+
+
+def test_sqlite_store_does_not_persist_local_objects(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SqliteSessionStore(path)
+    store.create('s1', {'company_b': {'company_name': 'B'}})
+    store.local('s1')['companies'] = object()
+
+    # 別のワーカー（別のストアインスタンス）からは保存したフィールドだけが見える
+    other = SqliteSessionStore(path)
+    assert other.get('s1') == {'company_b': {'company_name': 'B'}}
+    assert other.local('s1') == {}
+
+
+def test_local_objects_are_bounded():
+    store = MemorySessionStore(max_local_entries=2)
+    for session_id in ('s1', 's2', 's3'):
+        store.local(session_id)['context'] = session_id
+
+    assert store.local('s1') == {}
+    assert store.local('s3') == {'context': 's3'}
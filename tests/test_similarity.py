@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from company_store import CompanyStore
+from matching_algorithm import find_partner_pairs
+from similarity import all_pairs_top_k, normalize_rows
+from vector_codec import CompactVectors
+
+
+def _brute_force(vectors, k):
+    similarities = normalize_rows(vectors) @ normalize_rows(vectors).T
+    np.fill_diagonal(similarities, -np.inf)
+    indices = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+    return indices, np.take_along_axis(similarities, indices, axis=1)
+
+
+@pytest.mark.parametrize('memory_budget_mb', [0.001, 0.05, 256])
+def test_all_pairs_top_k_matches_brute_force(memory_budget_mb):
+    vectors = np.random.default_rng(0).standard_normal((97, 16)).astype(np.float32)
+    expected_indices, expected_scores = _brute_force(vectors, k=5)
+
+    indices, scores = all_pairs_top_k(vectors, k=5, memory_budget_mb=memory_budget_mb)
+
+    assert np.allclose(scores, expected_scores, atol=1e-5)
+    assert np.array_equal(indices, expected_indices)
+
+
+def test_all_pairs_top_k_marks_missing_partners():
+    vectors = np.random.default_rng(1).standard_normal((3, 8)).astype(np.float32)
+    indices, scores = all_pairs_top_k(vectors, k=5)
+    assert indices.shape == (3, 5)
+    assert (indices[:, 2:] == -1).all()
+    assert all(row not in indices[row, :2] for row in range(3))
+
+
+def test_all_pairs_top_k_accepts_compact_vectors():
+    vectors = normalize_rows(np.random.default_rng(2).standard_normal((50, 16)))
+    expected_indices, _ = _brute_force(vectors, k=1)
+    indices, _ = all_pairs_top_k(CompactVectors.encode(vectors, 'float16'), k=1, memory_budget_mb=0.01, normalized=True)
+    assert (indices == expected_indices).mean() > 0.95
+
+
+def test_find_partner_pairs_for_a_company_store(stub_backend):
+    companies = [{'company_name': f"企業{i}", 'industry': "製造業", 'business_description': f"部品{i}の製造"} for i in range(12)]
+    results = find_partner_pairs(CompanyStore.from_companies(companies), api_key='stub', top_k=3)
+    assert [result['company_name'] for result in results] == [company['company_name'] for company in companies]
+    for result in results:
+        assert len(result['partners']) == 3
+        assert result['company_name'] not in [partner['company_name'] for partner in result['partners']]
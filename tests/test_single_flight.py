@@ -0,0 +1,186 @@
+import time
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from conftest import API_KEY, COMPANY_A, COMPANY_B
+from jobs import JobQueue, CANCELLED, SUCCEEDED
+from model_backend import StubBackend, set_backend
+from single_flight import SingleFlight, get_single_flight
+
+
+def _start(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.start()
+    return thread
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "タイムアウトしました"
+        time.sleep(0.01)
+
+
+def test_concurrent_calls_are_executed_once():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait()
+        return 'value'
+
+    results = []
+    threads = [_start(lambda: results.append(flight.do('key', work))) for _ in range(4)]
+    _wait_for(lambda: flight.stats['executed'] + flight.stats['coalesced'] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(coalesced for _, coalesced in results) == [False, True, True, True]
+    assert all(value == 'value' for value, _ in results)
+    assert flight.stats == {'executed': 1, 'coalesced': 3}
+    assert flight.in_flight() == 0
+
+
+def test_error_is_shared_with_waiters():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    errors = []
+
+    def work():
+        release.wait()
+        raise RuntimeError("失敗")
+
+    def call():
+        try:
+            flight.do('key', work)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [_start(call) for _ in range(3)]
+    _wait_for(lambda: flight.stats['coalesced'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert flight.in_flight() == 0
+
+
+def test_claim_splits_led_and_waiting_keys():
+    flight = SingleFlight('test')
+    led, waiting = flight.claim(['a', 'b', 'a'])
+    assert led == ['a', 'b'] and waiting == {}
+
+    led2, waiting2 = flight.claim(['b', 'c'])
+    assert led2 == ['c'] and list(waiting2) == ['b']
+
+    flight.resolve('b', 'vector-b')
+    assert waiting2['b'].wait() == 'vector-b'
+    for key in ('a', 'c'):
+        flight.resolve(key, error=ValueError(key))
+    assert flight.in_flight() == 0
+
+
+def test_waiter_reruns_when_leader_is_cancelled():
+    flight = SingleFlight('test')
+    leader_started = threading.Event()
+    leader_cancel = threading.Event()
+    outcomes = {}
+
+    def leader_work():
+        leader_started.set()
+        leader_cancel.wait()
+        raise CancelledError()
+
+    def leader():
+        try:
+            flight.do('key', leader_work, cancel_event=leader_cancel)
+        except CancelledError:
+            outcomes['leader'] = 'cancelled'
+
+    def waiter():
+        outcomes['waiter'] = flight.do('key', lambda: 'fresh', cancel_event=threading.Event())
+
+    leader_thread = _start(leader)
+    leader_started.wait()
+    waiter_thread = _start(waiter)
+    _wait_for(lambda: flight.stats['coalesced'] == 1)
+
+    leader_cancel.set()
+    leader_thread.join()
+    waiter_thread.join(timeout=5)
+
+    assert outcomes['leader'] == 'cancelled'
+    # 取り消しを引き継がず、自身で実行し直す
+    assert outcomes['waiter'] == ('fresh', False)
+    assert flight.in_flight() == 0
+
+
+def test_waiter_can_cancel_its_own_wait():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    leader_thread = _start(lambda: flight.do('key', release.wait))
+    _wait_for(lambda: flight.in_flight() == 1)
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(CancelledError):
+        flight.do('key', lambda: 'unused', cancel_event=cancel_event)
+
+    release.set()
+    leader_thread.join()
+    assert flight.in_flight() == 0
+
+
+def test_cancelling_a_report_job_does_not_cancel_coalesced_jobs():
+    # ステージ境界で取り消しを確認できるように、スタブの応答を遅らせる
+    set_backend(StubBackend(dim=32, latency=0.05))
+    queue = JobQueue(max_workers=2)
+    try:
+        from matching_algorithm import generate_matching_report
+        first = queue.submit(generate_matching_report, COMPANY_A, COMPANY_B, api_key=API_KEY, kind='report')
+        _wait_for(lambda: queue.get(first).status != 'queued')
+        coalesced = get_single_flight('report').stats['coalesced']
+        second = queue.submit(generate_matching_report, COMPANY_A, COMPANY_B, api_key=API_KEY, kind='report')
+        # 2つ目のジョブが1つ目のレポート生成を待ち始めてから1つ目を取り消す
+        _wait_for(lambda: get_single_flight('report').stats['coalesced'] > coalesced)
+        assert queue.cancel(first)
+
+        _wait_for(lambda: queue.get(first).finished_at is not None and queue.get(second).finished_at is not None, timeout=30)
+        assert queue.get(first).status == CANCELLED
+        assert queue.get(second).status == SUCCEEDED
+        assert queue.get(second).result['matching_score'] is not None
+    finally:
+        queue.shutdown()
+        set_backend(None)
+
+
+def test_concurrent_identical_streams_run_the_pipeline_once():
+    from matching_algorithm import REPORT_SECTIONS, stream_matching_report
+    backend = StubBackend(dim=32, latency=0.05)
+    set_backend(backend)
+    try:
+        leader = stream_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY)
+        leader_events = [next(leader), next(leader)]
+        # 1つ目のストリームがパイプラインを実行している間に同じ企業ペアのストリームを開始する
+        follower_events = list(stream_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY))
+        leader_events.extend(leader)
+        calls = dict(backend.calls)
+
+        list(stream_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY))
+    finally:
+        set_backend(None)
+
+    leader_report = dict(leader_events)['report']
+    follower_report = dict(follower_events)['report']
+    assert [event for event, _ in follower_events] == ['companies', *REPORT_SECTIONS, 'report']
+    assert follower_report['metrics']['coalesced'] and not leader_report['metrics']['coalesced']
+    assert {section: follower_report[section] for section in REPORT_SECTIONS} == {section: leader_report[section] for section in REPORT_SECTIONS}
+    # 生成が終わった後のストリームは改めてパイプラインを実行する（レポートキャッシュは無効）
+    assert backend.calls['chat'] == 2 * calls['chat']
@@ -0,0 +1,71 @@
+"""
+レポートのセクションを Server-Sent Events で順に送るストリーミングのテスト
+"""
+
+import json
+import threading
+
+from conftest import API_KEY, COMPANY_A, COMPANY_B, upload_session
+from matching_algorithm import REPORT_SECTIONS, stream_matching_report
+from model_backend import StubBackend, set_backend
+
+
+def _parse_sse(body: str):
+    events = []
+    for message in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in message.split("\n"))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def test_sections_are_streamed_with_the_score_first(stub_backend):
+    events = list(stream_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY))
+    names = [event for event, _ in events]
+
+    assert names[0] == 'companies' and names[1] == 'matching_score' and names[-1] == 'report'
+    assert sorted(name for name in names if name in REPORT_SECTIONS) == sorted(REPORT_SECTIONS)
+    # マッチング詳細はトークンの断片を順に送り、完成した本文を最後に送る
+    deltas = [data for event, data in events if event == 'matching_details_delta']
+    details = dict(events)['matching_details']
+    assert len(deltas) > 1 and "".join(deltas).strip() == details
+    assert names.index('matching_details') > max(i for i, name in enumerate(names) if name == 'matching_details_delta')
+    report = dict(events)['report']
+    assert {section: report[section] for section in REPORT_SECTIONS} == {section: dict(events)[section] for section in REPORT_SECTIONS}
+
+
+def test_closing_the_stream_cancels_remaining_stages():
+    set_backend(StubBackend(dim=32, latency=0.05))
+    cancel_event = threading.Event()
+    try:
+        stream = stream_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, cancel_event=cancel_event)
+        assert [next(stream)[0] for _ in range(2)] == ['companies', 'matching_score']
+        stream.close()
+    finally:
+        set_backend(None)
+
+    assert cancel_event.is_set()
+
+
+def test_stream_endpoint_sends_server_sent_events(client):
+    session_id = upload_session(client)
+    try:
+        response = client.get('/api/matching_results/stream', query_string={'session_id': session_id})
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        assert response.headers['Cache-Control'] == 'no-cache'
+        events = _parse_sse(response.get_data(as_text=True))
+        assert [event for event, _ in events][:2] == ['companies', 'matching_score']
+        report = dict(events)['report']
+
+        # 完成したレポートはセッションに保存され、通常の結果取得でも返る
+        results = client.get('/api/matching_results', query_string={'session_id': session_id})
+        assert results.get_json()['results']['matching_score'] == report['matching_score']
+    finally:
+        client.post('/api/cleanup_session', json={'session_id': session_id})
+
+
+def test_stream_endpoint_rejects_unknown_session(client):
+    response = client.get('/api/matching_results/stream', query_string={'session_id': 'missing'})
+
+    assert response.status_code == 400
@@ -0,0 +1,71 @@
+"""
+構造化出力によるレポート生成（single モード）のテスト
+"""
+
+import httpx
+import openai
+import pytest
+
+import matching_algorithm
+from conftest import API_KEY, COMPANY_A, COMPANY_B
+from metrics import get_registry
+from model_backend import ChatResult, StubBackend, set_backend
+
+
+class _StructuredFailureBackend(StubBackend):
+    """構造化出力の要求だけを失敗させるスタブ"""
+
+    def __init__(self, failure):
+        super().__init__(dim=32)
+        self.failure = failure
+
+    def chat(self, model, messages, **params):
+        if (params.get('response_format') or {}).get('type') == 'json_schema':
+            self._simulate('chat')
+            if isinstance(self.failure, Exception):
+                raise self.failure
+            return ChatResult(self.failure)
+        return super().chat(model, messages, **params)
+
+
+def _fallbacks(reason):
+    return get_registry().fallbacks._values.get(('structured_report', reason), 0)
+
+
+def test_single_mode_generates_sections_in_one_call(stub_backend):
+    multi = matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='multi')
+    multi_calls = stub_backend.calls['chat']
+    single = matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='single')
+
+    # スコア算出の3回と構造化出力の1回
+    assert stub_backend.calls['chat'] - multi_calls == 4 < multi_calls
+    assert len(single['strategies']) == 4 and single['matching_details']
+    assert [case['title'] for case in single['past_cases']] == [case['title'] for case in multi['past_cases']]
+    assert single['metrics']['fallbacks'] == {}
+
+
+@pytest.mark.parametrize('failure, reason', [
+    ("JSONではない応答", 'invalid_response'),
+    ('{"strategies": [], "matching_details": ""}', 'invalid_response'),
+    (openai.BadRequestError("json_schema に対応していません。", response=httpx.Response(400, request=httpx.Request('POST', 'https://stub.invalid/chat')), body=None), 'api_error')
+])
+def test_invalid_response_or_api_error_falls_back_to_separate_calls(failure, reason):
+    set_backend(_StructuredFailureBackend(failure))
+    before = _fallbacks(reason)
+    try:
+        report = matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='single')
+    finally:
+        set_backend(None)
+
+    assert len(report['strategies']) == 4 and report['matching_details'] and report['past_cases']
+    assert report['metrics']['fallbacks'] == {'structured_report': reason}
+    assert _fallbacks(reason) == before + 1
+
+
+def test_programming_errors_are_not_hidden_by_the_fallback(stub_backend, monkeypatch):
+    def broken(data, include_cases):
+        raise KeyError('strategies')
+    monkeypatch.setattr(matching_algorithm, '_validate_structured_report', broken)
+
+    with pytest.raises(KeyError):
+        matching_algorithm.generate_matching_report(COMPANY_A, COMPANY_B, api_key=API_KEY, mode='single')
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from company_store import CompanyStore
+from similarity import normalize_rows
+from vector_codec import FORMATS, CompactVectors
+
+
+def _vectors(count=200, dim=64, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32))
+
+
+@pytest.mark.parametrize('vector_format', FORMATS)
+def test_quantized_scores_match_full_precision(vector_format):
+    vectors = _vectors()
+    queries = _vectors(count=3, seed=1)
+    compact = CompactVectors.encode(vectors, vector_format)
+
+    expected = vectors @ queries.T
+    assert np.abs(compact.scores(queries) - expected).max() < 0.02
+    assert np.abs(compact.scores(queries[0]) - expected[:, 0]).max() < 0.02
+    assert compact.top_k(queries[0], k=1)[0][0] == int(np.argmax(expected[:, 0]))
+
+
+def test_int8_is_a_quarter_of_float32():
+    vectors = _vectors()
+    assert CompactVectors.encode(vectors, 'int8').codes.nbytes * 4 == CompactVectors.encode(vectors, 'float32').codes.nbytes
+
+
+def test_reduced_dimensions_are_renormalized():
+    compact = CompactVectors.encode(_vectors(), 'float32', dim=16)
+    assert compact.dim == 16
+    assert np.allclose(np.linalg.norm(compact.decode(), axis=1), 1.0, atol=1e-5)
+
+
+def test_save_and_load(tmp_path):
+    compact = CompactVectors.encode(_vectors(), 'int8')
+    compact.save(str(tmp_path))
+    loaded = CompactVectors.load(str(tmp_path))
+    assert loaded.format == 'int8'
+    assert np.array_equal(loaded.decode(), compact.decode())
+
+
+def test_company_store_keeps_only_the_compact_form():
+    store = CompanyStore.from_companies([
+        {'company_name': f"企業{i}", 'industry': "製造業", 'business_description': "説明"} for i in range(10)
+    ], vector_format='int8')
+    vectors = _vectors(count=10)
+    store.set_embeddings(np.arange(5), vectors[:5])
+    store.set_embeddings(np.arange(5, 10), vectors[5:])
+
+    compact = store.compact_embeddings()
+    assert compact.codes.dtype == np.int8
+    assert np.shares_memory(compact.codes, store.compact_embeddings().codes)
+    assert len(store.missing_embedding_rows()) == 0
+    assert np.abs(store.embeddings - vectors).max() < 0.02
+    assert int(np.argmax(compact.scores(vectors[3]))) == 3
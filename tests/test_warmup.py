@@ -0,0 +1,74 @@
+"""
+起動時ウォームアップと readiness のテスト
+"""
+
+import os
+import sys
+import threading
+import subprocess
+
+import pytest
+
+import warmup
+from warmup import WarmupState, start_warmup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_steps_run_before_ready():
+    order = []
+    state = WarmupState()
+
+    warmup.warm_up(state, steps=[('first', lambda: order.append('first')), ('second', lambda: order.append('second'))])
+
+    assert order == ['first', 'second']
+    assert state.is_ready and set(state.to_dict()['steps']) == {'first', 'second'}
+
+
+def test_failed_step_is_reported_and_not_ready():
+    def fail():
+        raise RuntimeError("読み込み失敗")
+
+    state = WarmupState()
+    warmup.warm_up(state, steps=[('broken', fail), ('never', lambda: pytest.fail("実行されない"))])
+
+    assert state.ready.is_set() and not state.is_ready
+    assert state.to_dict()['error'] == "broken: 読み込み失敗"
+
+
+def test_empty_steps_are_ready_without_running_defaults(monkeypatch):
+    monkeypatch.setattr(warmup, 'WARMUP_STEPS', [('default', lambda: pytest.fail("既定のステップは実行しない"))])
+
+    state = start_warmup(steps=[])
+
+    assert state.ready.wait(5) and state.is_ready and state.steps == {}
+
+
+def test_readiness_flips_after_warm_up(client):
+    release = threading.Event()
+    warmup_state = client.application.extensions['warmup'] = start_warmup(steps=[('blocked', release.wait)])
+
+    not_ready = client.get('/readyz')
+    assert not_ready.status_code == 503 and not not_ready.get_json()['warmup']['ready']
+    assert client.get('/healthz').status_code == 200
+
+    release.set()
+    assert warmup_state.ready.wait(5)
+    ready = client.get('/readyz')
+    assert ready.status_code == 200 and 'blocked' in ready.get_json()['warmup']['steps']
+
+
+@pytest.mark.parametrize('module', ['app', 'run_server'])
+def test_server_modules_import_matching_lazily(module):
+    # ウォームアップを止めた状態で読み込み、リクエスト処理にだけ使う重いモジュールが読み込まれていないことを確認する
+    code = (
+        "import sys, warmup\n"
+        "warmup.start_warmup = lambda steps=None: warmup.WarmupState()\n"
+        f"import {module}\n"
+        "print('loaded:' + ','.join(name for name in ('matching_algorithm', 'openai', 'numpy') if name in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, 'MODEL_BACKEND': 'stub'}, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == 'loaded:'
@@ -0,0 +1,228 @@
+"""
+コンパクトな埋め込みベクトル表現モジュール
+ベクトルを正規化済みの float32 / float16 / int8（行ごとのスケール付き）で保持し、量子化したまま類似度を計算する
+
+精度の確認:
+    EMBEDDING_VECTOR_FORMAT=float32 python bulk_match.py companies.csv --partners --output partners.jsonl
+    python vector_codec.py cache/bulk/companies/vectors --dims 1536,512,256 --k 10
+
+埋め込みには bulk_match.py が保存した埋め込みのディレクトリ（cache/bulk/<企業台帳のファイル名>/vectors）か .npy ファイルを指定する。
+保存済みの形式を基準に計測するため、bulk_match.py は float32 で実行しておく。
+埋め込みを省略すると、クラスタ構造を持つ合成データで計測する。結果は JSON で出力する。
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from similarity import normalize_rows
+
+FORMATS = ('float32', 'float16', 'int8')
+
+# 既定の保持形式（EMBEDDING_VECTOR_FORMAT で変更可能）
+DEFAULT_FORMAT = os.environ.get('EMBEDDING_VECTOR_FORMAT', 'float32').lower()
+
+# ベクトル形式ごとの要素の型
+FORMAT_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+
+def truncate_dimensions(vectors, dim: Optional[int]) -> np.ndarray:
+    """先頭 dim 次元に切り詰めて正規化し直す関数（text-embedding-3 系のように次元削減に対応したモデル向け）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dim is None or dim >= vectors.shape[-1]:
+        return vectors
+    return normalize_rows(vectors.reshape(-1, vectors.shape[-1])[:, :dim]).reshape(vectors.shape[:-1] + (dim,))
+
+
+def quantize_int8(vectors) -> Tuple[np.ndarray, np.ndarray]:
+    """行ごとの最大絶対値で [-127, 127] に量子化し、(符号, 行ごとのスケール) を返す関数"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    max_abs = np.abs(vectors).max(axis=1)
+    max_abs[max_abs == 0] = 1.0
+    scales = (max_abs / 127.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+class CompactVectors:
+    """正規化済みベクトルの量子化表現
+
+    float16 はそのまま半精度で、int8 は行ごとの最大絶対値で [-127, 127] に量子化し、行ごとのスケールを保持する。
+    内積（コサイン類似度）は符号のまま計算し、最後にスケールを掛ける。
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray], vector_format: str):
+        self.codes = codes
+        self.scales = scales
+        self.format = vector_format
+
+    @classmethod
+    def encode(cls, vectors, vector_format: str = DEFAULT_FORMAT, dim: Optional[int] = None) -> 'CompactVectors':
+        """ベクトル行列を正規化（と次元削減）して指定の形式に変換する"""
+        if vector_format not in FORMATS:
+            raise ValueError(f"未対応のベクトル形式です: {vector_format}")
+        vectors = normalize_rows(truncate_dimensions(vectors, dim))
+        if vector_format == 'int8':
+            return cls(*quantize_int8(vectors), vector_format)
+        return cls(vectors.astype(FORMAT_DTYPES[vector_format], copy=False), None, vector_format)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.codes.shape
+
+    def __getitem__(self, rows) -> np.ndarray:
+        """指定した行（スライス）を float32 に復元して返す（similarity.all_pairs_top_k にタイル単位で渡せる）"""
+        return self.decode(rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def take(self, rows: Sequence[int]) -> 'CompactVectors':
+        """指定した行だけを取り出す（量子化したまま）"""
+        return CompactVectors(self.codes[rows], self.scales[rows] if self.scales is not None else None, self.format)
+
+    def decode(self, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        """float32 のベクトルに戻す"""
+        codes = self.codes if rows is None else self.codes[rows]
+        vectors = codes.astype(np.float32)
+        if self.scales is not None:
+            vectors *= (self.scales if rows is None else self.scales[rows])[:, None]
+        return vectors
+
+    def scores(self, query) -> np.ndarray:
+        """クエリベクトルと全行のコサイン類似度を返す（クエリは正規化して同じ次元に切り詰める）
+
+        query が行列（クエリ数×次元）の場合は、行数×クエリ数の類似度行列を返す。
+        float16 / int8 は float32 の行列に戻さずに計算する（int8 はクエリも量子化し、int32 で積和を取る）。
+        """
+        query = np.asarray(query, dtype=np.float32)
+        queries = normalize_rows(truncate_dimensions(query.reshape(-1, query.shape[-1]), self.dim))
+        if self.format == 'float32':
+            result = self.codes @ queries.T
+        elif self.format == 'float16':
+            result = np.einsum('ij,kj->ik', self.codes, queries, dtype=np.float32, casting='same_kind')
+        else:
+            query_codes, query_scales = quantize_int8(queries)
+            result = np.einsum('ij,kj->ik', self.codes, query_codes, dtype=np.int32).astype(np.float32)
+            result *= self.scales[:, None]
+            result *= query_scales[None, :]
+        return result[:, 0] if query.ndim == 1 else result
+
+    def top_k(self, query, k: int = 10):
+        """類似度の高い行IDと類似度を降順で返す"""
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return top, scores[top]
+
+    def save(self, directory: str):
+        """codes.npy（と scales.npy）として保存する"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'codes.npy'), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(directory, 'scales.npy'), self.scales)
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'format': self.format, 'dim': self.dim}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'CompactVectors':
+        """保存したベクトルを読み込む（mmap=True ではメモリマップする）"""
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        scales_path = os.path.join(directory, 'scales.npy')
+        scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        return cls(np.load(os.path.join(directory, 'codes.npy'), mmap_mode=mmap_mode), scales, meta['format'])
+
+
+def drift_report(vectors, queries, formats: Sequence[str] = FORMATS, dims: Sequence[Optional[int]] = (None,), k: int = 10) -> List[Dict[str, Any]]:
+    """各形式・次元について、完全精度（float32・元の次元）に対する上位 k 件の再現率と類似度の誤差を計測する関数"""
+    vectors = normalize_rows(vectors)
+    queries = normalize_rows(queries)
+    k = min(k, len(vectors))
+    reference = CompactVectors.encode(vectors, 'float32')
+    reference_scores = [reference.scores(query) for query in queries]
+    reference_top = [set(np.argpartition(-scores, k - 1)[:k].tolist()) for scores in reference_scores]
+
+    report = []
+    for dim in dims:
+        for vector_format in formats:
+            compact = CompactVectors.encode(vectors, vector_format, dim=dim)
+            recalls, errors = [], []
+            for query, scores, top in zip(queries, reference_scores, reference_top):
+                approx = compact.scores(query)
+                recalls.append(len(top & set(np.argpartition(-approx, k - 1)[:k].tolist())) / k)
+                errors.append(np.abs(approx - scores))
+            errors = np.concatenate(errors)
+            report.append({
+                'format': vector_format,
+                'dim': compact.dim,
+                'bytes_per_vector': compact.nbytes / len(compact),
+                'compression': round(reference.nbytes / compact.nbytes, 2),
+                f'recall_at_{k}': round(float(np.mean(recalls)), 4),
+                'score_drift_mean': round(float(errors.mean()), 6),
+                'score_drift_max': round(float(errors.max()), 6),
+                # マッチングスコアは類似度×100 の整数のため、0.01 以上の誤差でスコアが変わりうる
+                'score_changed_rate': round(float(np.mean(errors >= 0.01)), 4)
+            })
+    return report
+
+
+def _synthetic_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    """クラスタ構造を持つ合成の埋め込みを生成する関数"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量子化・次元削減による再現率と類似度の誤差のレポート")
+    parser.add_argument('embeddings', nargs='?', help="埋め込み行列（.npy）か CompactVectors の保存先ディレクトリ。省略時は合成データ")
+    parser.add_argument('--size', type=int, default=20000, help="合成データの件数")
+    parser.add_argument('--dim', type=int, default=1536, help="合成データの次元")
+    parser.add_argument('--queries', type=int, default=100, help="クエリとして使う件数")
+    parser.add_argument('--dims', default='', help="比較する次元（カンマ区切り、空で元の次元のみ）")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings is None:
+        vectors = _synthetic_vectors(args.size, args.dim, args.seed)
+    elif os.path.isdir(args.embeddings):
+        vectors = CompactVectors.load(args.embeddings).decode()
+    else:
+        vectors = np.load(args.embeddings)
+    rng = np.random.default_rng(args.seed)
+    queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    # クエリ自身が上位に入らないように少しずらす
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    dims = [int(dim) for dim in args.dims.split(',') if dim] or [None]
+
+    report = {
+        'source': args.embeddings or 'synthetic',
+        'vectors': int(len(vectors)),
+        'dim': int(vectors.shape[1]),
+        'results': drift_report(vectors, queries, dims=dims, k=args.k)
+    }
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+起動時ウォームアップモジュール
+リクエスト処理で使う重いモジュールの読み込みと、キャッシュ・インデックスのメモリマップをバックグラウンドで行い、
+完了したら準備完了（readiness）とする
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ウォームアップで事前に読み込む埋め込みモデル
+WARMUP_EMBEDDING_MODELS = ("text-embedding-ada-002",)
+
+
+class WarmupState:
+    """ウォームアップの進行状況"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps: Dict[str, float] = {}
+
+    @property
+    def is_ready(self) -> bool:
+        return self.ready.is_set() and self.error is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'ready': self.is_ready,
+            'finished': self.ready.is_set(),
+            'error': self.error,
+            'duration_seconds': round(self.finished_at - self.started_at, 3) if self.finished_at and self.started_at else None,
+            'steps': {name: round(seconds, 3) for name, seconds in self.steps.items()}
+        }
+
+
+def _import_matching():
+    import matching_algorithm  # noqa: F401  （openai・numpy を含む）
+
+
+def _preload_embedding_cache():
+    from embedding_cache import get_embedding_cache
+    from matching_algorithm import embedding_cache_model
+    cache = get_embedding_cache()
+    if cache is not None:
+        for model in WARMUP_EMBEDDING_MODELS:
+            # 読み出しと同じ（EMBEDDING_DIMENSIONS を含む）モデル名のシャードを読み込む
+            cache.preload(embedding_cache_model(model))
+
+
+def _preload_case_library():
+    from case_library import get_case_library
+    get_case_library()
+
+
+def _open_completion_cache():
+    from completion_cache import get_completion_cache
+    get_completion_cache()
+
+
+def _warm_numpy():
+    # BLAS の初期化を最初のリクエストで行わないように小さな行列積を実行する
+    from similarity import normalize_rows
+    matrix = normalize_rows([[1.0, 2.0], [3.0, 4.0]])
+    matrix @ matrix.T
+
+
+WARMUP_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ('matching_algorithm', _import_matching),
+    ('embedding_cache', _preload_embedding_cache),
+    ('case_library', _preload_case_library),
+    ('completion_cache', _open_completion_cache),
+    ('numpy', _warm_numpy)
+]
+
+
+def warm_up(state: WarmupState, steps: List[Tuple[str, Callable[[], None]]] = None):
+    """ウォームアップの各ステップを順に実行する（steps=[] ではステップを実行せずに準備完了とする）"""
+    state.started_at = time.perf_counter()
+    try:
+        for name, step in (WARMUP_STEPS if steps is None else steps):
+            start = time.perf_counter()
+            step()
+            state.steps[name] = time.perf_counter() - start
+    except Exception as e:
+        state.error = f"{name}: {str(e)}"
+        print(f"Warm-up failed: {state.error}")
+    finally:
+        state.finished_at = time.perf_counter()
+        state.ready.set()
+
+
+def start_warmup(steps: List[Tuple[str, Callable[[], None]]] = None) -> WarmupState:
+    """ウォームアップをバックグラウンドスレッドで開始し、進行状況を返す関数"""
+    state = WarmupState()
+    threading.Thread(target=warm_up, args=(state, steps), name='warmup', daemon=True).start()
+    return state